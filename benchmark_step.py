@@ -0,0 +1,135 @@
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import multiprocessing
+import time
+
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from solvers.registry import get_solver_class
+
+parser = argparse.ArgumentParser(description='Training step time and memory of solvers on synthetic batches')
+
+parser.add_argument('--configs', type=str, nargs='+', default=['DANN', 'MT', 'MT:teacher_dtype=bf16,shared_stages=2'],
+                    help='<model>[:<solver argument>=<value>,...]')
+parser.add_argument('--dataset', type=str, default='Office31')
+parser.add_argument('--source', type=str, default='Amazon')
+parser.add_argument('--target', type=str, default='Webcam')
+parser.add_argument('--cuda', type=str, default='cuda:0')
+parser.add_argument('--batch_size', type=int, default=36)
+parser.add_argument('--iters', type=int, default=10)
+parser.add_argument('--warmup_iters', type=int, default=2)
+
+
+def parse_config(config):
+    """'MT:teacher_dtype=bf16,shared_stages=2' -> ('MT', {'teacher_dtype': 'bf16', 'shared_stages': 2})"""
+    model, _, arg_string = config.partition(':')
+    solver_args = {}
+    for item in arg_string.split(','):
+        if item == '':
+            continue
+        name, value = item.split('=')
+        for cast in [int, float]:
+            try:
+                value = cast(value)
+                break
+            except ValueError:
+                pass
+        if value in ['True', 'False']:
+            value = value == 'True'
+        solver_args[name] = value
+    return model, solver_args
+
+
+def get_input_size(dataset_type, task):
+    if dataset_type == 'Digits':
+        return (3, 32, 32) if task == 'StoM' else (1, 28, 28)
+    return (3, 224, 224)
+
+
+def get_peak_memory(device):
+    """Peak allocated cuda memory, or peak resident set size of the process on cpu, in MB."""
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 1e6
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmHWM'):
+                return int(line.split()[1]) / 1e3
+    return 0.0
+
+
+def get_parameter_size(model):
+    params = {id(p): p for p in model.parameters()}.values()
+    total = sum(p.numel() * p.element_size() for p in params) / 1e6
+    trainable = sum(p.numel() * p.element_size() for p in params if p.requires_grad) / 1e6
+    return total, trainable
+
+
+def set_synthetic_dataloader(solver, batch_size, iters):
+    data_num = batch_size * iters
+    input_size = get_input_size(solver.dataset_type, solver.task)
+
+    source_data = TensorDataset(torch.randn(data_num, *input_size), torch.randint(solver.n_classes, (data_num,)))
+    target_data = TensorDataset(torch.randn(data_num, *input_size), torch.randint(solver.n_classes, (data_num,)),
+                                torch.arange(data_num))
+    solver.data_loader['source']['train'] = DataLoader(source_data, batch_size=batch_size, drop_last=True)
+    solver.data_loader['target']['train'] = DataLoader(target_data, batch_size=batch_size, drop_last=True)
+
+
+def benchmark_solver(model, solver_args, args):
+    """Run in a fresh process, so that the peak memory is the one of this solver only."""
+    solver = get_solver_class(model)(
+        dataset_type=args.dataset,
+        source_domain=args.source,
+        target_domain=args.target,
+        cuda=args.cuda,
+        batch_size=args.batch_size,
+        **solver_args
+    )
+    solver.set_task()
+    solver.set_model()
+    solver.set_optimizer()
+    solver.epoch = 0
+
+    total_size, trainable_size = get_parameter_size(solver.model)
+
+    # TODO 1 : warm up, e.g. allocator caches and cudnn algorithm search
+    with contextlib.redirect_stdout(io.StringIO()):
+        set_synthetic_dataloader(solver, args.batch_size, args.warmup_iters)
+        solver.train_one_epoch()
+
+    # TODO 2 : measure
+    set_synthetic_dataloader(solver, args.batch_size, args.iters)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if solver.device.type == 'cuda':
+            torch.cuda.synchronize(solver.device)
+        since = time.time()
+        solver.train_one_epoch()
+        if solver.device.type == 'cuda':
+            torch.cuda.synchronize(solver.device)
+        step_time = (time.time() - since) / args.iters
+
+    return total_size, trainable_size, step_time, get_peak_memory(solver.device)
+
+
+def main():
+    args = parser.parse_args()
+
+    rows = []
+    for config in args.configs:
+        model, solver_args = parse_config(config)
+        print('Benchmark {}'.format(config))
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            rows.append((config,) + executor.submit(benchmark_solver, model, solver_args, args).result())
+
+    print('\nDataset : {}, {} -> {}, batch size = {}\n'.format(args.dataset, args.source, args.target, args.batch_size))
+    print('{:<44} {:>10} {:>14} {:>14} {:>16}'.format('config', 'params(MB)', 'trainable(MB)', 'step(ms)',
+                                                      'peak memory(MB)'))
+    for row in rows:
+        print('{:<44} {:>10.1f} {:>14.1f} {:>14.1f} {:>16.1f}'.format(row[0], row[1], row[2], row[3] * 1000, row[4]))
+
+
+if __name__ == '__main__':
+    main()
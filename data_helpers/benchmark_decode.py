@@ -0,0 +1,33 @@
+import argparse
+import os
+import time
+
+from data_helpers.data_helper import load_Office
+
+parser = argparse.ArgumentParser(description='Images/sec of one data loading worker, full decode vs reduced JPEG decode')
+
+parser.add_argument('--dataset', type=str, default='Office31')
+parser.add_argument('--domain', type=str, default='Dslr')
+parser.add_argument('--data_dir', type=str, default='./data')
+parser.add_argument('--num_images', type=int, default=500)
+
+
+def benchmark(dataset, num_images):
+    num_images = min(num_images, len(dataset))
+    dataset[0]
+
+    since = time.time()
+    for i in range(num_images):
+        dataset[i]
+    return num_images / (time.time() - since)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    root_dir = os.path.join(args.data_dir, args.dataset)
+
+    for split in ['train', 'test']:
+        full = benchmark(load_Office(root_dir, args.domain, draft_decode=False)[split], args.num_images)
+        draft = benchmark(load_Office(root_dir, args.domain, draft_decode=True)[split], args.num_images)
+        print('{} {} {} : full decode {:.1f} images/s, reduced decode {:.1f} images/s, x{:.2f}'.format(
+            args.dataset, args.domain, split, full, draft, draft / full))
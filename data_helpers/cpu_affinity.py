@@ -0,0 +1,135 @@
+import argparse
+import glob
+import os
+import re
+
+import torch
+
+from data_helpers.data_loader import get_available_cpus, parse_cpus
+
+
+def format_cpus(cpus):
+    """[0, 1, 2, 3, 8, 10, 11] -> '0-3,8,10-11'"""
+    parts = []
+    for cpu in sorted(cpus):
+        if parts and cpu == parts[-1][1] + 1:
+            parts[-1][1] = cpu
+        else:
+            parts.append([cpu, cpu])
+    return ','.join(str(start) if start == end else '{}-{}'.format(start, end) for start, end in parts)
+
+
+def get_numa_nodes():
+    """NUMA node -> its cores available to this process, a single node where sysfs has none."""
+    available = set(get_available_cpus())
+    nodes = {}
+    for path in glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'):
+        node = int(re.search(r'node(\d+)', path).group(1))
+        with open(path, 'r') as f:
+            cpus = [cpu for cpu in parse_cpus(f.read()) if cpu in available]
+        if cpus:
+            nodes[node] = cpus
+    return dict(sorted(nodes.items())) or {0: sorted(available)}
+
+
+def partition_cpus(num_parts, cpus=None):
+    """
+    Split cores into num_parts groups of contiguous cores in NUMA node order, so a group only straddles two nodes
+    when the node sizes are not a multiple of the group size. Groups get one core at least.
+    """
+    node_of = {cpu: node for node, node_cpus in get_numa_nodes().items() for cpu in node_cpus}
+    cpus = sorted(cpus if cpus is not None else get_available_cpus(), key=lambda cpu: (node_of.get(cpu, 0), cpu))
+
+    if num_parts >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(num_parts)]
+
+    size, rest = divmod(len(cpus), num_parts)
+    parts, start = [], 0
+    for i in range(num_parts):
+        end = start + size + (1 if i < rest else 0)
+        parts.append(cpus[start:end])
+        start = end
+    return parts
+
+
+def parse_partition(partition):
+    """'i/n' -> (i, n) with 0 <= i < n"""
+    match = re.match(r'^\s*(\d+)\s*/\s*(\d+)\s*$', partition)
+    if match is None:
+        raise ValueError('Invalid cpu partition {!r}, expected i/n, e.g. 0/4'.format(partition))
+    index, num_parts = int(match.group(1)), int(match.group(2))
+    if not 0 <= index < num_parts:
+        raise ValueError('Invalid cpu partition {!r}, i/n needs 0 <= i < n'.format(partition))
+    return index, num_parts
+
+
+def get_process_cpus(cpus='', numa_nodes='', partition=''):
+    """
+    Cores of this process : the given cores, or the ones of the given NUMA nodes, or every available core,
+    then partition 'i/n' keeps the i-th of n groups of them.
+    """
+    available = get_available_cpus()
+    if cpus:
+        selected = [cpu for cpu in parse_cpus(cpus) if cpu in available]
+    elif numa_nodes:
+        nodes = get_numa_nodes()
+        selected = [cpu for node in parse_cpus(numa_nodes) for cpu in nodes.get(node, [])]
+    else:
+        selected = available
+
+    if partition:
+        index, num_parts = parse_partition(partition)
+        selected = partition_cpus(num_parts, selected)[index]
+
+    if not selected:
+        raise ValueError('No available core in cpus={} numa_nodes={} partition={}'.format(cpus, numa_nodes, partition))
+    return selected
+
+
+def set_num_threads(num_threads=0, num_interop_threads=0):
+    """Intra-op and inter-op thread counts of torch without touching the affinity, 0 keeps the current count."""
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError as e:
+            # only possible before the first inter-op parallel work of the process
+            print('Cannot set {} inter-op threads : {}'.format(num_interop_threads, e))
+
+
+def configure_cpus(cpus, num_workers=0, num_threads=0, num_interop_threads=0):
+    """
+    Pin this process to its cores. When there are more cores than DataLoader workers, the last num_workers cores
+    are kept for the workers and the intra-op threads get the others, so neither oversubscribes the other.
+    Returns the cores of the workers.
+    """
+    main_cpus, worker_cpus = cpus, cpus
+    if 0 < num_workers < len(cpus):
+        main_cpus, worker_cpus = cpus[:len(cpus) - num_workers], cpus[len(cpus) - num_workers:]
+
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, main_cpus)
+
+    set_num_threads(num_threads if num_threads > 0 else len(main_cpus), num_interop_threads)
+
+    print('Cores : {} ({} intra-op threads, {} inter-op threads), DataLoader workers : {}'.format(
+        format_cpus(main_cpus), torch.get_num_threads(), torch.get_num_interop_threads(),
+        format_cpus(worker_cpus) if num_workers > 0 else '-'))
+
+    return worker_cpus if num_workers > 0 else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Partition the cores of this host across concurrent main.py runs')
+    parser.add_argument('--num_procs', type=int, default=2)
+    parser.add_argument('--cpus', type=str, default='', help='cores to partition, default : every available core')
+    parser.add_argument('--numa_nodes', type=str, default='')
+    args = parser.parse_args()
+
+    print('NUMA nodes : ' + ', '.join('{} : {}'.format(node, format_cpus(node_cpus))
+                                      for node, node_cpus in get_numa_nodes().items()))
+    cpus = get_process_cpus(args.cpus, args.numa_nodes)
+    for i, part in enumerate(partition_cpus(args.num_procs, cpus)):
+        print("process {} : --cpus='{}'    # or --cpus='{}' --cpu_partition={}/{}".format(
+            i, format_cpus(part), format_cpus(cpus), i, args.num_procs))
@@ -1,49 +1,452 @@
+import copy
+import functools
+import io
 import os
+import random
+import tempfile
 
-import h5py
 import numpy as np
 import torch
+import torch.nn.functional as F
 from PIL import Image
 from torch.utils import data
 from torchvision import datasets
+from torchvision.datasets.folder import IMG_EXTENSIONS
 from torchvision import transforms
 
 
+# fixed-point precision of the resampling coefficients of PIL for 8-bit images
+PIL_PRECISION_BITS = 32 - 8 - 2
+
+
+def get_bilinear_weights(in_size, out_size):
+    """(out_size, in_size) fixed-point bilinear coefficients of PIL Image.resize, row i gives output pixel i."""
+    scale = in_size / out_size
+    support = max(scale, 1.0)
+    weights = torch.zeros(out_size, in_size, dtype=torch.int64)
+    for i in range(out_size):
+        center = (i + 0.5) * scale
+        x_min = max(int(center - support + 0.5), 0)
+        x_max = min(int(center + support + 0.5), in_size)
+        ks = [max(1.0 - abs((x - center + 0.5) / support), 0.0) for x in range(x_min, x_max)]
+        for x, k in zip(range(x_min, x_max), ks):
+            weights[i, x] = int(k / sum(ks) * (1 << PIL_PRECISION_BITS) + 0.5)
+    return weights
+
+
+def resize_bilinear_uint8(images, size):
+    """
+    Bilinear resize of a (N, C, H, W) uint8 batch with two integer matmuls, bit-exact with PIL's bilinear resize
+    of 8-bit images : same coefficients, horizontal pass then vertical pass, each rounded and clipped to 8 bits.
+    """
+    half = 1 << (PIL_PRECISION_BITS - 1)
+    weights_h = get_bilinear_weights(images.size(-2), size[0])
+    weights_w = get_bilinear_weights(images.size(-1), size[1])
+
+    x = images.long()
+    x = ((x @ weights_w.t() + half) >> PIL_PRECISION_BITS).clamp(0, 255)
+    x = ((weights_h @ x + half) >> PIL_PRECISION_BITS).clamp(0, 255)
+    return x.to(torch.uint8)
+
+
 class USPSDataset(data.Dataset):
-    def __init__(self, root_dir, train=True, transform=None):
+    """
+    USPS resized once as a whole : the 16x16 float rows are quantized to 8 bits and resized to
+    resize_size x resize_size exactly like the former ToPILImage / Resize(BILINEAR) / ToTensor chain, and
+    cached in root_dir/cache. Samples are views of the cached tensor, transform only gets tensors.
+    """
+
+    def __init__(self, root_dir, train=True, transform=None, resize_size=28, cache_dir=None):
         self.transform = transform
         self.root_dir = root_dir
-        with h5py.File(os.path.join(root_dir, 'usps.h5'), 'r') as hf:
-            if train:
-                d = hf.get('train')
-            else:
-                d = hf.get('test')
-
+        self.resize_size = resize_size
+
+        split = 'train' if train else 'test'
+        h5_path = os.path.join(root_dir, 'usps.h5')
+        h5_stat = os.stat(h5_path)
+        # keyed by the resize settings and the source file, a new usps.h5 invalidates the cache
+        cache_path = os.path.join(cache_dir or os.path.join(root_dir, 'cache'), 'usps_{}_{}x{}_bilinear_{}_{}.pt'.format(
+            split, resize_size, resize_size, h5_stat.st_size, int(h5_stat.st_mtime)))
+
+        if os.path.exists(cache_path):
+            cache = load_tensor_cache(cache_path)
+        else:
+            cache = self.build_cache(h5_path, split, resize_size)
+            try:
+                if not os.path.exists(os.path.dirname(cache_path)):
+                    os.makedirs(os.path.dirname(cache_path))
+                # concurrent runs building the same cache never read a partial file
+                write_atomic(cache_path, lambda f: torch.save(cache, f))
+            except OSError as e:
+                print('Cannot cache USPS in {} : {}'.format(cache_path, e))
+
+        # format:(7291, 1, resize_size, resize_size) float in [0, 1]
+        self.data = cache['data']
+        # format:(7291,)
+        self.targets = cache['labels']
+        self.labels = self.targets.numpy()
+
+    @staticmethod
+    def build_cache(h5_path, split, resize_size):
+        import h5py
+
+        with h5py.File(h5_path, 'r') as hf:
+            d = hf.get(split)
             # format:(7291, 256)
-            self.samples = d.get('data')[:]
-
+            samples = d.get('data')[:]
             # format:(7291,)
-            self.labels = d.get('target')[:]
+            labels = d.get('target')[:]
+
+        # ToPILImage truncates float images to 8 bits
+        images = torch.from_numpy((samples * 255).astype(np.uint8)).view(-1, 1, 16, 16)
+        images = resize_bilinear_uint8(images, (resize_size, resize_size))
+
+        return {'data': images.float().div(255), 'labels': torch.from_numpy(labels.astype(np.int64))}
 
     def __len__(self):
-        return len(self.labels)
+        return len(self.targets)
 
     def __getitem__(self, index):
-        img = self.samples[index]
-        img = img.reshape(16, 16)
-        img = img[:, :, np.newaxis]
+        img = self.data[index]
         if self.transform is not None:
             img = self.transform(img)
 
-        label = torch.tensor(self.labels[index], dtype=torch.long)
-        return [img, label]
+        return [img, self.targets[index]]
 
 
-def load_Office(root_dir, domain):
-    root_dir = os.path.join(root_dir, domain)
+def load_tensor_cache(path):
+    """torch.load, memory-mapped where torch supports it so the samples are read from the page cache."""
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except (TypeError, RuntimeError):
+        # torch < 2.1 has no mmap loading
+        return torch.load(path, map_location='cpu')
 
-    resize_size = [256, 256]
-    crop_size = 224
+
+class ImageListDataset(data.Dataset):
+    """Unlabeled images given as a directory (searched recursively) or a text file with one path per line."""
+
+    def __init__(self, root, transform=None, mode='RGB', skip_paths=None):
+        self.transform = transform
+        self.mode = mode
+
+        if os.path.isdir(root):
+            self.paths = sorted(
+                os.path.join(dir_path, file_name)
+                for dir_path, _, file_names in os.walk(root, followlinks=True)
+                for file_name in file_names
+                if file_name.lower().endswith(IMG_EXTENSIONS)
+            )
+        else:
+            with open(root, 'r') as f:
+                self.paths = [line.strip() for line in f if line.strip()]
+
+        if skip_paths:
+            self.paths = [path for path in self.paths if path not in skip_paths]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        with open(self.paths[index], 'rb') as f:
+            img = Image.open(f).convert(self.mode)
+
+        if self.transform is not None:
+            img = self.transform(img)
+
+        return [img, index]
+
+
+class IndexedDataset(data.Dataset):
+    """Wrap a labeled dataset so that every sample also returns its index."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        img, label = self.dataset[index]
+        return [img, label, index]
+
+
+def make_indexed_dataset(dataset):
+    """Dataset returning [img, label, index], sharded datasets return the index of their shard index."""
+    if isinstance(dataset, ShardedImageDataset):
+        dataset = copy.copy(dataset)
+        dataset.return_index = True
+        return dataset
+    return IndexedDataset(dataset)
+
+
+def write_atomic(path, write):
+    """
+    write(f) into a temporary file of the directory of path renamed onto path, so readers see either the old
+    file or the complete new one, and a failed write leaves no file behind.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def scan_image_folder(root_dir):
+    """Walk an ImageFolder tree in the same order as torchvision and stat every image and directory."""
+    classes = sorted(entry.name for entry in os.scandir(root_dir) if entry.is_dir())
+
+    paths, targets, sizes, mtimes = [], [], [], []
+    dirs, dir_mtimes = [root_dir], [os.stat(root_dir).st_mtime_ns]
+
+    for class_index, class_name in enumerate(classes):
+        for dir_path, _, file_names in sorted(os.walk(os.path.join(root_dir, class_name), followlinks=True)):
+            dirs.append(dir_path)
+            dir_mtimes.append(os.stat(dir_path).st_mtime_ns)
+
+            for file_name in sorted(file_names):
+                if not file_name.lower().endswith(IMG_EXTENSIONS):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                stat = os.stat(path)
+                paths.append(os.path.relpath(path, root_dir))
+                targets.append(class_index)
+                sizes.append(stat.st_size)
+                mtimes.append(stat.st_mtime_ns)
+
+    return {
+        'classes': np.array(classes, dtype=str),
+        'paths': np.array(paths, dtype=str),
+        'targets': np.array(targets, dtype=np.int32),
+        'sizes': np.array(sizes, dtype=np.int64),
+        'mtimes': np.array(mtimes, dtype=np.int64),
+        'dirs': np.array([os.path.relpath(d, root_dir) for d in dirs], dtype=str),
+        'dir_mtimes': np.array(dir_mtimes, dtype=np.int64),
+    }
+
+
+def load_image_manifest(root_dir, manifest_suffix='.manifest.npz'):
+    """
+    Sorted (path, class index, size, mtime) list of an ImageFolder tree, cached next to it in
+    root_dir + manifest_suffix. The cache is valid as long as no directory of the tree has a new mtime,
+    i.e. no file was added, removed or renamed, which costs one stat per directory instead of one per image.
+    The cache is kept out of the tree, writing it there would change the mtime of root_dir it just recorded.
+    """
+    manifest_path = os.path.normpath(root_dir) + manifest_suffix
+
+    if os.path.exists(manifest_path):
+        with np.load(manifest_path, allow_pickle=False) as f:
+            manifest = {key: f[key] for key in f.files}
+        try:
+            valid = all(
+                os.stat(os.path.join(root_dir, d)).st_mtime_ns == mtime
+                for d, mtime in zip(manifest['dirs'], manifest['dir_mtimes'])
+            )
+        except OSError:
+            valid = False
+        if valid:
+            return manifest
+
+    manifest = scan_image_folder(root_dir)
+    try:
+        write_atomic(manifest_path, lambda f: np.savez(f, **manifest))
+    except OSError as e:
+        print('Cannot save manifest in {} : {}'.format(manifest_path, e))
+
+    return manifest
+
+
+def decode_image(fp, min_size=256):
+    """
+    Decode an image as RGB. JPEGs are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that keeps
+    both sides at least min_size, which is all that Resize([min_size, min_size]) needs.
+    Other formats, or min_size=None, are decoded at full size.
+    """
+    img = Image.open(fp)
+    if min_size is not None and img.format == 'JPEG':
+        img.draft('RGB', (min_size, min_size))
+    return img.convert('RGB')
+
+
+def draft_loader(path, min_size=256):
+    with open(path, 'rb') as f:
+        return decode_image(f, min_size=min_size)
+
+
+class ManifestImageFolder(datasets.DatasetFolder):
+    """ImageFolder whose samples come from a manifest instead of a directory scan."""
+
+    def __init__(self, root, manifest, transform=None, loader=datasets.folder.default_loader):
+        datasets.VisionDataset.__init__(self, root, transform=transform)
+        self.loader = loader
+        self.extensions = IMG_EXTENSIONS
+
+        self.classes = manifest['classes'].tolist()
+        self.class_to_idx = {class_name: i for i, class_name in enumerate(self.classes)}
+        self.samples = [
+            (os.path.join(root, path), int(target))
+            for path, target in zip(manifest['paths'].tolist(), manifest['targets'].tolist())
+        ]
+        self.targets = [target for _, target in self.samples]
+        self.imgs = self.samples
+
+
+class ShardedImageDataset(data.IterableDataset):
+    """
+    Images packed by data_helpers/pack_shards.py into a few large tar shards, read sequentially.
+    Every DataLoader worker reads its own subset of the shards and, when shuffle is set,
+    the shard order changes every epoch and samples are shuffled within a buffer of encoded images.
+    With return_index, samples also return their position in the shard index, like IndexedDataset.
+    """
+
+    def __init__(self, shard_dir, transform=None, shuffle=False, buffer_size=1000, min_size=256, return_index=False):
+        self.shard_dir = shard_dir
+        self.min_size = min_size
+        self.transform = transform
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.return_index = return_index
+        self.epoch = 0
+
+        with np.load(os.path.join(shard_dir, 'index.npz'), allow_pickle=False) as index:
+            self.shards = index['shards'].tolist()
+            self.classes = index['classes'].tolist()
+            sample_shards = index['sample_shards']
+            offsets = index['offsets']
+            sizes = index['sizes']
+            self.targets = index['targets'].tolist()
+
+        self.shard_samples = []
+        for shard_id in range(len(self.shards)):
+            mask = sample_shards == shard_id
+            self.shard_samples.append(list(zip(
+                offsets[mask].tolist(),
+                sizes[mask].tolist(),
+                np.array(self.targets)[mask].tolist(),
+                np.nonzero(mask)[0].tolist()
+            )))
+
+    def __len__(self):
+        return len(self.targets)
+
+    def read_shard(self, shard_id):
+        # offsets are increasing, so the seeks only skip the tar headers of a large buffered read
+        with open(os.path.join(self.shard_dir, self.shards[shard_id]), 'rb', buffering=16 * 1024 * 1024) as f:
+            for offset, size, target, index in self.shard_samples[shard_id]:
+                f.seek(offset)
+                yield f.read(size), target, index
+
+    def shuffle_buffer(self, samples, rng):
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.buffer_size:
+                buffer.append(sample)
+                continue
+            i = rng.randint(0, len(buffer) - 1)
+            yield buffer[i]
+            buffer[i] = sample
+
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield sample
+
+    def __iter__(self):
+        # persistent workers keep their copy of the dataset, so the epoch changes the order between epochs
+        self.epoch += 1
+        worker_info = data.get_worker_info()
+        if worker_info is None:
+            worker_id, num_workers = 0, 1
+            seed = torch.empty((), dtype=torch.int64).random_().item()
+        else:
+            # every worker derives the same shard order from the seed of the DataLoader iterator
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+            seed = worker_info.seed - worker_info.id + self.epoch
+
+        shard_ids = list(range(len(self.shards)))
+        rng = random.Random(seed)
+        if self.shuffle:
+            rng.shuffle(shard_ids)
+
+        def samples():
+            for shard_id in shard_ids[worker_id::num_workers]:
+                for sample in self.read_shard(shard_id):
+                    yield sample
+
+        stream = samples()
+        if self.shuffle:
+            stream = self.shuffle_buffer(stream, random.Random(seed + worker_id + 1))
+
+        for raw, target, index in stream:
+            img = decode_image(io.BytesIO(raw), min_size=self.min_size)
+            if self.transform is not None:
+                img = self.transform(img)
+            if self.return_index:
+                yield img, target, index
+            else:
+                yield img, target
+
+
+class BatchRandomResizedCrop(torch.nn.Module):
+    """
+    RandomResizedCrop, RandomHorizontalFlip and Normalize of the Office train transform as batched tensor ops,
+    for uint8 (N, C, H, W) batches already on the training device. Every sample gets its own crop and flip.
+    """
+
+    def __init__(self, crop_size=224, scale=(0.08, 1.0), ratio=(3.0 / 4.0, 4.0 / 3.0),
+                 mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), tries=10):
+        super(BatchRandomResizedCrop, self).__init__()
+        self.crop_size = crop_size
+        self.scale = scale
+        self.log_ratio = (float(np.log(ratio[0])), float(np.log(ratio[1])))
+        self.tries = tries
+        self.register_buffer('mean', torch.tensor(mean).view(1, -1, 1, 1))
+        self.register_buffer('std', torch.tensor(std).view(1, -1, 1, 1))
+
+    def sample_boxes(self, N, H, W, device):
+        # draw `tries` candidates per sample and keep the first that fits, like torchvision does sequentially
+        area = H * W * torch.empty(N, self.tries, device=device).uniform_(*self.scale)
+        aspect = torch.exp(torch.empty(N, self.tries, device=device).uniform_(*self.log_ratio))
+        w = torch.sqrt(area * aspect).round()
+        h = torch.sqrt(area / aspect).round()
+
+        valid = (w > 0) & (w <= W) & (h > 0) & (h <= H)
+        first = torch.argmax(valid.int(), dim=1, keepdim=True)
+        w = torch.gather(w, 1, first).squeeze(1)
+        h = torch.gather(h, 1, first).squeeze(1)
+
+        # fallback of torchvision for a square image: the whole image
+        found = valid.any(dim=1)
+        w = torch.where(found, w, torch.full_like(w, W))
+        h = torch.where(found, h, torch.full_like(h, H))
+
+        i = torch.floor(torch.rand(N, device=device) * (H - h + 1))
+        j = torch.floor(torch.rand(N, device=device) * (W - w + 1))
+        return i, j, h, w
+
+    def forward(self, x):
+        N, C, H, W = x.size()
+        i, j, h, w = self.sample_boxes(N, H, W, x.device)
+        flip = torch.where(torch.rand(N, device=x.device) < 0.5, -1.0, 1.0)
+
+        # map output coordinates in [-1, 1] onto the crop box of every sample
+        theta = torch.zeros(N, 2, 3, device=x.device)
+        theta[:, 0, 0] = w / W * flip
+        theta[:, 0, 2] = (2 * j + w) / W - 1
+        theta[:, 1, 1] = h / H
+        theta[:, 1, 2] = (2 * i + h) / H - 1
+
+        grid = F.affine_grid(theta, [N, C, self.crop_size, self.crop_size], align_corners=False)
+        x = F.grid_sample(x.float(), grid, mode='bilinear', padding_mode='border', align_corners=False)
+
+        return (x / 255.0 - self.mean) / self.std
+
+
+def get_Office_transform(resize_size=(256, 256), crop_size=224, gpu_augment=False):
+    resize_size = list(resize_size)
 
     T = {
         'train': transforms.Compose([
@@ -61,14 +464,66 @@ def load_Office(root_dir, domain):
         ])
     }
 
+    # workers only decode and resize, BatchRandomResizedCrop does the rest on the training device
+    if gpu_augment:
+        T['train'] = transforms.Compose([
+            transforms.Resize(resize_size),
+            transforms.PILToTensor()
+        ])
+
+    return T
+
+
+def get_predict_transform(dataset_type, task):
+    """Test-time transform of the target domain, applied to decoded PIL images."""
+    if dataset_type in ['Office31', 'OfficeHome']:
+        return get_Office_transform()['test'], 'RGB'
+
+    if task == 'StoM':
+        # the same 28x28 digit padded to 32x32 as load_MNIST feeds the network in training
+        return transforms.Compose([
+            transforms.Resize([28, 28], interpolation=Image.BILINEAR),
+            transforms.Pad(padding=2, fill=0, padding_mode='constant'),
+            transforms.ToTensor()
+        ]), 'RGB'
+
+    return transforms.Compose([
+        transforms.Resize([28, 28], interpolation=Image.BILINEAR),
+        transforms.ToTensor()
+    ]), 'L'
+
+
+def load_Office(root_dir, domain, use_shards=False, draft_decode=True, gpu_augment=False):
+    resize_size = [256, 256]
+    T = get_Office_transform(resize_size=resize_size, gpu_augment=gpu_augment)
+
+    # JPEGs are decoded directly at the smallest scale that still covers the resize
+    min_size = max(resize_size) if draft_decode else None
+
+    if use_shards:
+        shard_dir = os.path.join(root_dir + '_shards', domain)
+        return {
+            'train': ShardedImageDataset(shard_dir=shard_dir, transform=T['train'], shuffle=True, min_size=min_size),
+            'test': ShardedImageDataset(shard_dir=shard_dir, transform=T['test'], shuffle=False, min_size=min_size)
+        }
+
+    root_dir = os.path.join(root_dir, domain)
+
+    # both datasets share one cached scan of the domain
+    manifest = load_image_manifest(root_dir)
+
     dataset = {
-        'train': datasets.ImageFolder(
+        'train': ManifestImageFolder(
             root=root_dir,
-            transform=T['train']
+            manifest=manifest,
+            transform=T['train'],
+            loader=functools.partial(draft_loader, min_size=min_size)
         ),
-        'test': datasets.ImageFolder(
+        'test': ManifestImageFolder(
             root=root_dir,
-            transform=T['test']
+            manifest=manifest,
+            transform=T['test'],
+            loader=functools.partial(draft_loader, min_size=min_size)
         )
     }
     return dataset
@@ -101,42 +556,17 @@ def load_SVHN(root_dir):
     return SVHN
 
 
-def load_USPS(root_dir):
-    T = {
-        'train': [
-            transforms.ToPILImage()
-        ],
-        'test': [
-            transforms.ToPILImage()
-        ]
-    }
-
-    T['train'].append(transforms.Resize([28, 28], interpolation=Image.BILINEAR))
-    T['test'].append(transforms.Resize([28, 28], interpolation=Image.BILINEAR))
-
-    T['train'].append(transforms.ToTensor())
-    T['test'].append(transforms.ToTensor())
-
-    # if Gray_to_RGB:
-    #     T['train'].append(transforms.Lambda(lambda x: x.expand([3, -1, -1])))
-    #     T['test'].append(transforms.Lambda(lambda x: x.expand([3, -1, -1])))
-
-    # T['train'].append(transforms.Normalize(mean=(0.25466308,), std=(0.35181096,)))
-    # T['test'].append(transforms.Normalize(mean=(0.26791447,), std=(0.3605367,)))
-
-    # T['train'].append(transforms.Normalize(mean=(0.5,), std=(0.5,)))
-    # T['test'].append(transforms.Normalize(mean=(0.5,), std=(0.5,)))
-
+def load_USPS(root_dir, resize_size=28):
     USPS = {
         'train': USPSDataset(
             root_dir=root_dir,
             train=True,
-            transform=transforms.Compose(T['train']),
+            resize_size=resize_size,
         ),
         'test': USPSDataset(
             root_dir=root_dir,
             train=False,
-            transform=transforms.Compose(T['test']),
+            resize_size=resize_size,
         ),
     }
     return USPS
@@ -174,41 +604,3 @@ def load_MNIST(root_dir, resize_size=28, Gray_to_RGB=False):
     }
     return MNIST
 
-
-def cal_mean_and_std():
-    transform = transforms.Compose([
-        transforms.ToTensor()
-    ])
-
-    dset = load_USPS(root_dir='./data/Digits/USPS')
-
-    # dset = load_MNIST(root_dir='./data/Digits/MNIST', Gray_to_RGB=True)
-    data_loader = torch.utils.data.DataLoader(
-        dset['test'],
-        batch_size=128,
-        shuffle=False,
-        num_workers=0
-    )
-
-    data_mean = []  # Mean of the dataset
-    data_std0 = []  # std of dataset
-    data_std1 = []  # std with ddof = 1
-    for i, data in enumerate(data_loader, 0):
-        # shape (batch_size, 3, height, width)
-        numpy_image = data[0].numpy()
-
-        # shape (3,)
-        batch_mean = np.mean(numpy_image, axis=(0, 2, 3))
-        batch_std0 = np.std(numpy_image, axis=(0, 2, 3))
-        batch_std1 = np.std(numpy_image, axis=(0, 2, 3), ddof=1)
-
-        data_mean.append(batch_mean)
-        data_std0.append(batch_std0)
-        data_std1.append(batch_std1)
-
-    # shape (num_iterations, 3) -> (mean across 0th axis) -> shape (3,)
-    data_mean = np.array(data_mean).mean(axis=0)
-    data_std0 = np.array(data_std0).mean(axis=0)
-    data_std1 = np.array(data_std1).mean(axis=0)
-
-    print(data_mean, data_std0, data_std1)
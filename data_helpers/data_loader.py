@@ -0,0 +1,131 @@
+import json
+import os
+import socket
+import time
+
+import torch
+from torch.utils.data import DataLoader, IterableDataset
+
+from data_helpers.data_helper import write_atomic
+
+
+def parse_cpus(cpus):
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    result = []
+    for part in cpus.split(','):
+        part = part.strip()
+        if part == '':
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            result += list(range(int(start), int(end) + 1))
+        else:
+            result.append(int(part))
+    return result
+
+
+def get_available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class WorkerAffinity(object):
+    """worker_init_fn pinning every DataLoader worker to the given cores."""
+
+    def __init__(self, cpus):
+        self.cpus = cpus
+
+    def __call__(self, worker_id):
+        if self.cpus and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.cpus)
+        # workers only decode, intra-op threads would oversubscribe the cores
+        torch.set_num_threads(1)
+
+
+def build_dataloader(dataset, batch_size, train=True, num_workers=2, pin_memory=False, persistent_workers=False,
+                     prefetch_factor=2, drop_last=False, worker_cpus=None, sampler=None):
+    """
+    DataLoader with the throughput settings of a solver. Train loaders shuffle map-style datasets
+    (sharded ones shuffle by themselves) and may drop the last incomplete batch, test loaders do neither.
+    A sampler replaces the shuffle.
+    """
+    use_workers = num_workers > 0
+    shuffle = train and sampler is None and not isinstance(dataset, IterableDataset)
+
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        sampler=sampler,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        drop_last=train and drop_last,
+        persistent_workers=use_workers and persistent_workers,
+        prefetch_factor=prefetch_factor if use_workers else None,
+        worker_init_fn=WorkerAffinity(worker_cpus) if use_workers else None,
+    )
+
+
+def measure_throughput(data_loader, seconds=3.0):
+    """Samples per second of a DataLoader, once its workers are up and have delivered a first batch."""
+    data_iter = iter(data_loader)
+    next(data_iter)
+
+    processed_num = 0
+    since = time.time()
+    for inputs in data_iter:
+        processed_num += len(inputs[0])
+        if time.time() - since >= seconds:
+            break
+
+    return processed_num / max(time.time() - since, 1e-8)
+
+
+def tune_num_workers(dataset, batch_size, key, seconds=3.0, candidates=None, cache_path='./data/loader_tuning.json',
+                     **loader_args):
+    """
+    Measure a few worker counts for `seconds` each and return the fastest.
+    The result is cached per host and key, so the measurement runs once per host.
+    """
+    host_key = '{}:{}'.format(socket.gethostname(), key)
+
+    cache = load_tuning_cache(cache_path)
+    if host_key in cache:
+        return cache[host_key]['num_workers']
+
+    if candidates is None:
+        n_cpus = len(get_available_cpus())
+        candidates = sorted(set([0] + [n for n in [1, 2, 4, 8, 12, 16, 24, 32] if n <= n_cpus]))
+
+    results = {}
+    for num_workers in candidates:
+        data_loader = build_dataloader(dataset, batch_size, train=True, num_workers=num_workers, **loader_args)
+        results[num_workers] = measure_throughput(data_loader, seconds)
+        print('num_workers = {:>2} : {:.1f} samples/s'.format(num_workers, results[num_workers]))
+        del data_loader
+
+    best = max(results, key=results.get)
+    print('Choose num_workers = {}'.format(best))
+
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    # the file is shared by the runs of the host, entries written by others during the measurement are kept
+    cache = load_tuning_cache(cache_path)
+    cache[host_key] = {'num_workers': best, 'throughput': {str(k): v for k, v in results.items()}}
+    write_atomic(cache_path, lambda f: f.write(json.dumps(cache, indent=2).encode()))
+
+    return best
+
+
+def load_tuning_cache(cache_path):
+    """host:key -> tuning result, empty when the file is missing or unreadable."""
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except ValueError as e:
+        print('Ignore the unreadable tuning cache {} : {}'.format(cache_path, e))
+        return {}
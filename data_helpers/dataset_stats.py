@@ -0,0 +1,183 @@
+import argparse
+import copy
+import hashlib
+import json
+import os
+
+import torch
+from torchvision import transforms
+
+from data_helpers.data_helper import load_MNIST, load_Office, load_SVHN, load_USPS, write_atomic
+
+parser = argparse.ArgumentParser(description='Exact per-channel mean / std of a dataset in one streaming pass')
+
+parser.add_argument('--dataset', type=str, default='Office31')
+parser.add_argument('--domain', type=str, default='Amazon')
+parser.add_argument('--split', type=str, default='train', choices=['train', 'test'])
+parser.add_argument('--data_dir', type=str, default='./data')
+parser.add_argument('--cache_dir', type=str, default='./data/stats')
+parser.add_argument('--batch_size', type=int, default=256)
+parser.add_argument('--num_workers', type=int, default=4)
+parser.add_argument('--bins', type=int, default=0, help='per-channel histogram bins over [0, 1], 0 disables')
+parser.add_argument('--refresh', action='store_true', default=False)
+
+
+class ChannelStats(object):
+    """
+    Per-channel count, mean and sum of squared deviations (M2), merged with the parallel
+    algorithm of Chan et al., so partial statistics of any batches or workers combine exactly.
+    """
+
+    def __init__(self, n_channels, bins=0):
+        self.count = 0
+        self.mean = torch.zeros(n_channels, dtype=torch.float64)
+        self.m2 = torch.zeros(n_channels, dtype=torch.float64)
+        self.bins = bins
+        self.hist = torch.zeros(n_channels, bins, dtype=torch.float64) if bins > 0 else None
+
+    @staticmethod
+    def from_batch(images, bins=0):
+        # images : (N, C, H, W)
+        x = images.transpose(0, 1).reshape(images.size(1), -1).to(torch.float64)
+
+        stats = ChannelStats(x.size(0), bins)
+        stats.count = x.size(1)
+        stats.mean = x.mean(dim=1)
+        stats.m2 = ((x - stats.mean[:, None]) ** 2).sum(dim=1)
+        if bins > 0:
+            stats.hist = torch.stack([torch.histc(c, bins=bins, min=0.0, max=1.0) for c in x])
+
+        return stats
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2, self.hist = other.count, other.mean, other.m2, other.hist
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        if self.hist is not None:
+            self.hist = self.hist + other.hist
+
+        return self
+
+    def std(self, ddof=0):
+        return (self.m2 / max(self.count - ddof, 1)).sqrt()
+
+
+class BatchStatsCollate(object):
+    """collate_fn that reduces every batch to its ChannelStats inside the DataLoader worker."""
+
+    def __init__(self, bins=0):
+        self.bins = bins
+
+    def __call__(self, samples):
+        return ChannelStats.from_batch(torch.stack([sample[0] for sample in samples]), self.bins)
+
+
+def is_stats_transform(t):
+    """Deterministic whole-image steps : no Normalize, the constants being computed, no random augmentation, no crop."""
+    return not isinstance(t, (transforms.Normalize, transforms.CenterCrop)) and not type(t).__name__.startswith('Random')
+
+
+def make_stats_dataset(dataset):
+    """
+    Copy of dataset whose transform only keeps the deterministic steps, e.g. Resize + ToTensor on Office,
+    so the statistics are the same on every run and cover the whole image.
+    """
+    dataset = copy.copy(dataset)
+    if isinstance(dataset.transform, transforms.Compose):
+        dataset.transform = transforms.Compose([t for t in dataset.transform.transforms if is_stats_transform(t)])
+    return dataset
+
+
+def compute_stats(dataset, batch_size=256, num_workers=4, bins=0):
+    """dataset is expected to come from make_stats_dataset."""
+    data_loader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        collate_fn=BatchStatsCollate(bins)
+    )
+
+    stats = None
+    for batch_stats in data_loader:
+        stats = batch_stats if stats is None else stats.merge(batch_stats)
+
+    return stats
+
+
+def load_dataset(dataset_type, domain, data_dir='./data'):
+    if dataset_type == 'Digits':
+        root_dir = os.path.join(data_dir, 'Digits', domain)
+        if domain == 'MNIST':
+            return load_MNIST(root_dir=root_dir)
+        if domain == 'USPS':
+            return load_USPS(root_dir=root_dir)
+        if domain == 'SVHN':
+            return load_SVHN(root_dir=root_dir)
+        raise ValueError('Unknown Digits domain {}'.format(domain))
+
+    return load_Office(os.path.join(data_dir, dataset_type), domain=domain)
+
+
+def get_dataset_stats(dataset_type, domain, split='train', data_dir='./data', cache_dir='./data/stats',
+                      batch_size=256, num_workers=4, bins=0, refresh=False):
+    """
+    Mean / std of a dataset split, cached in cache_dir/<dataset>_<domain>_<split>_<transform>.json where
+    <transform> is a digest of the transform the statistics are computed with.
+    """
+    dataset = make_stats_dataset(load_dataset(dataset_type, domain, data_dir)[split])
+    transform_key = hashlib.sha1(repr(dataset.transform).encode()).hexdigest()[:8]
+    path = os.path.join(cache_dir, '{}_{}_{}_{}.json'.format(dataset_type, domain, split, transform_key)
+                        .replace(' ', '_'))
+
+    if not refresh and os.path.exists(path):
+        with open(path, 'r') as f:
+            result = json.load(f)
+        if bins == 0 or len(result.get('hist', [[]])[0]) == bins:
+            return result
+
+    stats = compute_stats(dataset, batch_size=batch_size, num_workers=num_workers, bins=bins)
+
+    result = {
+        'count': stats.count,
+        'mean': stats.mean.tolist(),
+        'std': stats.std(ddof=0).tolist(),
+        'std_ddof1': stats.std(ddof=1).tolist(),
+        'transform': repr(dataset.transform),
+    }
+    if bins > 0:
+        result['hist'] = stats.hist.tolist()
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    write_atomic(path, lambda f: f.write(json.dumps(result).encode()))
+
+    return result
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    result = get_dataset_stats(
+        dataset_type=args.dataset,
+        domain=args.domain,
+        split=args.split,
+        data_dir=args.data_dir,
+        cache_dir=args.cache_dir,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        bins=args.bins,
+        refresh=args.refresh
+    )
+
+    print('{} {} {} : {} values per channel'.format(args.dataset, args.domain, args.split, result['count']))
+    print('transforms.Normalize(mean={}, std={})'.format(
+        [round(m, 8) for m in result['mean']], [round(s, 8) for s in result['std']]))
@@ -0,0 +1,91 @@
+import argparse
+import io
+import os
+import random
+import tarfile
+
+import numpy as np
+
+from data_helpers.data_helper import load_image_manifest
+
+parser = argparse.ArgumentParser(description='Pack an Office31 / OfficeHome domain into large tar shards')
+
+parser.add_argument('--dataset', type=str, default='Office31')
+parser.add_argument('--domain', type=str, default='Amazon')
+parser.add_argument('--data_dir', type=str, default='./data')
+parser.add_argument('--shard_size', type=int, default=64, help='MB per shard')
+parser.add_argument('--min_shards', type=int, default=8, help='at least one shard per DataLoader worker')
+parser.add_argument('--seed', type=int, default=0)
+
+
+def pack_shards(root_dir, shard_dir, shard_size=64, min_shards=8, seed=0):
+    """
+    Write the images of root_dir in a random order into shard-xxxxx.tar files of about shard_size MB,
+    with an index.npz holding the shard, data offset, size and class of every image.
+    Random order mixes the classes of every shard, so the shuffle buffer of a reader sees all of them.
+    """
+    manifest = load_image_manifest(root_dir)
+    paths = manifest['paths'].tolist()
+    targets = manifest['targets']
+    sizes = manifest['sizes']
+
+    order = list(range(len(paths)))
+    random.Random(seed).shuffle(order)
+
+    shard_bytes = min(shard_size * 1024 * 1024, max(int(sizes.sum()) // min_shards, 1))
+
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+
+    shards = []
+    sample_shards, offsets, sample_sizes, sample_targets = [], [], [], []
+    tar = None
+    written = 0
+
+    for i in order:
+        if tar is None or written >= shard_bytes:
+            if tar is not None:
+                tar.close()
+            shards.append('shard-{:05d}.tar'.format(len(shards)))
+            tar = tarfile.open(os.path.join(shard_dir, shards[-1]), 'w')
+            written = 0
+
+        with open(os.path.join(root_dir, paths[i]), 'rb') as f:
+            content = f.read()
+
+        info = tarfile.TarInfo(name='{:08d}_{}'.format(i, paths[i].replace(os.sep, '_')))
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+
+        sample_shards.append(len(shards) - 1)
+        # the data block of the member ends where the tar writer stands now, padded to 512 bytes
+        offsets.append(tar.offset - (len(content) + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE)
+        sample_sizes.append(len(content))
+        sample_targets.append(int(targets[i]))
+        written += len(content)
+
+    if tar is not None:
+        tar.close()
+
+    np.savez(
+        os.path.join(shard_dir, 'index.npz'),
+        shards=np.array(shards, dtype=str),
+        classes=manifest['classes'],
+        sample_shards=np.array(sample_shards, dtype=np.int32),
+        offsets=np.array(offsets, dtype=np.int64),
+        sizes=np.array(sample_sizes, dtype=np.int64),
+        targets=np.array(sample_targets, dtype=np.int64),
+    )
+
+    print('Pack {} images of {} into {} shards in {}'.format(len(order), root_dir, len(shards), shard_dir))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    pack_shards(
+        root_dir=os.path.join(args.data_dir, args.dataset, args.domain),
+        shard_dir=os.path.join(args.data_dir, args.dataset + '_shards', args.domain),
+        shard_size=args.shard_size,
+        min_shards=args.min_shards,
+        seed=args.seed
+    )
@@ -0,0 +1,88 @@
+import torch
+from torch.utils import data
+
+
+def get_dataset_labels(dataset):
+    """Class index of every sample, read from the dataset attributes without decoding any image."""
+    if hasattr(dataset, 'dataset'):
+        return get_dataset_labels(dataset.dataset)
+
+    # MNIST, ImageFolder and USPS : targets, SVHN : labels
+    for name in ['targets', 'labels']:
+        if hasattr(dataset, name):
+            return torch.as_tensor(getattr(dataset, name), dtype=torch.long).view(-1)
+
+    raise ValueError('Cannot find the labels of {}'.format(type(dataset).__name__))
+
+
+class StratifiedSampler(data.Sampler):
+    """
+    Draw a class uniformly, then a sample of that class uniformly, with replacement.
+    The per-class index tables are a single index array sorted by class and the start and size of every class,
+    so every draw is O(1) whatever the class sizes are.
+    """
+
+    def __init__(self, num_samples, labels=None, generator=None):
+        self.num_samples = num_samples
+        self.generator = generator
+        self.order = None
+        self.starts = None
+        self.counts = None
+        self.classes = None
+        if labels is not None:
+            self.set_labels(labels)
+
+    def set_labels(self, labels):
+        labels = torch.as_tensor(labels, dtype=torch.long).view(-1)
+        counts = torch.bincount(labels)
+
+        self.order = torch.argsort(labels, stable=True)
+        self.starts = torch.cumsum(counts, dim=0) - counts
+        self.counts = counts
+        # classes without any sample are never drawn
+        self.classes = torch.nonzero(counts, as_tuple=True)[0]
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        classes = self.classes[torch.randint(len(self.classes), (self.num_samples,), generator=self.generator)]
+        offsets = (torch.rand(self.num_samples, generator=self.generator) * self.counts[classes]).long()
+        return iter(self.order[self.starts[classes] + offsets].tolist())
+
+
+class ClassBalancedSampler(StratifiedSampler):
+    """Class-balanced batches of a labeled (source) dataset."""
+
+    def __init__(self, dataset, num_samples=None, generator=None):
+        labels = get_dataset_labels(dataset)
+        super(ClassBalancedSampler, self).__init__(
+            num_samples=len(labels) if num_samples is None else num_samples,
+            labels=labels,
+            generator=generator
+        )
+
+
+class PseudoLabelSampler(StratifiedSampler):
+    """
+    Target batches stratified by pseudo-labels of the current model, refreshed with update().
+    Until the first update the target samples are shuffled uniformly.
+    """
+
+    def __init__(self, dataset, num_samples=None, generator=None):
+        super(PseudoLabelSampler, self).__init__(
+            num_samples=len(dataset) if num_samples is None else num_samples,
+            generator=generator
+        )
+        self.data_num = len(dataset)
+
+    def update(self, pseudo_labels):
+        self.set_labels(pseudo_labels)
+
+    def __iter__(self):
+        if self.order is not None:
+            return super(PseudoLabelSampler, self).__iter__()
+
+        if self.num_samples <= self.data_num:
+            return iter(torch.randperm(self.data_num, generator=self.generator)[:self.num_samples].tolist())
+        return iter(torch.randint(self.data_num, (self.num_samples,), generator=self.generator).tolist())
@@ -0,0 +1,253 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+from data_helpers.data_helper import load_Office, write_atomic
+from data_helpers.data_loader import build_dataloader
+from networks.Alignment import multi_kernel_mmd
+from networks.Pretrained import load_pretrained_model
+from solvers.inference import load_trained_solver
+
+DOMAINS = {
+    'Office31': ['Amazon', 'Webcam', 'Dslr'],
+    'OfficeHome': ['Art', 'Clipart', 'Product', 'Real World'],
+}
+
+parser = argparse.ArgumentParser(description='Proxy A-distance and MMD between the domains of a dataset')
+
+parser.add_argument('--dataset', type=str, default='Office31')
+parser.add_argument('--domains', type=str, nargs='+', default=[],
+                    help='defaults to every domain of the dataset, Digits uses the two domains of the checkpoint task')
+parser.add_argument('--model', type=str, default='',
+                    help='solver of the trained checkpoint whose features are used, empty : ImageNet ResNet50')
+parser.add_argument('--checkpoint', type=str, default='')
+parser.add_argument('--source', type=str, default='Webcam', help='task of the checkpoint')
+parser.add_argument('--target', type=str, default='Dslr', help='task of the checkpoint')
+parser.add_argument('--cuda', type=str, default='cuda:0')
+parser.add_argument('--batch_size', type=int, default=128)
+parser.add_argument('--num_workers', type=int, default=4)
+parser.add_argument('--max_samples', type=int, default=2000, help='per domain for the MMD, 0 uses all')
+parser.add_argument('--cache_dir', type=str, default='./data/features')
+parser.add_argument('--output', type=str, default='', help='json file of the matrices')
+
+
+class ImageNetFeatures(nn.Module):
+    """2048-d average-pooled features of the ImageNet ResNet50."""
+
+    def __init__(self):
+        super(ImageNetFeatures, self).__init__()
+        resnet50 = load_pretrained_model('resnet50', pretrained=True)
+        resnet50.fc = nn.Identity()
+        self.resnet50 = resnet50
+
+    def forward(self, x):
+        return self.resnet50(x)
+
+
+class TrainedFeatures(nn.Module):
+    """Bottleneck features of the deployed classifier of a trained solver."""
+
+    def __init__(self, solver):
+        super(TrainedFeatures, self).__init__()
+        deploy_model = solver.get_deploy_model()
+        # MCD : Generator, other solvers : classifier
+        self.backbone = deploy_model.Generator if hasattr(deploy_model, 'Generator') else deploy_model.classifier
+
+    def forward(self, x):
+        return self.backbone(x, get_features=True, get_class_outputs=False)
+
+
+def extract_features(backbone, dataset, device, batch_size=128, num_workers=4):
+    data_loader = build_dataloader(dataset, batch_size, train=False, num_workers=num_workers,
+                                   pin_memory=device.type == 'cuda')
+    features, labels = [], []
+    processed_num = 0
+
+    with torch.no_grad():
+        for inputs, batch_labels in data_loader:
+            sys.stdout.write('\r{}/{}'.format(processed_num, len(dataset)))
+            sys.stdout.flush()
+
+            features.append(backbone(inputs.to(device, non_blocking=True)).float().cpu())
+            labels.append(batch_labels)
+            processed_num += batch_labels.size(0)
+    print()
+
+    return torch.cat(features), torch.cat(labels)
+
+
+def load_features(backbone, backbone_key, dataset, dataset_type, domain, device, cache_dir, batch_size, num_workers):
+    """
+    Features of the test split of a domain, cached in cache_dir/<dataset>/<backbone_key>/<domain>_<transform>.pt
+    where <transform> is a digest of the input transform, so other input settings never reuse the cache.
+    """
+    transform = repr(getattr(dataset, 'transform', None))
+    transform_key = hashlib.sha1(transform.encode()).hexdigest()[:8]
+    path = os.path.join(cache_dir, dataset_type, backbone_key, '{}_{}.pt'.format(domain.replace(' ', '_'),
+                                                                                 transform_key))
+    if os.path.exists(path):
+        cache = torch.load(path)
+        if cache['features'].size(0) == len(dataset) and cache.get('transform') == transform:
+            return cache['features'], cache['labels']
+
+    print('Extract {} {} features'.format(dataset_type, domain))
+    features, labels = extract_features(backbone, dataset, device, batch_size, num_workers)
+
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    cache = {'features': features, 'labels': labels, 'transform': transform}
+    # an interrupted extraction or a concurrent run never leaves a partial cache
+    write_atomic(path, lambda f: torch.save(cache, f))
+
+    return features, labels
+
+
+def proxy_a_distance(source_features, target_features, steps=100, weight_decay=1e-3):
+    """
+    Proxy A-distance 2 (1 - 2 err) of a linear domain classifier, trained with L-BFGS on one half of the
+    standardized features and tested on the other half.
+    """
+    x = torch.cat([source_features, target_features])
+    y = torch.cat([torch.zeros(source_features.size(0)), torch.ones(target_features.size(0))]).to(x.device)
+    x = (x - x.mean(dim=0)) / x.std(dim=0).clamp(min=1e-6)
+
+    permutation = torch.randperm(x.size(0), device=x.device)
+    train_ids, test_ids = permutation[:x.size(0) // 2], permutation[x.size(0) // 2:]
+
+    classifier = nn.Linear(x.size(1), 1).to(x.device)
+    optimizer = torch.optim.LBFGS(classifier.parameters(), max_iter=steps, line_search_fn='strong_wolfe')
+
+    def closure():
+        optimizer.zero_grad()
+        loss = nn.functional.binary_cross_entropy_with_logits(classifier(x[train_ids]).view(-1), y[train_ids])
+        loss = loss + weight_decay * classifier.weight.pow(2).sum()
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+
+    with torch.no_grad():
+        preds = (classifier(x[test_ids]).view(-1) > 0).float()
+        err = (preds != y[test_ids]).float().mean().item()
+
+    return 2 * (1 - 2 * min(err, 0.5))
+
+
+def subsample(features, labels, max_samples):
+    if max_samples <= 0 or features.size(0) <= max_samples:
+        return features, labels
+    ids = torch.randperm(features.size(0), device=features.device)[:max_samples]
+    return features[ids], labels[ids]
+
+
+def class_mmd(source_features, source_labels, target_features, target_labels, min_samples=2):
+    """Mean MMD between the source and target samples of every class present in both domains (true labels)."""
+    values = {}
+    for c in torch.unique(source_labels).tolist():
+        source_ids, target_ids = source_labels == c, target_labels == c
+        if source_ids.sum() >= min_samples and target_ids.sum() >= min_samples:
+            values[c] = multi_kernel_mmd(source_features[source_ids], target_features[target_ids])
+    mean = sum(values.values()) / len(values) if values else 0.0
+    return mean, values
+
+
+def print_matrix(name, domains, matrix):
+    print('\n{}'.format(name))
+    print('{:<12}'.format('') + ''.join('{:>12}'.format(d[:11]) for d in domains))
+    for source, row in zip(domains, matrix):
+        print('{:<12}'.format(source[:11]) + ''.join(
+            '{:>12}'.format('-' if value is None else '{:.4f}'.format(value)) for value in row))
+
+
+def main():
+    args = parser.parse_args()
+    device = torch.device(args.cuda if torch.cuda.is_available() else 'cpu')
+
+    # TODO 1 : backbone and datasets
+    if args.model == '':
+        if args.dataset == 'Digits':
+            raise ValueError('There is no ImageNet backbone for Digits, give a trained --model and --checkpoint')
+        backbone = ImageNetFeatures()
+        backbone_key = 'imagenet_resnet50'
+        domain_data = {}
+    else:
+        solver = load_trained_solver(
+            model=args.model,
+            dataset_type=args.dataset,
+            source_domain=args.source,
+            target_domain=args.target,
+            cuda=args.cuda,
+            checkpoint=args.checkpoint
+        )
+        backbone = TrainedFeatures(solver)
+        checkpoint = args.checkpoint or os.path.join(solver.models_checkpoints_dir, solver.model_name + '_best_test.pt')
+        backbone_key = '{}_{}_{}'.format(solver.task, os.path.splitext(os.path.basename(checkpoint))[0],
+                                         int(os.path.getmtime(checkpoint)))
+        domain_data = {}
+        if args.dataset == 'Digits':
+            # the inputs of a Digits network depend on its task, e.g. MNIST is RGB 32x32 for StoM
+            solver.load_dataset()
+            domain_data = {args.source: solver.source_data['test'], args.target: solver.target_data['test']}
+
+    backbone = backbone.to(device).eval()
+
+    domains = args.domains or list(domain_data.keys()) or DOMAINS[args.dataset]
+    for domain in domains:
+        if domain not in domain_data:
+            if args.dataset == 'Digits':
+                raise ValueError('Digits domains are the source and target of the checkpoint task')
+            domain_data[domain] = load_Office(os.path.join('./data', args.dataset), domain=domain)['test']
+
+    # TODO 2 : features, extracted once per domain and backbone
+    since = time.time()
+    features = {}
+    for domain in domains:
+        features[domain] = load_features(backbone, backbone_key, domain_data[domain], args.dataset, domain, device,
+                                         args.cache_dir, args.batch_size, args.num_workers)
+    print('Features ready in {:.1f}s'.format(time.time() - since))
+
+    # TODO 3 : discrepancies, symmetric so every unordered pair is computed once
+    since = time.time()
+    n = len(domains)
+    matrices = {name: [[None] * n for _ in range(n)] for name in ['proxy_a_distance', 'mmd', 'class_mmd']}
+    per_class = {}
+    for i, j in itertools.combinations(range(n), 2):
+        source_features, source_labels = [t.to(device) for t in features[domains[i]]]
+        target_features, target_labels = [t.to(device) for t in features[domains[j]]]
+
+        pad = proxy_a_distance(source_features, target_features)
+        mmd = multi_kernel_mmd(subsample(source_features, source_labels, args.max_samples)[0],
+                               subsample(target_features, target_labels, args.max_samples)[0])
+        mean_class_mmd, class_values = class_mmd(source_features, source_labels, target_features, target_labels)
+
+        for a, b in [(i, j), (j, i)]:
+            matrices['proxy_a_distance'][a][b] = pad
+            matrices['mmd'][a][b] = mmd
+            matrices['class_mmd'][a][b] = mean_class_mmd
+        per_class['{} - {}'.format(domains[i], domains[j])] = class_values
+
+        print('{} - {} : A-distance {:.4f}, MMD {:.4f}, class MMD {:.4f}'.format(
+            domains[i], domains[j], pad, mmd, mean_class_mmd))
+    print('Discrepancies of {} directions in {:.1f}s'.format(n * (n - 1), time.time() - since))
+
+    # TODO 4 : report
+    print_matrix('Proxy A-distance', domains, matrices['proxy_a_distance'])
+    print_matrix('Multi-kernel MMD^2', domains, matrices['mmd'])
+    print_matrix('Mean per-class MMD^2', domains, matrices['class_mmd'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'dataset': args.dataset, 'backbone': backbone_key, 'domains': domains,
+                       'matrices': matrices, 'per_class_mmd': per_class}, f, indent=2)
+        print('\nSave matrices in {} successfully'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
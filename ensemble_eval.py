@@ -0,0 +1,106 @@
+import argparse
+import os
+import sys
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from solvers.inference import load_trained_solver
+from solvers.registry import get_solver_class
+
+parser = argparse.ArgumentParser(description='Evaluate several checkpoints and their ensemble in one pass over the target test set')
+
+parser.add_argument('--dataset', type=str, default='Office31')
+parser.add_argument('--source', type=str, default='Webcam')
+parser.add_argument('--target', type=str, default='Dslr')
+parser.add_argument('--cuda', type=str, default='cuda:0')
+parser.add_argument('--models', type=str, nargs='+', default=['Baseline', 'DANN', 'MADA', 'MCD', 'MT'])
+parser.add_argument('--suffixes', type=str, nargs='+', default=['best_train', 'best_test'])
+parser.add_argument('--batch_size', type=int, default=128)
+parser.add_argument('--num_workers', type=int, default=4)
+
+
+def find_checkpoints(models_checkpoints_dir, models, suffixes):
+    checkpoints = []
+    for model in models:
+        for suffix in suffixes:
+            path = os.path.join(models_checkpoints_dir, '{}_{}.pt'.format(model, suffix))
+            if os.path.exists(path):
+                checkpoints.append((model, suffix, path))
+    return checkpoints
+
+
+def main():
+    args = parser.parse_args()
+
+    # TODO 1 : find and load every checkpoint of the task
+    task_solver = get_solver_class(args.models[0])(
+        dataset_type=args.dataset,
+        source_domain=args.source,
+        target_domain=args.target,
+        cuda=args.cuda,
+        test_mode=True
+    )
+    task_solver.load_dataset()
+
+    checkpoints = find_checkpoints(task_solver.models_checkpoints_dir, args.models, args.suffixes)
+    if len(checkpoints) == 0:
+        print('Cannot find any checkpoint in {}'.format(task_solver.models_checkpoints_dir))
+        return
+
+    solvers = []
+    for model, suffix, path in checkpoints:
+        solvers.append(load_trained_solver(
+            model=model,
+            dataset_type=args.dataset,
+            source_domain=args.source,
+            target_domain=args.target,
+            cuda=args.cuda,
+            checkpoint=path
+        ))
+
+    # TODO 2 : decode every batch once and feed it to all models
+    data_loader = DataLoader(
+        task_solver.target_data['test'],
+        batch_size=args.batch_size,
+        shuffle=False,
+        num_workers=args.num_workers,
+        pin_memory=task_solver.device.type == 'cuda'
+    )
+
+    corrects = [0] * len(solvers)
+    ensemble_corrects = 0
+    data_num = len(data_loader.dataset)
+    processed_num = 0
+    since = time.time()
+
+    for inputs, labels in data_loader:
+        sys.stdout.write('\r{}/{}'.format(processed_num, data_num))
+        sys.stdout.flush()
+
+        inputs = inputs.to(task_solver.device, non_blocking=True)
+        labels = labels.to(task_solver.device, non_blocking=True)
+
+        ensemble_probs = 0
+        for i, solver in enumerate(solvers):
+            probs = solver.predict(inputs)
+            corrects[i] += (torch.max(probs, 1)[1] == labels).sum().item()
+            ensemble_probs = ensemble_probs + probs
+
+        ensemble_corrects += (torch.max(ensemble_probs, 1)[1] == labels).sum().item()
+        processed_num += labels.size(0)
+
+    time_elapsed = time.time() - since
+
+    # TODO 3 : report
+    print('\nTask : {} {}, Data size = {}, {} models in {:.1f}s\n'.format(
+        args.dataset, task_solver.task, processed_num, len(solvers), time_elapsed))
+    print('{:<12} {:<12} {:>8}'.format('model', 'checkpoint', 'acc'))
+    for (model, suffix, _), correct in zip(checkpoints, corrects):
+        print('{:<12} {:<12} {:>8.4f}'.format(model, suffix, correct / processed_num))
+    print('{:<12} {:<12} {:>8.4f}'.format('Ensemble', 'mean prob', ensemble_corrects / processed_num))
+
+
+if __name__ == '__main__':
+    main()
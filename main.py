@@ -1,18 +1,14 @@
 import argparse
 import os
 
-from solvers.BaselineSolver import BaselineSolver
-from solvers.DANNSolver import DANNSolver
-from solvers.MADASolver import MADASolver
-from solvers.MCDSolver import MCDSolver
-from solvers.MTSolver import MTSolver
+from solvers.registry import SOLVERS, get_solver_args, get_solver_class
 
 print(os.getcwd())
 os.chdir(os.getcwd())
 
 parser = argparse.ArgumentParser(description='Hello')
 
-parser.add_argument('--model', type=str, default='DANN')
+parser.add_argument('--model', type=str, default='DANN', choices=list(SOLVERS.keys()))
 parser.add_argument('--dataset', type=str, default='Office31')
 parser.add_argument('--source', type=str, default='Webcam')
 parser.add_argument('--target', type=str, default='Dslr')
@@ -24,136 +20,118 @@ parser.add_argument('--pretrained', action='store_true', default=False)
 parser.add_argument('--if_test', action='store_true', default=False)
 parser.add_argument('--use_CT', action='store_true', default=False)
 parser.add_argument('--use_augment', action='store_true', default=False)
+parser.add_argument('--use_shards', action='store_true', default=False)
+parser.add_argument('--gpu_augment', action='store_true', default=False)
 
 parser.add_argument('--batch_size', type=int, default=36)
-parser.add_argument('--num_workers', type=int, default=2)
+parser.add_argument('--num_workers', type=int, default=2, help='-1 measures and picks the fastest for this host')
+parser.add_argument('--eval_batch_size', type=int, default=0, help='0 uses 4 * batch_size')
+parser.add_argument('--prefetch_factor', type=int, default=2)
+parser.add_argument('--no_pin_memory', action='store_true', default=False)
+parser.add_argument('--no_persistent_workers', action='store_true', default=False)
+parser.add_argument('--drop_last', action='store_true', default=False)
+parser.add_argument('--worker_cpus', type=str, default='', help='cores of the DataLoader workers, e.g. 0-7,16-23')
+parser.add_argument('--cpus', type=str, default='', help='cores of this run, e.g. 0-15')
+parser.add_argument('--numa_nodes', type=str, default='', help='NUMA nodes of this run, e.g. 1 or 0-1')
+parser.add_argument('--cpu_partition', type=str, default='', help='i/n : the i-th of n groups of the cores of this run')
+parser.add_argument('--num_threads', type=int, default=0, help='intra-op threads, 0 : the cores left by the workers')
+parser.add_argument('--num_interop_threads', type=int, default=0, help='0 keeps the torch default')
+parser.add_argument('--source_sampler', type=str, default='uniform', choices=['uniform', 'balanced'])
+parser.add_argument('--target_sampler', type=str, default='uniform', choices=['uniform', 'pseudo'])
+parser.add_argument('--pseudo_label_interval', type=int, default=500, help='iterations between pseudo-label refreshes')
+parser.add_argument('--pseudo_label_fraction', type=float, default=1.0, help='stalest fraction refreshed each time')
+parser.add_argument('--saturation_thresh', type=float, default=0.0, help='skip target samples this confident, 0 disables')
 parser.add_argument('--epochs', type=int, default=999999)
+parser.add_argument('--time_budget', type=float, default=0, help='seconds of training, 0 disables')
+parser.add_argument('--sample_budget', type=int, default=0, help='training samples per domain, 0 disables')
+parser.add_argument('--early_stop_patience', type=int, default=0, help='evaluations without improvement, 0 disables')
+parser.add_argument('--early_stop_metric', type=str, default='auto', choices=['auto', 'val', 'test'])
+parser.add_argument('--early_stop_smoothing', type=float, default=0.6, help='EMA factor of the early stopping metric')
+parser.add_argument('--early_stop_min_delta', type=float, default=0.001)
+parser.add_argument('--memory_interval', type=int, default=0, help='iterations between memory samples, 0 disables')
+parser.add_argument('--memory_growth_thresh', type=float, default=50.0, help='MB of RSS growth per 1k iterations')
 parser.add_argument('--iterations', type=int, default=999999)
 parser.add_argument('--test_interval', type=int, default=500)
 parser.add_argument('--lr', type=float, default=0.001)
 parser.add_argument('--gamma', type=float, default=10)
 parser.add_argument('--num_k', type=int, default=4)
 parser.add_argument('--loss_weight', type=float, default=1.0)
+parser.add_argument('--align_loss', type=str, default='mmd', choices=['mmd', 'coral', 'both'])
+parser.add_argument('--teacher_dtype', type=str, default='fp32', choices=['fp32', 'bf16', 'fp16'])
+parser.add_argument('--shared_stages', type=int, default=0, choices=[0, 1, 2, 3, 4],
+                    help='MT : frozen ResNet50 stages shared by student and teacher')
+parser.add_argument('--teacher', type=str, default='MADA')
+parser.add_argument('--teacher_checkpoint', type=str, default='')
+parser.add_argument('--student', type=str, default='ResNet18', choices=['ResNet18', 'MobileNetV2'],
+                    help='Distill on Office, the Digits student is always DigitsSmall')
+parser.add_argument('--temperature', type=float, default=4.0)
 
 args = parser.parse_args()
 
 
 def main():
-    solver = None
-
-    if args.model == 'Baseline':
-        solver = BaselineSolver(
-            dataset_type=args.dataset,
-            source_domain=args.source,
-            target_domain=args.target,
-            cuda=args.cuda,
-            pretrained=args.pretrained,
-            test_mode=args.test_mode,
-            batch_size=args.batch_size,
-            num_epochs=args.epochs,
-            test_interval=args.test_interval,
-            max_iter_num=args.iterations,
-            num_workers=args.num_workers,
-            lr=args.lr,
-            gamma=args.gamma,
-            optimizer_type=args.optimizer
-        )
-
-    if args.model == 'DANN':
-        solver = DANNSolver(
-            dataset_type=args.dataset,
-            source_domain=args.source,
-            target_domain=args.target,
-            cuda=args.cuda,
-            pretrained=args.pretrained,
-            test_mode=args.test_mode,
-            batch_size=args.batch_size,
-            num_epochs=args.epochs,
-            test_interval=args.test_interval,
-            max_iter_num=args.iterations,
-            num_workers=args.num_workers,
-            lr = args.lr,
-            gamma=args.gamma,
-            optimizer_type=args.optimizer,
-            use_augment=args.use_augment
-        )
-
-    if args.model == 'MT':
-        solver = MTSolver(
-            dataset_type=args.dataset,
-            source_domain=args.source,
-            target_domain=args.target,
-            cuda=args.cuda,
-            pretrained=args.pretrained,
-            test_mode=args.test_mode,
-            batch_size=args.batch_size,
-            num_epochs=args.epochs,
-            test_interval=args.test_interval,
-            max_iter_num=args.iterations,
-            num_workers=args.num_workers,
-            lr=args.lr,
-            gamma=args.gamma,
-            optimizer_type=args.optimizer,
-            use_CT=args.use_CT
-        )
-
-    if args.model == 'MCD':
-        solver = MCDSolver(
-            dataset_type=args.dataset,
-            source_domain=args.source,
-            target_domain=args.target,
-            cuda=args.cuda,
-            pretrained=args.pretrained,
-            test_mode=args.test_mode,
-            batch_size=args.batch_size,
-            num_epochs=args.epochs,
-            test_interval=args.test_interval,
-            max_iter_num=args.iterations,
-            num_workers=args.num_workers,
-            lr=args.lr,
-            gamma=args.gamma,
-            optimizer_type=args.optimizer,
-            num_k=args.num_k
-        )
-
-    if args.model == 'MCD2':
-        solver = MCD2Solver(
-            dataset_type=args.dataset,
-            source_domain=args.source,
-            target_domain=args.target,
-            cuda=args.cuda,
-            pretrained=args.pretrained,
-            test_mode=args.test_mode,
-            batch_size=args.batch_size,
-            num_epochs=args.epochs,
-            test_interval=args.test_interval,
-            max_iter_num=args.iterations,
-            num_workers=args.num_workers,
-            lr=args.lr,
-            gamma=args.gamma,
-            optimizer_type=args.optimizer,
-            num_k=args.num_k
-        )
-
-    if args.model == 'MADA':
-        solver = MADASolver(
-            dataset_type=args.dataset,
-            source_domain=args.source,
-            target_domain=args.target,
-            cuda=args.cuda,
-            pretrained=args.pretrained,
-            test_mode=args.test_mode,
-            batch_size=args.batch_size,
-            num_epochs=args.epochs,
-            test_interval=args.test_interval,
-            max_iter_num=args.iterations,
-            num_workers=args.num_workers,
-            lr=args.lr,
-            gamma=args.gamma,
-            optimizer_type=args.optimizer,
-            loss_weight=args.loss_weight
-        )
-
+    # solvers (and torch, torchvision, pandas behind them) are only imported once the arguments are valid
+    solver_class = get_solver_class(args.model)
+    from data_helpers.data_loader import parse_cpus
+
+    worker_cpus = parse_cpus(args.worker_cpus) if args.worker_cpus else None
+    # the process is only pinned when its cores are given, thread counts alone leave the affinity alone
+    if args.cpus or args.numa_nodes or args.cpu_partition:
+        from data_helpers.cpu_affinity import configure_cpus, get_process_cpus
+        try:
+            cpus = get_process_cpus(args.cpus, args.numa_nodes, args.cpu_partition)
+        except ValueError as e:
+            parser.error(str(e))
+        placed_worker_cpus = configure_cpus(cpus, max(args.num_workers, 0), args.num_threads,
+                                            args.num_interop_threads)
+        worker_cpus = worker_cpus or placed_worker_cpus
+    elif args.num_threads or args.num_interop_threads:
+        import torch
+        from data_helpers.cpu_affinity import set_num_threads
+        set_num_threads(args.num_threads, args.num_interop_threads)
+        print('Threads : {} intra-op, {} inter-op'.format(torch.get_num_threads(), torch.get_num_interop_threads()))
+
+    solver_args = dict(
+        dataset_type=args.dataset,
+        source_domain=args.source,
+        target_domain=args.target,
+        cuda=args.cuda,
+        pretrained=args.pretrained,
+        test_mode=args.test_mode,
+        batch_size=args.batch_size,
+        num_epochs=args.epochs,
+        test_interval=args.test_interval,
+        max_iter_num=args.iterations,
+        num_workers=args.num_workers,
+        lr=args.lr,
+        gamma=args.gamma,
+        optimizer_type=args.optimizer,
+        use_shards=args.use_shards,
+        gpu_augment=args.gpu_augment,
+        eval_batch_size=args.eval_batch_size,
+        pin_memory=False if args.no_pin_memory else None,
+        persistent_workers=not args.no_persistent_workers,
+        prefetch_factor=args.prefetch_factor,
+        drop_last=args.drop_last,
+        worker_cpus=worker_cpus,
+        source_sampler=args.source_sampler,
+        target_sampler=args.target_sampler,
+        pseudo_label_interval=args.pseudo_label_interval,
+        pseudo_label_fraction=args.pseudo_label_fraction,
+        saturation_thresh=args.saturation_thresh,
+        time_budget=args.time_budget,
+        sample_budget=args.sample_budget,
+        early_stop_patience=args.early_stop_patience,
+        early_stop_metric=args.early_stop_metric,
+        early_stop_smoothing=args.early_stop_smoothing,
+        early_stop_min_delta=args.early_stop_min_delta,
+        memory_interval=args.memory_interval,
+        memory_growth_thresh=args.memory_growth_thresh
+    )
+    for name in get_solver_args(args.model):
+        solver_args[name] = getattr(args, name)
+
+    solver = solver_class(**solver_args)
     solver.solve()
 
 
@@ -0,0 +1,75 @@
+import torch
+
+
+def linear_mmd(source_features, target_features, kernel_mults=(0.25, 0.5, 1.0, 2.0, 4.0)):
+    """
+    Linear-time estimate of the squared multi-kernel MMD (Gretton et al. 2012, Long et al. 2015) :
+    consecutive samples are paired, so the cost is O(N * D) instead of O(N^2 * D).
+    The gaussian bandwidths are kernel_mults times the mean squared distance of the pairs.
+    """
+    n = min(source_features.size(0), target_features.size(0)) // 2 * 2
+    if n == 0:
+        return source_features.sum() * 0
+
+    xs, ys = source_features[:n:2], source_features[1:n:2]
+    xt, yt = target_features[:n:2], target_features[1:n:2]
+
+    # (4, N/2) squared distances of the pairs : (s, s'), (t, t'), (s, t'), (s', t)
+    distances = torch.stack([
+        (xs - ys).pow(2).sum(dim=1),
+        (xt - yt).pow(2).sum(dim=1),
+        (xs - yt).pow(2).sum(dim=1),
+        (ys - xt).pow(2).sum(dim=1),
+    ])
+
+    bandwidth = distances.detach().mean().clamp(min=1e-8)
+    bandwidths = bandwidth * torch.tensor(kernel_mults, device=distances.device, dtype=distances.dtype)
+
+    # (K, 4, N/2) kernel values summed over the K bandwidths
+    kernels = torch.exp(-distances.unsqueeze(0) / bandwidths.view(-1, 1, 1)).sum(dim=0)
+
+    return (kernels[0] + kernels[1] - kernels[2] - kernels[3]).mean()
+
+
+def coral(source_features, target_features):
+    """CORAL loss (Sun & Saenko 2016) : squared Frobenius distance of the feature covariances / (4 D^2)."""
+    d = source_features.size(1)
+
+    def covariance(x):
+        x = x - x.mean(dim=0, keepdim=True)
+        return x.t() @ x / max(x.size(0) - 1, 1)
+
+    return (covariance(source_features) - covariance(target_features)).pow(2).sum() / (4 * d * d)
+
+
+def multi_kernel_mmd(x, y, kernel_mults=(0.25, 0.5, 1.0, 2.0, 4.0), block_size=512):
+    """
+    Unbiased quadratic-time estimate of the squared multi-kernel MMD, for analysis rather than training.
+    Kernel sums are accumulated over blocks of rows, so the memory is O(block_size * N) whatever N is.
+    The gaussian bandwidths are kernel_mults times the mean squared distance of a pooled subsample.
+    """
+    n, m = x.size(0), y.size(0)
+
+    z = torch.cat([x, y])
+    sub = z[torch.randperm(z.size(0), device=z.device)[:1000]]
+    bandwidth = torch.cdist(sub, sub).pow(2).mean().clamp(min=1e-8)
+    bandwidths = bandwidth * torch.tensor(kernel_mults, device=z.device, dtype=z.dtype)
+
+    def kernel_sum(a, b, exclude_diagonal=False):
+        # float64 accumulation, the estimate is a small difference of large sums
+        total = torch.zeros((), dtype=torch.float64, device=z.device)
+        for i in range(0, a.size(0), block_size):
+            distances = torch.cdist(a[i:i + block_size], b).pow(2)
+            kernels = torch.exp(-distances.unsqueeze(0) / bandwidths.view(-1, 1, 1))
+            if exclude_diagonal:
+                rows = torch.arange(kernels.size(1), device=z.device)
+                kernels[:, rows, rows + i] = 0
+            total += kernels.sum(dtype=torch.float64)
+        return total.item()
+
+    # the terms k(x_i, x_i) are left out of the unbiased estimate
+    kxx = kernel_sum(x, x, exclude_diagonal=True) / max(n * (n - 1), 1)
+    kyy = kernel_sum(y, y, exclude_diagonal=True) / max(m * (m - 1), 1)
+    kxy = kernel_sum(x, y) / (n * m)
+
+    return kxx + kyy - 2 * kxy
@@ -2,6 +2,8 @@ import torchvision
 import torch
 from torch import nn
 
+from networks.Pretrained import load_pretrained_model
+
 
 def init_weights(m):
     classname = m.__class__.__name__
@@ -18,7 +20,7 @@ def init_weights(m):
 
 def get_small_classifier(in_features_size, n_classes):
     small_classifier = nn.Sequential(
-        nn.Linear(in_features_size, n_classes),
+        nn.Linear(in_features_size, 256),
         nn.BatchNorm1d(256),
         nn.ReLU(),
         nn.Linear(256, n_classes),
@@ -181,6 +183,63 @@ class DigitsStoM(nn.Module):
         return parameters
 
 
+# Compact student for Digits, MNIST / USPS [1,28,28] or SVHN / MNIST [3,32,32], same interface as DigitsMU
+class DigitsSmall(nn.Module):
+    def __init__(self, n_classes, in_channels=1, use_dropout=False):
+        super(DigitsSmall, self).__init__()
+        self.n_classes = n_classes
+        self.use_dropout = use_dropout
+
+        self.normalization_layer = nn.BatchNorm2d(in_channels)
+
+        self.feature_extracter = nn.Sequential(
+            nn.Conv2d(in_channels, 16, (5, 5)),
+            nn.BatchNorm2d(16),
+            nn.ReLU(),
+            nn.MaxPool2d((2, 2)),
+            nn.Conv2d(16, 32, (3, 3)),
+            nn.BatchNorm2d(32),
+            nn.ReLU(),
+            nn.AdaptiveAvgPool2d((4, 4)),
+        )
+
+        if self.use_dropout:
+            self.feature_extracter.add_module(name='dropout', module=nn.Dropout(0.5))
+
+        self.features_output_size = 512
+
+        self.classifier = nn.Sequential(
+            nn.Linear(self.features_output_size, 64),
+            nn.ReLU(),
+            nn.Linear(64, n_classes),
+        )
+
+    def forward(self, x, get_features=False, get_class_outputs=True):
+        if get_features == False and get_class_outputs == False:
+            return None
+
+        x = self.normalization_layer(x)
+
+        features = self.feature_extracter(x)
+        features = features.view(-1, self.features_output_size)
+
+        if get_features == True and get_class_outputs == False:
+            return features
+
+        class_outputs = self.classifier(features)
+
+        if get_features:
+            return features, class_outputs
+        else:
+            return class_outputs
+
+    def get_parameters(self):
+        return [
+            {'params': self.feature_extracter.parameters(), 'lr_mult': 1, 'decay_mult': 1},
+            {'params': self.classifier.parameters(), 'lr_mult': 1, 'decay_mult': 1}
+        ]
+
+
 # ResNet for Office31 and OfficeHome
 class ResNet50(nn.Module):
     def __init__(self, bottleneck_dim=256, n_classes=1000, pretrained=True, use_dropout=False):
@@ -189,7 +248,7 @@ class ResNet50(nn.Module):
         self.pretrained = pretrained
         self.use_dropout = use_dropout
 
-        resnet50 = torchvision.models.resnet50(pretrained=pretrained)
+        resnet50 = load_pretrained_model('resnet50', pretrained=pretrained)
 
         # Extracter
         self.feature_extracter = nn.Sequential(
@@ -217,10 +276,14 @@ class ResNet50(nn.Module):
         )
         self.classifier.apply(init_weights)
 
-    def forward(self, x, get_features=False, get_class_outputs=True):
+    def forward(self, x, get_features=False, get_class_outputs=True, start=0):
+        # start > 0 : x is already the output of feature_extracter[:start], e.g. of a trunk shared with another model
         if get_features == False and get_class_outputs == False:
             return None
-        features = self.feature_extracter(x)
+        if start > 0:
+            features = self.feature_extracter[start:](x)
+        else:
+            features = self.feature_extracter(x)
         features = features.view(features.size(0), -1)
         features = self.bottleneck(features)
 
@@ -245,3 +308,65 @@ class ResNet50(nn.Module):
         ]
 
         return parameters
+
+
+# Compact students for Office31 and OfficeHome, same interface as ResNet50
+class ResNet18(ResNet50):
+    def __init__(self, bottleneck_dim=256, n_classes=1000, pretrained=True, use_dropout=False):
+        nn.Module.__init__(self)
+        self.n_classes = n_classes
+        self.pretrained = pretrained
+        self.use_dropout = use_dropout
+
+        resnet18 = load_pretrained_model('resnet18', pretrained=pretrained)
+
+        self.feature_extracter = nn.Sequential(
+            resnet18.conv1,
+            resnet18.bn1,
+            resnet18.relu,
+            resnet18.maxpool,
+            resnet18.layer1,
+            resnet18.layer2,
+            resnet18.layer3,
+            resnet18.layer4,
+            resnet18.avgpool,
+        )
+
+        self.bottleneck = nn.Linear(resnet18.fc.in_features, bottleneck_dim)
+        self.bottleneck.apply(init_weights)
+        self.features_output_size = bottleneck_dim
+
+        if use_dropout:
+            self.dropout = nn.Dropout(0.5)
+
+        self.classifier = nn.Sequential(
+            nn.Linear(self.features_output_size, n_classes)
+        )
+        self.classifier.apply(init_weights)
+
+
+class MobileNetV2(ResNet50):
+    def __init__(self, bottleneck_dim=256, n_classes=1000, pretrained=True, use_dropout=False):
+        nn.Module.__init__(self)
+        self.n_classes = n_classes
+        self.pretrained = pretrained
+        self.use_dropout = use_dropout
+
+        mobilenet_v2 = load_pretrained_model('mobilenet_v2', pretrained=pretrained)
+
+        self.feature_extracter = nn.Sequential(
+            mobilenet_v2.features,
+            nn.AdaptiveAvgPool2d((1, 1)),
+        )
+
+        self.bottleneck = nn.Linear(mobilenet_v2.last_channel, bottleneck_dim)
+        self.bottleneck.apply(init_weights)
+        self.features_output_size = bottleneck_dim
+
+        if use_dropout:
+            self.dropout = nn.Dropout(0.5)
+
+        self.classifier = nn.Sequential(
+            nn.Linear(self.features_output_size, n_classes)
+        )
+        self.classifier.apply(init_weights)
@@ -0,0 +1,26 @@
+from networks.Baseline import *
+
+
+# Plain x -> class probabilities modules of the trained classifiers, for export and deployment
+class SoftmaxClassifier(nn.Module):
+    def __init__(self, classifier):
+        super(SoftmaxClassifier, self).__init__()
+        self.classifier = classifier
+
+    def forward(self, x):
+        class_outputs = self.classifier(x, get_features=False, get_class_outputs=True)
+        return nn.functional.softmax(class_outputs, dim=1)
+
+
+class MCDClassifier(nn.Module):
+    def __init__(self, generator, classifier1, classifier2):
+        super(MCDClassifier, self).__init__()
+        self.Generator = generator
+        self.Classifier1 = classifier1
+        self.Classifier2 = classifier2
+
+    def forward(self, x):
+        features = self.Generator(x, get_features=True, get_class_outputs=False)
+        outputs1 = nn.functional.softmax(self.Classifier1(features), dim=1)
+        outputs2 = nn.functional.softmax(self.Classifier2(features), dim=1)
+        return (outputs1 + outputs2) / 2
@@ -1,12 +1,30 @@
+import contextlib
+
 from networks.Baseline import *
 
+TEACHER_DTYPES = {
+    'fp32': None,
+    'bf16': torch.bfloat16,
+    'fp16': torch.float16,
+}
+
 
 class MT(nn.Module):
-    def __init__(self, n_classes, base_model, pretrained=True):
+    """
+    Mean teacher. With teacher_dtype 'bf16' or 'fp16' the convolution and linear weights of the teacher are stored
+    in that dtype, which halves most of its parameter memory, and it runs in autocast. The BatchNorm layers keep
+    fp32 weights and statistics. A 0.001 EMA step is below the resolution of half precision, so the EMA of the
+    solver rounds the teacher weights stochastically. With shared_stages = k (ResNet50 only),
+    the stem and the first k ResNet stages are frozen and shared by student and teacher, and run once per batch.
+    """
+
+    def __init__(self, n_classes, base_model, pretrained=True, teacher_dtype='fp32', shared_stages=0):
         super(MT, self).__init__()
 
         self.n_classes = n_classes
         self.pretrained = pretrained
+        self.teacher_dtype = TEACHER_DTYPES[teacher_dtype]
+        self.trunk_size = 0
 
         if base_model == 'ResNet50':
             self.student = ResNet50(n_classes=n_classes, pretrained=pretrained, bottleneck_dim=2048,
@@ -14,6 +32,14 @@ class MT(nn.Module):
             self.teacher = ResNet50(n_classes=n_classes, pretrained=pretrained, bottleneck_dim=2048,
                                     use_dropout=True)
 
+            if shared_stages > 0:
+                # feature_extracter : conv1, bn1, relu, maxpool, layer1, ..., layer4, avgpool
+                self.trunk_size = 4 + shared_stages
+                for i in range(self.trunk_size):
+                    self.teacher.feature_extracter[i] = self.student.feature_extracter[i]
+                for param in self.student.feature_extracter[:self.trunk_size].parameters():
+                    param.requires_grad = False
+
         if base_model == 'DigitsStoM':
             self.student = DigitsStoM(n_classes=n_classes, use_dropout=True)
             self.teacher = DigitsStoM(n_classes=n_classes, use_dropout=True)
@@ -25,6 +51,31 @@ class MT(nn.Module):
         for param in self.teacher.parameters():
             param.requires_grad = False
 
+        if self.teacher_dtype is not None:
+            self.cast_teacher(self.teacher_dtype)
+
+    def cast_teacher(self, dtype):
+        """Store the weights of every teacher layer but BatchNorm in dtype, except the ones shared with the student."""
+        student_params = set(id(param) for param in self.student.parameters())
+        for module in self.teacher.modules():
+            if isinstance(module, nn.modules.batchnorm._BatchNorm):
+                continue
+            for param in module.parameters(recurse=False):
+                if id(param) not in student_params:
+                    param.data = param.data.to(dtype)
+
+    def train(self, mode=True):
+        super(MT, self).train(mode)
+        # the BatchNorm statistics of the frozen trunk stay the ImageNet ones
+        if self.trunk_size > 0:
+            self.student.feature_extracter[:self.trunk_size].eval()
+        return self
+
+    def teacher_autocast(self, device):
+        if self.teacher_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=device.type, dtype=self.teacher_dtype)
+
     def forward(self, source_x=None, target_x1=None, target_x2=None, test_mode=False, is_source=True):
         if test_mode:
             class_outputs = self.student(source_x, get_features=False, get_class_outputs=True)
@@ -34,9 +85,22 @@ class MT(nn.Module):
             source_y = self.student(source_x, get_features=False, get_class_outputs=True)
             return source_y
         else:
-            target_y1 = self.student(target_x1, get_features=False, get_class_outputs=True)
-            target_y2 = self.teacher(target_x1, get_features=False, get_class_outputs=True)
-            return target_y1, target_y2
+            x = target_x1
+            if self.trunk_size > 0:
+                with torch.no_grad():
+                    x = self.student.feature_extracter[:self.trunk_size](x)
+
+            target_y1 = self.forward_after_trunk(self.student, x)
+
+            # no graph is kept for the teacher, its activations are freed layer by layer
+            with torch.no_grad(), self.teacher_autocast(x.device):
+                target_y2 = self.forward_after_trunk(self.teacher, x)
+            return target_y1, target_y2.float()
+
+    def forward_after_trunk(self, model, x):
+        if self.trunk_size > 0:
+            return model(x, get_features=False, get_class_outputs=True, start=self.trunk_size)
+        return model(x, get_features=False, get_class_outputs=True)
 
     def get_parameters(self):
         return self.student.get_parameters()
@@ -0,0 +1,79 @@
+import argparse
+import inspect
+import os
+
+import torch
+import torchvision
+
+from data_helpers.data_helper import write_atomic
+
+# ImageNet weights converted once into plain state_dict files, see `python -m networks.Pretrained`
+PRETRAINED_DIR = os.environ.get('DA_PRETRAINED_DIR', './models_checkpoints/pretrained')
+
+
+def get_pretrained_path(arch):
+    return os.path.join(PRETRAINED_DIR, arch + '_imagenet.pt')
+
+
+def supports_mmap_loading():
+    """torch >= 2.1 : torch.load(mmap=True) and load_state_dict(assign=True)."""
+    return 'mmap' in inspect.signature(torch.load).parameters and \
+        'assign' in inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+
+def convert_pretrained_weights(arch):
+    """Save the torchvision ImageNet weights of arch into the local store (downloads them if needed)."""
+    if not os.path.exists(PRETRAINED_DIR):
+        os.makedirs(PRETRAINED_DIR)
+
+    model = getattr(torchvision.models, arch)(pretrained=True)
+    path = get_pretrained_path(arch)
+    state_dict = model.state_dict()
+    # concurrent runs filling the store never read a partial file
+    write_atomic(path, lambda f: torch.save(state_dict, f))
+    print('Save {} ImageNet weights in {} successfully'.format(arch, path))
+
+    return path
+
+
+def load_pretrained_model(arch, pretrained=True):
+    """
+    Build a torchvision model, taking the ImageNet weights from the local store when they are there.
+    The store file is memory-mapped and the weights are assigned without a copy, so every model built
+    from it, in this process or in other processes of the host, reads the same page cache pages until
+    it writes to them. Without a store file, torchvision downloads the weights and the store is filled.
+    """
+    build = getattr(torchvision.models, arch)
+
+    if not pretrained:
+        return build(pretrained=False)
+
+    path = get_pretrained_path(arch)
+    if not os.path.exists(path):
+        try:
+            convert_pretrained_weights(arch)
+        except OSError as e:
+            print('Cannot save {} ImageNet weights in the local store : {}'.format(arch, e))
+            return build(pretrained=True)
+
+    if supports_mmap_loading():
+        state_dict = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+        # parameters are created on the meta device so nothing is allocated or randomly initialized
+        with torch.device('meta'):
+            model = build(pretrained=False)
+        model.load_state_dict(state_dict, assign=True)
+    else:
+        # torch < 2.1 has neither mmap loading nor assign
+        model = build(pretrained=False)
+        model.load_state_dict(torch.load(path, map_location='cpu'))
+
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill the local ImageNet weight store')
+    parser.add_argument('--archs', type=str, nargs='+', default=['resnet50', 'resnet18', 'mobilenet_v2'])
+    args = parser.parse_args()
+
+    for arch in args.archs:
+        convert_pretrained_weights(arch)
@@ -0,0 +1,120 @@
+import argparse
+import csv
+import os
+import sys
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+from data_helpers.data_helper import ImageListDataset, get_predict_transform
+from solvers.inference import load_trained_solver
+
+parser = argparse.ArgumentParser(description='Predict classes of unlabeled target images with a trained model')
+
+parser.add_argument('--model', type=str, default='DANN')
+parser.add_argument('--dataset', type=str, default='Office31')
+parser.add_argument('--source', type=str, default='Webcam')
+parser.add_argument('--target', type=str, default='Dslr')
+parser.add_argument('--cuda', type=str, default='cuda:0')
+parser.add_argument('--checkpoint', type=str, default='',
+                    help='defaults to ./models_checkpoints/<dataset>/<task>/<model>_best_test.pt')
+
+parser.add_argument('--input', type=str, required=True, help='image directory or text file with one path per line')
+parser.add_argument('--output', type=str, default='predictions.csv')
+parser.add_argument('--save_probs', action='store_true', default=False)
+parser.add_argument('--no_resume', action='store_true', default=False)
+
+parser.add_argument('--batch_size', type=int, default=256)
+parser.add_argument('--num_workers', type=int, default=4)
+parser.add_argument('--prefetch_factor', type=int, default=4)
+parser.add_argument('--log_interval', type=int, default=20)
+
+args = parser.parse_args()
+
+
+def read_finished_paths(path):
+    if args.no_resume or not os.path.exists(path):
+        return set()
+
+    with open(path, 'r', newline='') as f:
+        return set(row['path'] for row in csv.DictReader(f))
+
+
+def main():
+    solver = load_trained_solver(
+        model=args.model,
+        dataset_type=args.dataset,
+        source_domain=args.source,
+        target_domain=args.target,
+        cuda=args.cuda,
+        checkpoint=args.checkpoint,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers
+    )
+
+    # rows are flushed after every batch, so an interrupted run resumes after the last written batch
+    finished_paths = read_finished_paths(args.output)
+
+    transform, mode = get_predict_transform(args.dataset, solver.task)
+    dataset = ImageListDataset(root=args.input, transform=transform, mode=mode, skip_paths=finished_paths)
+
+    print('Model : {}, Task : {}, Images to predict : {}, Already predicted : {}'.format(
+        solver.model_name, solver.task, len(dataset), len(finished_paths)))
+
+    if len(dataset) == 0:
+        return
+
+    data_loader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=False,
+        num_workers=args.num_workers,
+        pin_memory=solver.device.type == 'cuda',
+        prefetch_factor=args.prefetch_factor if args.num_workers > 0 else None,
+    )
+
+    header = ['path', 'pred', 'confidence']
+    if args.save_probs:
+        header += ['prob_{}'.format(i) for i in range(solver.n_classes)]
+
+    write_header = len(finished_paths) == 0
+    processed_num = 0
+    since = time.time()
+
+    with open(args.output, 'w' if write_header else 'a', newline='') as f:
+        writer = csv.writer(f)
+        if write_header:
+            writer.writerow(header)
+
+        for batch_id, (inputs, indices) in enumerate(data_loader):
+            inputs = inputs.to(solver.device, non_blocking=True)
+
+            probs = solver.predict(inputs)
+            confidences, preds = torch.max(probs, 1)
+
+            probs = probs.cpu().tolist()
+            confidences = confidences.cpu().tolist()
+            preds = preds.cpu().tolist()
+
+            for i, index in enumerate(indices.tolist()):
+                row = [dataset.paths[index], preds[i], '%.6f' % confidences[i]]
+                if args.save_probs:
+                    row += ['%.6f' % p for p in probs[i]]
+                writer.writerow(row)
+            f.flush()
+
+            processed_num += len(preds)
+            if (batch_id + 1) % args.log_interval == 0:
+                sys.stdout.write('\r{}/{} images, {:.1f} images/s'.format(
+                    processed_num, len(dataset), processed_num / (time.time() - since)))
+                sys.stdout.flush()
+
+    time_elapsed = time.time() - since
+    print('\nPredicted {} images in {:.1f}s, {:.1f} images/s'.format(
+        processed_num, time_elapsed, processed_num / max(time_elapsed, 1e-8)))
+    print('Save predictions in {} successfully'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import copy
+import io
+import os
+import sys
+import time
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import default_dynamic_qconfig, get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from torch.utils.data import DataLoader, IterableDataset
+
+from solvers.inference import load_trained_solver
+
+parser = argparse.ArgumentParser(description='Post-training int8 quantization of a trained model for CPU deployment')
+
+parser.add_argument('--model', type=str, default='DANN')
+parser.add_argument('--dataset', type=str, default='Office31')
+parser.add_argument('--source', type=str, default='Webcam')
+parser.add_argument('--target', type=str, default='Dslr')
+parser.add_argument('--checkpoint', type=str, default='')
+parser.add_argument('--output', type=str, default='',
+                    help='defaults to the checkpoint path with an _int8_<mode> suffix')
+
+parser.add_argument('--mode', type=str, default='static', choices=['dynamic', 'static'],
+                    help='dynamic : int8 Linear layers only, static : calibrated int8 convs and dynamic int8 Linear')
+parser.add_argument('--calibration_batches', type=int, default=10)
+parser.add_argument('--eval_batches', type=int, default=0, help='0 evaluates on the whole target test set')
+parser.add_argument('--batch_size', type=int, default=64)
+parser.add_argument('--num_workers', type=int, default=2)
+parser.add_argument('--benchmark_iters', type=int, default=20)
+
+
+def set_quantized_engine():
+    for engine in ['x86', 'fbgemm', 'qnnpack']:
+        if engine in torch.backends.quantized.supported_engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    return torch.backends.quantized.engine
+
+
+def quantize_dynamic_model(model):
+    return quantize_dynamic(copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static_model(model, data_loader, calibration_batches=10, engine='x86'):
+    qconfig_mapping = get_default_qconfig_mapping(engine).set_object_type(nn.Linear, default_dynamic_qconfig)
+
+    example_inputs, _ = next(iter(data_loader))
+    prepared_model = prepare_fx(copy.deepcopy(model).eval(), qconfig_mapping, example_inputs=(example_inputs,))
+
+    # TODO 1 : calibrate activation ranges on a sample of the target domain
+    with torch.no_grad():
+        for batch_id, (inputs, _) in enumerate(data_loader):
+            if batch_id >= calibration_batches:
+                break
+            sys.stdout.write('\rcalibrating {}/{}'.format(batch_id + 1, calibration_batches))
+            sys.stdout.flush()
+            prepared_model(inputs)
+    print()
+
+    return convert_fx(prepared_model)
+
+
+def evaluate(model, data_loader, max_batches=0):
+    corrects = 0
+    processed_num = 0
+
+    with torch.no_grad():
+        for batch_id, (inputs, labels) in enumerate(data_loader):
+            if 0 < max_batches <= batch_id:
+                break
+            _, preds = torch.max(model(inputs), 1)
+            corrects += (preds == labels).sum().item()
+            processed_num += labels.size(0)
+
+    return corrects / max(processed_num, 1)
+
+
+def benchmark(model, inputs, iters=20):
+    with torch.no_grad():
+        for _ in range(3):
+            model(inputs)
+
+        since = time.time()
+        for _ in range(iters):
+            model(inputs)
+        latency = (time.time() - since) / iters
+
+    return latency, inputs.size(0) / latency
+
+
+def get_size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 1e6
+
+
+def main():
+    args = parser.parse_args()
+    engine = set_quantized_engine()
+
+    # TODO 1 : load the fp32 model on cpu
+    solver = load_trained_solver(
+        model=args.model,
+        dataset_type=args.dataset,
+        source_domain=args.source,
+        target_domain=args.target,
+        cuda='cpu',
+        checkpoint=args.checkpoint,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers
+    )
+    solver.load_dataset()
+
+    fp32_model = solver.get_deploy_model().eval()
+
+    test_loader = DataLoader(
+        solver.target_data['test'],
+        batch_size=args.batch_size,
+        shuffle=False,
+        num_workers=args.num_workers
+    )
+    # calibrated on the target train images with the test transform, the test split is only used for evaluation
+    calibration_dataset = solver.get_target_eval_dataset()
+    calibration_loader = DataLoader(
+        calibration_dataset,
+        batch_size=args.batch_size,
+        shuffle=not isinstance(calibration_dataset, IterableDataset),
+        num_workers=args.num_workers,
+        generator=torch.Generator().manual_seed(0)
+    )
+
+    # TODO 2 : quantize
+    if args.mode == 'dynamic':
+        int8_model = quantize_dynamic_model(fp32_model)
+    else:
+        int8_model = quantize_static_model(fp32_model, calibration_loader, args.calibration_batches, engine)
+
+    # TODO 3 : compare accuracy, latency and size
+    fp32_acc = evaluate(fp32_model, test_loader, args.eval_batches)
+    int8_acc = evaluate(int8_model, test_loader, args.eval_batches)
+
+    inputs, _ = next(iter(test_loader))
+    results = {}
+    for name, model in [('fp32', fp32_model), ('int8', int8_model)]:
+        results[name] = {
+            'single': benchmark(model, inputs[:1], args.benchmark_iters),
+            'batch': benchmark(model, inputs, args.benchmark_iters),
+            'size': get_size_mb(model)
+        }
+
+    print('Engine : {}, Mode : {}, Threads : {}'.format(engine, args.mode, torch.get_num_threads()))
+    print('Acc fp32 : {:.4f} int8 : {:.4f} delta : {:+.4f}'.format(fp32_acc, int8_acc, int8_acc - fp32_acc))
+    for name in ['fp32', 'int8']:
+        print('{} : size {:.1f}MB, latency(bs=1) {:.2f}ms, latency(bs={}) {:.2f}ms, throughput {:.1f} images/s'.format(
+            name, results[name]['size'], results[name]['single'][0] * 1000, inputs.size(0),
+            results[name]['batch'][0] * 1000, results[name]['batch'][1]))
+    print('Speedup : latency(bs=1) x{:.2f}, throughput x{:.2f}'.format(
+        results['fp32']['single'][0] / results['int8']['single'][0],
+        results['int8']['batch'][1] / results['fp32']['batch'][1]))
+
+    # TODO 4 : export as TorchScript, which loads without the networks package
+    output = args.output
+    if output == '':
+        checkpoint = args.checkpoint
+        if checkpoint == '':
+            checkpoint = os.path.join(solver.models_checkpoints_dir, solver.model_name + '_best_test.pt')
+        output = os.path.splitext(checkpoint)[0] + '_int8_' + args.mode + '.pt'
+
+    with torch.no_grad():
+        torch.jit.save(torch.jit.trace(int8_model, inputs[:1]), output)
+    print('Save int8 model in {} successfully'.format(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+from data_helpers.cpu_affinity import configure_cpus, partition_cpus
+from solvers.registry import get_solver_args, get_solver_class
+
+parser = argparse.ArgumentParser(description='Asynchronous successive halving (ASHA) over the arguments of a solver')
+
+parser.add_argument('--model', type=str, default='DANN')
+parser.add_argument('--dataset', type=str, default='Office31')
+parser.add_argument('--source', type=str, default='Amazon')
+parser.add_argument('--target', type=str, default='Webcam')
+parser.add_argument('--optimizer', type=str, default='SGD')
+parser.add_argument('--cuda', type=str, nargs='+', default=['cuda:0'], help='trials are spread over these devices')
+parser.add_argument('--space', type=str, nargs='*', default=[],
+                    help='<argument>=<value>,<value>,... or <argument>=log:<low>:<high>, default : lr, gamma, '
+                         'batch_size and loss_weight / num_k when the solver has them')
+parser.add_argument('--num_trials', type=int, default=27)
+parser.add_argument('--min_iters', type=int, default=400, help='iterations of a trial in the first rung')
+parser.add_argument('--max_iters', type=int, default=10004, help='iterations of a trial in the last rung')
+parser.add_argument('--eta', type=int, default=3, help='the top 1 / eta of a rung is promoted to the next one')
+parser.add_argument('--num_procs', type=int, default=1, help='trials run at the same time')
+parser.add_argument('--num_workers', type=int, default=2)
+parser.add_argument('--pin_cpus', action='store_true', default=False,
+                    help='give every running trial its own group of cores (and NUMA node when possible)')
+parser.add_argument('--metric', type=str, default='auto', choices=['auto', 'val', 'test'],
+                    help='auto : val (source test split) for Digits, test otherwise')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--output', type=str, default='', help='default : ./logs/<dataset>/<task>/search_<model>')
+
+DEFAULT_SPACE = {
+    'lr': 'log:0.0003:0.003',
+    'gamma': '5,10,20',
+    'batch_size': '32,36,48',
+    'loss_weight': '0.3,1.0,3.0',
+    'num_k': '2,4,6',
+}
+
+
+def parse_value(value):
+    for cast in [int, float]:
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    if value in ['True', 'False']:
+        return value == 'True'
+    return value
+
+
+def parse_space(items, solver_args):
+    """['lr=log:1e-4:1e-2', 'gamma=5,10'] -> {'lr': ('log', 0.0001, 0.01), 'gamma': [5, 10]}"""
+    if not items:
+        items = ['{}={}'.format(name, value) for name, value in DEFAULT_SPACE.items()
+                 if name in ['lr', 'gamma', 'batch_size'] or name in solver_args]
+
+    space = {}
+    for item in items:
+        name, value = item.split('=')
+        if value.startswith('log:'):
+            _, low, high = value.split(':')
+            space[name] = ('log', float(low), float(high))
+        else:
+            space[name] = [parse_value(v) for v in value.split(',')]
+    return space
+
+
+def sample_config(space, rng):
+    config = {}
+    for name, values in space.items():
+        if isinstance(values, tuple):
+            config[name] = float('{:.3g}'.format(math.exp(rng.uniform(math.log(values[1]), math.log(values[2])))))
+        else:
+            config[name] = rng.choice(values)
+    return config
+
+
+def get_rung_iters(min_iters, max_iters, eta):
+    """[min_iters, min_iters * eta, ..., max_iters]"""
+    rung_iters = [min_iters]
+    while rung_iters[-1] * eta < max_iters:
+        rung_iters.append(rung_iters[-1] * eta)
+    if rung_iters[-1] < max_iters:
+        rung_iters.append(max_iters)
+    return rung_iters
+
+
+def run_trial(trial_id, rung, config, iters, args, device, output_dir, cpus=None):
+    """
+    Train a trial up to exactly iters iterations in a fresh process, starting from its checkpoint of the previous
+    rung. The lr and alpha schedules run over max_iters, so a promoted trial follows the schedules of a single full
+    run, only the epoch cut by the end of a rung restarts with a new shuffle.
+    """
+    since = time.time()
+    checkpoint = os.path.join(output_dir, 'trial_{}.pt'.format(trial_id))
+
+    with open(os.path.join(output_dir, 'trial_{}.log'.format(trial_id)), 'a') as f, contextlib.redirect_stdout(f):
+        print('Rung {}, {} iterations, {}'.format(rung, iters, config))
+        worker_cpus = None
+        if cpus is not None:
+            worker_cpus = configure_cpus(cpus, args.num_workers)
+        solver = get_solver_class(args.model)(
+            dataset_type=args.dataset,
+            source_domain=args.source,
+            target_domain=args.target,
+            cuda=device,
+            num_epochs=999999,
+            max_iter_num=args.max_iters,
+            num_workers=args.num_workers,
+            worker_cpus=worker_cpus,
+            optimizer_type=args.optimizer,
+            **config
+        )
+        solver.load_dataset()
+        solver.set_dataloader()
+        solver.set_model()
+        solver.set_optimizer()
+
+        if os.path.exists(checkpoint):
+            solver.load_checkpoint(checkpoint)
+
+        # TODO 1 : train until the iterations of the rung, the last epoch stops there
+        solver.stop_iter = iters
+        while solver.iter_num < iters:
+            solver.epoch_interrupted = False
+            solver.train_one_epoch()
+            if not solver.epoch_interrupted:
+                solver.update_pseudo_labels()
+                solver.epoch += 1
+
+        solver.save_checkpoint(checkpoint)
+
+        # TODO 2 : evaluate
+        metric = args.metric
+        if metric == 'auto':
+            metric = 'val' if args.dataset == 'Digits' else 'test'
+        domain = 'source' if metric == 'val' else 'target'
+        _, acc = solver.evaluate(data_loader=solver.data_loader[domain]['test'])
+        print('Rung {} : {} acc {:.4f} after {} iterations, using {:.1f}s\n'.format(
+            rung, metric, acc, solver.iter_num, time.time() - since))
+
+    return trial_id, rung, acc, solver.iter_num, time.time() - since
+
+
+class ASHA(object):
+    """
+    Asynchronous successive halving (Li et al. 2018) : a free process continues the best trial of the highest rung
+    that is in the top 1 / eta of its rung and not promoted yet, otherwise it starts a new trial in the first rung.
+    """
+
+    def __init__(self, configs, rung_iters, eta):
+        self.configs = configs
+        self.rung_iters = rung_iters
+        self.eta = eta
+        self.next_trial = 0
+        # rung -> {trial id : acc}
+        self.results = [{} for _ in rung_iters]
+        self.promoted = [set() for _ in rung_iters]
+
+    def get_job(self):
+        for rung in reversed(range(len(self.rung_iters) - 1)):
+            ranked = sorted(self.results[rung], key=lambda t: -self.results[rung][t])
+            for trial_id in ranked[:len(ranked) // self.eta]:
+                if trial_id not in self.promoted[rung]:
+                    self.promoted[rung].add(trial_id)
+                    return trial_id, rung + 1
+
+        if self.next_trial < len(self.configs):
+            self.next_trial += 1
+            return self.next_trial - 1, 0
+
+        return None
+
+    def report(self, trial_id, rung, acc):
+        self.results[rung][trial_id] = acc
+
+    def get_leaderboard(self):
+        """Trials sorted by the highest rung they reached, then by their accuracy there."""
+        rows = []
+        for trial_id, config in enumerate(self.configs):
+            rungs = [rung for rung in range(len(self.rung_iters)) if trial_id in self.results[rung]]
+            if rungs:
+                rows.append((trial_id, rungs[-1], self.results[rungs[-1]][trial_id], config))
+        return sorted(rows, key=lambda row: (-row[1], -row[2]))
+
+
+def main():
+    args = parser.parse_args()
+
+    # TODO 1 : search space and rungs
+    rng = random.Random(args.seed)
+    space = parse_space(args.space, get_solver_args(args.model))
+    configs = [sample_config(space, rng) for _ in range(args.num_trials)]
+    rung_iters = get_rung_iters(args.min_iters, args.max_iters, args.eta)
+
+    task = args.source[0] + 'to' + args.target[0] if args.dataset != 'OfficeHome' else \
+        args.source[:2] + 'to' + args.target[:2]
+    output_dir = args.output or os.path.join('./logs', args.dataset, task, 'search_' + args.model)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    print('Search {} trials of {} on {}, rungs : {} iterations'.format(args.num_trials, args.model, task, rung_iters))
+    print('Space : {}\n'.format(space))
+
+    # TODO 2 : keep every process busy with the next job of ASHA
+    since = time.time()
+    asha = ASHA(configs, rung_iters, args.eta)
+    total_iters = 0
+    trial_iters = [0] * args.num_trials
+    # one group of cores per slot of the pool
+    slot_cpus = partition_cpus(args.num_procs) if args.pin_cpus else [None] * args.num_procs
+    with concurrent.futures.ProcessPoolExecutor(args.num_procs,
+                                                mp_context=multiprocessing.get_context('spawn')) as executor:
+        running = {}
+        while True:
+            while len(running) < args.num_procs:
+                job = asha.get_job()
+                if job is None:
+                    break
+                trial_id, rung = job
+                devices = [device for device, _ in running.values()]
+                device = min(args.cuda, key=devices.count)
+                slot = min(set(range(args.num_procs)) - set(slot for _, slot in running.values()))
+                future = executor.submit(run_trial, trial_id, rung, configs[trial_id], rung_iters[rung], args,
+                                         device, output_dir, slot_cpus[slot])
+                running[future] = (device, slot)
+
+            if not running:
+                break
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                trial_id, rung, acc, iter_num, trial_time = future.result()
+                asha.report(trial_id, rung, acc)
+                total_iters += iter_num - trial_iters[trial_id]
+                trial_iters[trial_id] = iter_num
+                print('Trial {:>3} rung {} : acc {:.4f} at {} iterations, using {:.1f}s, {}'.format(
+                    trial_id, rung, acc, iter_num, trial_time, configs[trial_id]))
+
+    # TODO 3 : report
+    time_elapsed = time.time() - since
+    leaderboard = asha.get_leaderboard()
+    print('\nSearch complete in {:.0f}m {:.0f}s, {} iterations = {:.1f} full runs'.format(
+        time_elapsed // 60, time_elapsed % 60, total_iters, total_iters / args.max_iters))
+    print('{:>6} {:>6} {:>8}  {}'.format('trial', 'rung', 'acc', 'config'))
+    for trial_id, rung, acc, config in leaderboard[:10]:
+        print('{:>6} {:>6} {:>8.4f}  {}'.format(trial_id, rung, acc, config))
+
+    best_config = leaderboard[0][3]
+    print('\nBest : ' + ' '.join('--{}={}'.format(name, value) for name, value in best_config.items()))
+
+    path = os.path.join(output_dir, 'search.json')
+    with open(path, 'w') as f:
+        json.dump({
+            'model': args.model,
+            'dataset': args.dataset,
+            'task': task,
+            'space': {name: list(values) for name, values in space.items()},
+            'rung_iters': rung_iters,
+            'total_iters': total_iters,
+            'elapsed': time_elapsed,
+            'best': {'trial': leaderboard[0][0], 'rung': leaderboard[0][1], 'acc': leaderboard[0][2],
+                     'config': best_config},
+            'trials': [{'trial': trial_id, 'config': config,
+                        'accs': {rung_iters[rung]: asha.results[rung][trial_id]
+                                 for rung in range(len(rung_iters)) if trial_id in asha.results[rung]}}
+                       for trial_id, config in enumerate(configs)],
+        }, f, indent=2)
+    print('Save search results in {} successfully'.format(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from PIL import Image
+
+from data_helpers.data_helper import get_predict_transform
+from solvers.inference import load_trained_solver
+
+parser = argparse.ArgumentParser(description='Serve a trained model over HTTP with dynamic micro-batching')
+
+parser.add_argument('--model', type=str, default='DANN')
+parser.add_argument('--dataset', type=str, default='Office31')
+parser.add_argument('--source', type=str, default='Webcam')
+parser.add_argument('--target', type=str, default='Dslr')
+parser.add_argument('--cuda', type=str, default='cuda:0')
+parser.add_argument('--checkpoint', type=str, default='')
+
+parser.add_argument('--host', type=str, default='127.0.0.1')
+parser.add_argument('--port', type=int, default=8080)
+parser.add_argument('--unix_socket', type=str, default='', help='serve on a unix socket instead of host:port')
+
+parser.add_argument('--max_batch_size', type=int, default=64)
+parser.add_argument('--max_wait_ms', type=float, default=5.0)
+parser.add_argument('--num_workers', type=int, default=1, help='threads running batched forwards')
+parser.add_argument('--warmup_iters', type=int, default=3)
+
+
+class MicroBatcher(object):
+    """
+    Coalesce requests that arrive within max_wait_ms of the first queued request into one forward pass
+    """
+
+    def __init__(self, solver, max_batch_size=64, max_wait_ms=5.0, num_workers=1):
+        self.solver = solver
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.served_num = 0
+        self.batch_num = 0
+        self.lock = threading.Lock()
+
+        self.workers = [
+            threading.Thread(target=self.work, name='batcher-{}'.format(i), daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def queue_depth(self):
+        return self.requests.qsize()
+
+    def submit(self, inputs):
+        request = {'inputs': inputs, 'done': threading.Event(), 'probs': None, 'error': None, 'batch_size': 0}
+        self.requests.put(request)
+        request['done'].wait()
+
+        if request['error'] is not None:
+            raise request['error']
+
+        return request['probs'], request['batch_size']
+
+    def collect(self):
+        batch = [self.requests.get()]
+        deadline = time.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def work(self):
+        while True:
+            batch = self.collect()
+
+            try:
+                inputs = torch.stack([request['inputs'] for request in batch]).to(self.solver.device)
+                probs = self.solver.predict(inputs).cpu()
+                for i, request in enumerate(batch):
+                    request['probs'] = probs[i]
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+
+            with self.lock:
+                self.served_num += len(batch)
+                self.batch_num += 1
+
+            for request in batch:
+                request['batch_size'] = len(batch)
+                request['done'].set()
+
+    def warmup(self, input_size, iters=3):
+        with torch.no_grad():
+            for _ in range(iters):
+                self.solver.predict(torch.zeros([self.max_batch_size] + list(input_size), device=self.solver.device))
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, code, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+
+        batcher = self.server.batcher
+        self.send_json(200, {
+            'model': batcher.solver.model_name,
+            'task': batcher.solver.task,
+            'queue_depth': batcher.queue_depth(),
+            'served': batcher.served_num,
+            'batches': batcher.batch_num,
+        })
+
+    def do_POST(self):
+        since = time.time()
+
+        if self.path != '/predict':
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            img = Image.open(io.BytesIO(body)).convert(self.server.image_mode)
+        except Exception as e:
+            self.send_json(400, {'error': 'cannot decode image: {}'.format(e)})
+            return
+
+        inputs = self.server.transform(img)
+
+        queue_depth = self.server.batcher.queue_depth()
+        try:
+            probs, batch_size = self.server.batcher.submit(inputs)
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+
+        confidence, pred = torch.max(probs, 0)
+        self.send_json(200, {
+            'pred': pred.item(),
+            'confidence': confidence.item(),
+            'probs': probs.tolist(),
+            'latency_ms': (time.time() - since) * 1000.0,
+            'queue_depth': queue_depth,
+            'batch_size': batch_size,
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixInferenceServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        return request, ('localhost', 0)
+
+
+def build_server(solver, batcher, host='127.0.0.1', port=8080, unix_socket=''):
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixInferenceServer(unix_socket, InferenceHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), InferenceHandler)
+
+    server.daemon_threads = True
+    server.batcher = batcher
+    server.transform, server.image_mode = get_predict_transform(solver.dataset_type, solver.task)
+
+    return server
+
+
+def main():
+    args = parser.parse_args()
+
+    solver = load_trained_solver(
+        model=args.model,
+        dataset_type=args.dataset,
+        source_domain=args.source,
+        target_domain=args.target,
+        cuda=args.cuda,
+        checkpoint=args.checkpoint
+    )
+
+    batcher = MicroBatcher(
+        solver=solver,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        num_workers=args.num_workers
+    )
+
+    server = build_server(solver, batcher, host=args.host, port=args.port, unix_socket=args.unix_socket)
+
+    # keep the model warm so the first requests do not pay for lazy initialization
+    sample_inputs = server.transform(Image.new(server.image_mode, (256, 256)))
+    batcher.warmup(input_size=sample_inputs.size(), iters=args.warmup_iters)
+
+    print('Serving {} on {}, max batch size {}, max wait {}ms, {} workers'.format(
+        solver.model_name,
+        args.unix_socket if args.unix_socket else '{}:{}'.format(args.host, args.port),
+        args.max_batch_size, args.max_wait_ms, args.num_workers))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
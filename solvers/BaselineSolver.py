@@ -6,6 +6,7 @@ import torch
 import torch.nn as nn
 
 from networks.Baseline import DigitsStoM, DigitsMU, ResNet50
+from networks.Deploy import SoftmaxClassifier
 from solvers.Solver import Solver
 
 
@@ -14,7 +15,7 @@ class BaselineSolver(Solver):
     def __init__(self, dataset_type, source_domain, target_domain, cuda, pretrained=False,
                  batch_size=32,
                  num_epochs=99999, max_iter_num=99999999, test_interval=100, test_mode=False, num_workers=2, lr=0.001,
-                 gamma=10, optimizer_type='SGD'):
+                 gamma=10, optimizer_type='SGD', **kwargs):
         super(BaselineSolver, self).__init__(
             dataset_type=dataset_type,
             source_domain=source_domain,
@@ -29,7 +30,8 @@ class BaselineSolver(Solver):
             num_workers=num_workers,
             lr=lr,
             gamma=gamma,
-            optimizer_type=optimizer_type
+            optimizer_type=optimizer_type,
+            **kwargs
         )
         self.model_name = 'Baseline'
 
@@ -78,6 +80,14 @@ class BaselineSolver(Solver):
 
         return average_loss, acc
 
+    def predict(self, inputs):
+        with torch.no_grad():
+            class_outputs = self.model(inputs, get_features=False, get_class_outputs=True)
+            return nn.Softmax(dim=1)(class_outputs)
+
+    def get_deploy_model(self):
+        return SoftmaxClassifier(self.model)
+
     def train_one_epoch(self):
         since = time.time()
         self.model.train()
@@ -90,10 +100,13 @@ class BaselineSolver(Solver):
 
         criterion = nn.CrossEntropyLoss()
         for inputs, labels in self.data_loader['source']['train']:
+            if self.reached_stop_iter():
+                break
+
             sys.stdout.write('\r{}/{}'.format(processed_num, data_num))
             sys.stdout.flush()
 
-            inputs = inputs.to(self.device)
+            inputs = self.prepare_train_inputs(inputs)
             labels = labels.to(self.device)
 
             self.update_optimizer()
@@ -113,6 +126,7 @@ class BaselineSolver(Solver):
             corrects += (preds == labels.data).sum().item()
             processed_num += self.batch_size
             self.iter_num += 1
+            self.end_iter()
 
         acc = corrects / data_num
         average_loss = total_loss / data_num
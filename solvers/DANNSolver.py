@@ -6,6 +6,7 @@ import time
 import torch.nn as nn
 
 from data_helpers.data_helper import *
+from networks.Deploy import SoftmaxClassifier
 from networks.DANN import DANN
 from solvers.Solver import Solver
 import torch.nn.functional as F
@@ -17,7 +18,7 @@ class DANNSolver(Solver):
                  pretrained=False,
                  batch_size=32,
                  num_epochs=9999, max_iter_num=9999999, test_interval=500, test_mode=False, num_workers=2,
-                 clean_log=False, lr=0.001, gamma=10, optimizer_type='SGD', use_augment = False):
+                 clean_log=False, lr=0.001, gamma=10, optimizer_type='SGD', use_augment = False, **kwargs):
         super(DANNSolver, self).__init__(
             dataset_type=dataset_type,
             source_domain=source_domain,
@@ -33,20 +34,13 @@ class DANNSolver(Solver):
             clean_log=clean_log,
             lr=lr,
             gamma=gamma,
-            optimizer_type=optimizer_type
+            optimizer_type=optimizer_type,
+            **kwargs
         )
         self.model_name = 'DANN'
         self.iter_num = 0
         self.use_augment = use_augment
 
-    def get_alpha(self, delta=10.0):
-        if self.num_epochs != 999999:
-            p = self.epoch / self.num_epochs
-        else:
-            p = self.iter_num / self.max_iter_num
-
-        return np.float(2.0 / (1.0 + np.exp(-delta * p)) - 1.0)
-
     def set_model(self):
         if self.dataset_type == 'Digits':
             if self.task in ['MtoU', 'UtoM']:
@@ -89,6 +83,14 @@ class DANNSolver(Solver):
 
         return average_loss, acc
 
+    def predict(self, inputs):
+        with torch.no_grad():
+            class_outputs = self.model(inputs, test_mode=True)
+            return nn.Softmax(dim=1)(class_outputs)
+
+    def get_deploy_model(self):
+        return SoftmaxClassifier(self.model.base_model)
+
     def augment(self, x, T=True, A=True):
         # tmp = torch.Tensor(x) + torch.randn_like(x) * 0.1
 
@@ -102,7 +104,7 @@ class DANNSolver(Solver):
         if A:
             theta[:, :, :2] += np.random.normal(scale=0.1, size=(N, 2, 2))
 
-        grid = F.affine_grid(theta=torch.from_numpy(theta), size=x.size())
+        grid = F.affine_grid(theta=torch.from_numpy(theta).to(x.device), size=x.size())
         new_x = F.grid_sample(input=x, grid=grid)
 
         return new_x
@@ -119,7 +121,11 @@ class DANNSolver(Solver):
         total_source_num = 0
 
         alpha = 0
-        for target_inputs, target_labels in self.data_loader['target']['train']:
+        source_iter = iter(self.cycle(self.data_loader['source']['train']))
+        for target_inputs, target_labels, _ in self.data_loader['target']['train']:
+            if self.reached_stop_iter():
+                break
+
             sys.stdout.write('\r{}/{}'.format(processed_target_num, total_target_num))
             sys.stdout.flush()
 
@@ -130,20 +136,19 @@ class DANNSolver(Solver):
             alpha = self.get_alpha()
 
             # TODO 1 : Target Train
+            target_inputs = self.prepare_train_inputs(target_inputs)
             if self.use_augment:
                 target_inputs = self.augment(target_inputs)
-            target_inputs = target_inputs.to(self.device)
             target_domain_outputs = self.model(target_inputs, alpha=alpha, test_mode=False, is_source=False)
             target_domain_labels = torch.ones((target_labels.size(0), 1), device=self.device)
             target_domain_loss = nn.BCELoss()(target_domain_outputs, target_domain_labels)
 
             # TODO 2 : Source Train
 
-            source_iter = iter(self.data_loader['source']['train'])
             source_inputs, source_labels = next(source_iter)
+            source_inputs = self.prepare_train_inputs(source_inputs)
             if self.use_augment:
                 source_inputs = self.augment(source_inputs)
-            source_inputs = source_inputs.to(self.device)
 
             source_domain_outputs, source_class_outputs = self.model(source_inputs, alpha=alpha, test_mode=False,
                                                                      is_source=True)
@@ -172,6 +177,7 @@ class DANNSolver(Solver):
             total_source_num += source_labels.size()[0]
             processed_target_num += target_labels.size()[0]
             self.iter_num += 1
+            self.end_iter()
 
         acc = source_corrects / total_source_num
         average_loss = total_loss / total_source_num
@@ -0,0 +1,249 @@
+from __future__ import print_function, division
+
+import sys
+import time
+
+import torch.nn as nn
+import torch.nn.functional as F
+
+from data_helpers.data_helper import *
+from networks.Baseline import DigitsSmall, MobileNetV2, ResNet18
+from networks.Deploy import SoftmaxClassifier
+from solvers.Solver import Solver
+from solvers.inference import load_trained_solver
+
+
+class DistillSolver(Solver):
+    """
+    Distill an adapted teacher (any trained solver) into a compact student on unlabeled target images.
+    The teacher predictions of the un-augmented target images are computed once and cached on disk.
+    """
+
+    def __init__(self, dataset_type, source_domain, target_domain, cuda='cuda:0',
+                 pretrained=False,
+                 batch_size=36,
+                 num_epochs=9999, max_iter_num=9999999, test_interval=500, test_mode=False, num_workers=2,
+                 clean_log=False, lr=0.001, gamma=10, optimizer_type='SGD', teacher='MADA', teacher_checkpoint='',
+                 student='ResNet18', temperature=4.0, loss_weight=0.0, **kwargs):
+        super(DistillSolver, self).__init__(
+            dataset_type=dataset_type,
+            source_domain=source_domain,
+            target_domain=target_domain,
+            cuda=cuda,
+            pretrained=pretrained,
+            batch_size=batch_size,
+            num_epochs=num_epochs,
+            max_iter_num=max_iter_num,
+            test_interval=test_interval,
+            test_mode=test_mode,
+            num_workers=num_workers,
+            clean_log=clean_log,
+            lr=lr,
+            gamma=gamma,
+            optimizer_type=optimizer_type,
+            **kwargs
+        )
+        self.teacher_name = teacher
+        self.teacher_checkpoint = teacher_checkpoint
+        # the Digits teachers are DigitsMU / DigitsStoM, their student is always the much smaller DigitsSmall
+        self.student_name = 'DigitsSmall' if dataset_type == 'Digits' else student
+        self.temperature = temperature
+        self.loss_weight = loss_weight
+        self.model_name = 'Distill_' + teacher + '_' + self.student_name
+        self.iter_num = 0
+        self.teacher = None
+        self.soft_targets = None
+
+    def set_model(self):
+        if self.dataset_type == 'Digits':
+            if self.task in ['MtoU', 'UtoM']:
+                self.model = DigitsSmall(n_classes=self.n_classes, in_channels=1)
+            if self.task in ['StoM']:
+                self.model = DigitsSmall(n_classes=self.n_classes, in_channels=3)
+
+        if self.dataset_type in ['Office31', 'OfficeHome']:
+            if self.student_name == 'MobileNetV2':
+                self.model = MobileNetV2(bottleneck_dim=256, n_classes=self.n_classes, pretrained=True)
+            else:
+                self.model = ResNet18(bottleneck_dim=256, n_classes=self.n_classes, pretrained=True)
+
+        if self.pretrained:
+            self.load_model(path=self.models_checkpoints_dir + '/' + self.model_name + '_best_train.pt')
+
+        self.model = self.model.to(self.device)
+
+        self.teacher = load_trained_solver(
+            model=self.teacher_name,
+            dataset_type=self.dataset_type,
+            source_domain=self.source_domain,
+            target_domain=self.target_domain,
+            cuda=self.cuda,
+            checkpoint=self.teacher_checkpoint,
+            batch_size=self.batch_size,
+            num_workers=self.num_workers
+        )
+
+        self.soft_targets = self.load_soft_targets().to(self.device)
+
+    def load_soft_targets(self):
+        checkpoint = self.teacher_checkpoint
+        if checkpoint == '':
+            checkpoint = os.path.join(self.models_checkpoints_dir, self.teacher_name + '_best_test.pt')
+        path = os.path.join(self.models_checkpoints_dir, self.teacher_name + '_soft_targets.pt')
+
+        if os.path.exists(path):
+            cache = torch.load(path)
+            if cache['checkpoint_mtime'] == os.path.getmtime(checkpoint) and \
+                    cache['log_probs'].size(0) == len(self.target_data['train']):
+                print('Read teacher soft targets in {} successfully\n'.format(path))
+                return cache['log_probs']
+
+        # the teacher sees the target train images without augmentation
+        dataset = self.get_target_eval_dataset()
+
+        data_loader = self.make_dataloader(make_indexed_dataset(dataset), train=False)
+
+        log_probs = torch.zeros(len(dataset), self.n_classes)
+        processed_num = 0
+        for inputs, _, indices in data_loader:
+            sys.stdout.write('\rcaching teacher predictions {}/{}'.format(processed_num, len(dataset)))
+            sys.stdout.flush()
+
+            probs = self.teacher.predict(inputs.to(self.device))
+            log_probs[indices] = torch.log(probs.clamp(min=1e-8)).cpu()
+            processed_num += indices.size(0)
+
+        torch.save({'checkpoint_mtime': os.path.getmtime(checkpoint), 'log_probs': log_probs}, path)
+        print('\nSave teacher soft targets in {} successfully\n'.format(path))
+
+        return log_probs
+
+    def test(self, data_loader):
+        self.model.eval()
+
+        corrects = 0
+        data_num = len(data_loader.dataset)
+        processed_num = 0
+
+        for inputs, labels in data_loader:
+            sys.stdout.write('\r{}/{}'.format(processed_num, data_num))
+            sys.stdout.flush()
+
+            inputs = inputs.to(self.device)
+            labels = labels.to(self.device)
+
+            class_outputs = self.model(inputs, get_features=False, get_class_outputs=True)
+
+            _, preds = torch.max(class_outputs, 1)
+
+            corrects += (preds == labels.data).sum().item()
+            processed_num += labels.size()[0]
+
+        acc = corrects / processed_num
+        print('\nData size = {} , corrects = {}'.format(processed_num, corrects))
+
+        return 0, acc
+
+    def predict(self, inputs):
+        with torch.no_grad():
+            class_outputs = self.model(inputs, get_features=False, get_class_outputs=True)
+            return nn.Softmax(dim=1)(class_outputs)
+
+    def get_deploy_model(self):
+        return SoftmaxClassifier(self.model)
+
+    def compute_distill_loss(self, student_outputs, teacher_log_probs):
+        T = self.temperature
+        teacher_probs = F.softmax(teacher_log_probs / T, dim=1)
+        student_log_probs = F.log_softmax(student_outputs / T, dim=1)
+        return F.kl_div(student_log_probs, teacher_probs, reduction='batchmean') * T * T
+
+    def train_one_epoch(self):
+        since = time.time()
+        self.model.train()
+
+        total_loss = 0
+        teacher_agreements = 0
+
+        total_target_num = len(self.data_loader['target']['train'].dataset)
+        processed_target_num = 0
+        source_iter = iter(self.cycle(self.data_loader['source']['train']))
+
+        for target_inputs, _, target_indices in self.data_loader['target']['train']:
+            if self.reached_stop_iter():
+                break
+
+            sys.stdout.write('\r{}/{}'.format(processed_target_num, total_target_num))
+            sys.stdout.flush()
+
+            self.update_optimizer()
+
+            self.optimizer.zero_grad()
+
+            # TODO 1 : Distill on target
+            target_inputs = self.prepare_train_inputs(target_inputs)
+            teacher_log_probs = self.soft_targets[target_indices.to(self.device)]
+
+            target_outputs = self.model(target_inputs, get_features=False, get_class_outputs=True)
+            loss = self.compute_distill_loss(target_outputs, teacher_log_probs)
+
+            # TODO 2 : Optional source supervision
+            if self.loss_weight > 0:
+                source_inputs, source_labels = next(source_iter)
+                source_outputs = self.model(self.prepare_train_inputs(source_inputs), get_features=False,
+                                            get_class_outputs=True)
+                loss += self.loss_weight * nn.CrossEntropyLoss()(source_outputs, source_labels.to(self.device))
+
+            loss.backward()
+
+            self.optimizer.step()
+
+            # TODO 3 : other parameters
+            total_loss += loss.item() * target_indices.size(0)
+            _, preds = torch.max(target_outputs, 1)
+            teacher_agreements += (preds == teacher_log_probs.argmax(dim=1)).sum().item()
+            processed_target_num += target_indices.size(0)
+            self.iter_num += 1
+            self.end_iter()
+
+        acc = teacher_agreements / processed_target_num
+        average_loss = total_loss / processed_target_num
+
+        print()
+        print('\nData size = {} , agreements with teacher = {}'.format(processed_target_num, teacher_agreements))
+        print('Using {:4f}'.format(time.time() - since))
+        return average_loss, acc
+
+    def compare_with_teacher(self, iters=10):
+        data_loader = self.data_loader['target']['test']
+        inputs, _ = next(iter(data_loader))
+        inputs = inputs.to(self.device)
+
+        rows = []
+        for name, solver in [(self.teacher.model_name, self.teacher), (self.model_name, self)]:
+            model = solver.get_deploy_model().eval()
+            params = sum(p.numel() for p in model.parameters())
+            size = sum(p.numel() * p.element_size() for p in model.state_dict().values())
+
+            with torch.no_grad():
+                model(inputs)
+                if self.device.type == 'cuda':
+                    torch.cuda.synchronize(self.device)
+                start = time.time()
+                for _ in range(iters):
+                    model(inputs)
+                if self.device.type == 'cuda':
+                    torch.cuda.synchronize(self.device)
+                latency = (time.time() - start) / iters
+
+            _, acc = solver.evaluate(data_loader)
+            rows.append((name, params / 1e6, size / 1e6, latency * 1000, acc))
+
+        print('\n{:<24} {:>10} {:>10} {:>12} {:>10}'.format('model', 'params(M)', 'size(MB)', 'latency(ms)', 'acc'))
+        for row in rows:
+            print('{:<24} {:>10.2f} {:>10.1f} {:>12.2f} {:>10.4f}'.format(*row))
+
+    def solve(self):
+        super(DistillSolver, self).solve()
+        self.load_model(path=self.models_checkpoints_dir + '/' + self.model_name + '_best_test.pt')
+        self.compare_with_teacher()
@@ -6,6 +6,7 @@ import time
 import torch.nn as nn
 
 from data_helpers.data_helper import *
+from networks.Deploy import SoftmaxClassifier
 from networks.MADA import MADA
 from solvers.Solver import Solver
 
@@ -16,7 +17,7 @@ class MADASolver(Solver):
                  pretrained=False,
                  batch_size=32,
                  num_epochs=9999, max_iter_num=9999999, test_interval=500, test_mode=False, num_workers=2,
-                 clean_log=False, lr=0.001, gamma=10, optimizer_type='SGD', loss_weight=1.0):
+                 clean_log=False, lr=0.001, gamma=10, optimizer_type='SGD', loss_weight=1.0, **kwargs):
         super(MADASolver, self).__init__(
             dataset_type=dataset_type,
             source_domain=source_domain,
@@ -32,21 +33,14 @@ class MADASolver(Solver):
             clean_log=clean_log,
             lr=lr,
             gamma=gamma,
-            optimizer_type=optimizer_type
+            optimizer_type=optimizer_type,
+            **kwargs
         )
         self.model_name = 'MADA'
         self.iter_num = 0
         self.class_weight = None
         self.loss_weight = loss_weight
 
-    def get_alpha(self, delta=10.0):
-        if self.num_epochs != 999999:
-            p = self.epoch / self.num_epochs
-        else:
-            p = self.iter_num / self.max_iter_num
-
-        return np.float(2.0 / (1.0 + np.exp(-delta * p)) - 1.0)
-
     def set_model(self):
         if self.dataset_type == 'Digits':
             if self.task in ['MtoU', 'UtoM']:
@@ -93,6 +87,14 @@ class MADASolver(Solver):
 
         return average_loss, acc
 
+    def predict(self, inputs):
+        with torch.no_grad():
+            class_outputs = self.model(inputs, test_mode=True)
+            return nn.Softmax(dim=1)(class_outputs)
+
+    def get_deploy_model(self):
+        return SoftmaxClassifier(self.model.base_model)
+
     def train_one_epoch(self):
         since = time.time()
         self.model.train()
@@ -107,7 +109,11 @@ class MADASolver(Solver):
         class_criterion = nn.CrossEntropyLoss()
 
         alpha = 0
-        for target_inputs, target_labels in self.data_loader['target']['train']:
+        source_iter = iter(self.cycle(self.data_loader['source']['train']))
+        for target_inputs, target_labels, target_indices in self.data_loader['target']['train']:
+            if self.reached_stop_iter():
+                break
+
             sys.stdout.write('\r{}/{}'.format(processed_target_num, total_target_num))
             sys.stdout.flush()
 
@@ -119,9 +125,10 @@ class MADASolver(Solver):
 
             # TODO 1 : Target Train
 
-            target_inputs = target_inputs.to(self.device)
+            target_inputs = self.prepare_train_inputs(target_inputs)
 
             target_domain_outputs, target_class_outputs = self.model(target_inputs, alpha=alpha)
+            self.record_pseudo_labels(target_indices, target_class_outputs)
 
             target_domain_labels = torch.ones((target_labels.size()[0] * self.n_classes, 1), device=self.device)
 
@@ -129,10 +136,9 @@ class MADASolver(Solver):
 
             # TODO 2 : Source Train
 
-            source_iter = iter(self.data_loader['source']['train'])
             source_inputs, source_labels = next(source_iter)
 
-            source_inputs = source_inputs.to(self.device)
+            source_inputs = self.prepare_train_inputs(source_inputs)
             source_domain_outputs, source_class_outputs = self.model(source_inputs, alpha=alpha)
 
             source_labels = source_labels.to(self.device)
@@ -158,6 +164,7 @@ class MADASolver(Solver):
             total_source_num += source_labels.size()[0]
             processed_target_num += target_labels.size()[0]
             self.iter_num += 1
+            self.end_iter()
 
         acc = source_corrects / total_source_num
         average_loss = total_loss / total_source_num
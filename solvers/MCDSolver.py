@@ -6,8 +6,10 @@ import time
 import torch.nn as nn
 
 from data_helpers.data_helper import *
+from networks.Deploy import MCDClassifier
 from networks.MCD import MCD
 from solvers.Solver import Solver
+from solvers.schedules import group_parameters
 import torch.nn.functional as F
 
 
@@ -17,7 +19,7 @@ class MCDSolver(Solver):
                  pretrained=False,
                  batch_size=36,
                  num_epochs=9999, max_iter_num=9999999, test_interval=500, test_mode=False, num_workers=2,
-                 clean_log=False, lr=0.001, gamma=10, loss_weight=3.0, optimizer_type='SGD', num_k=4):
+                 clean_log=False, lr=0.001, gamma=10, loss_weight=3.0, optimizer_type='SGD', num_k=4, **kwargs):
         super(MCDSolver, self).__init__(
             dataset_type=dataset_type,
             source_domain=source_domain,
@@ -33,7 +35,8 @@ class MCDSolver(Solver):
             clean_log=clean_log,
             lr=lr,
             gamma=gamma,
-            optimizer_type=optimizer_type
+            optimizer_type=optimizer_type,
+            **kwargs
         )
         self.model_name = 'MCD'
         self.iter_num = 0
@@ -88,20 +91,28 @@ class MCDSolver(Solver):
 
         return 0, acc
 
+    def predict(self, inputs):
+        with torch.no_grad():
+            outputs1, outputs2 = self.model(inputs)
+            return (nn.Softmax(dim=1)(outputs1) + nn.Softmax(dim=1)(outputs2)) / 2
+
+    def get_deploy_model(self):
+        return MCDClassifier(self.model.Generator, self.model.Classifier1, self.model.Classifier2)
+
     def set_optimizer(self):
         if self.optimizer_type == 'Adam':
             self.optimizer_generator = torch.optim.Adam(
-                self.model.get_generator_parameters(),
+                group_parameters(self.model.get_generator_parameters()),
                 lr=self.lr,
                 weight_decay=0.0005
             )
             self.optimizer_classifier1 = torch.optim.Adam(
-                self.model.get_classifier1_parameters(),
+                group_parameters(self.model.get_classifier1_parameters()),
                 lr=self.lr,
                 weight_decay=0.0005
             )
             self.optimizer_classifier2 = torch.optim.Adam(
-                self.model.get_classifier2_parameters(),
+                group_parameters(self.model.get_classifier2_parameters()),
                 lr=self.lr,
                 weight_decay=0.0005
             )
@@ -110,52 +121,30 @@ class MCDSolver(Solver):
             self.gamma = 10
 
             self.optimizer_generator = torch.optim.SGD(
-                self.model.get_generator_parameters(),
+                group_parameters(self.model.get_generator_parameters()),
                 lr=self.lr,
                 momentum=0.9,
                 weight_decay=0.0005,
                 nesterov=True
             )
             self.optimizer_classifier1 = torch.optim.SGD(
-                self.model.get_classifier1_parameters(),
+                group_parameters(self.model.get_classifier1_parameters()),
                 lr=self.lr,
                 momentum=0.9,
                 weight_decay=0.0005,
                 nesterov=True
             )
             self.optimizer_classifier2 = torch.optim.SGD(
-                self.model.get_classifier2_parameters(),
+                group_parameters(self.model.get_classifier2_parameters()),
                 lr=self.lr,
                 momentum=0.9,
                 weight_decay=0.0005,
                 nesterov=True
             )
+        self.lr_schedule = None
 
-    def update_optimizer(self, power=0.75, weight_decay=0.0005):
-        """Decay learning rate by a factor of 0.1 every lr_decay_epoch epochs."""
-        if self.optimizer_type == 'SGD':
-            if self.num_epochs != 999999:
-                p = self.epoch / self.num_epochs
-            else:
-                p = self.iter_num / self.max_iter_num
-
-            lr = self.lr * (1.0 + self.gamma * p) ** (-power)
-        else:
-            lr = self.lr
-
-        self.cur_lr = lr
-
-        for param_group in self.optimizer_generator.param_groups:
-            param_group['lr'] = lr * param_group['lr_mult']
-            param_group['weight_decay'] = weight_decay * param_group['decay_mult']
-
-        for param_group in self.optimizer_classifier1.param_groups:
-            param_group['lr'] = lr * param_group['lr_mult']
-            param_group['weight_decay'] = weight_decay * param_group['decay_mult']
-
-        for param_group in self.optimizer_classifier2.param_groups:
-            param_group['lr'] = lr * param_group['lr_mult']
-            param_group['weight_decay'] = weight_decay * param_group['decay_mult']
+    def get_optimizers(self):
+        return [self.optimizer_generator, self.optimizer_classifier1, self.optimizer_classifier2]
 
     def reset_optimizer(self):
         self.optimizer_generator.zero_grad()
@@ -176,7 +165,10 @@ class MCDSolver(Solver):
         processed_source_num = 0
         source_iter = iter(self.cycle(self.data_loader['source']['train']))
 
-        for target_inputs, target_labels in self.data_loader['target']['train']:
+        for target_inputs, target_labels, _ in self.data_loader['target']['train']:
+            if self.reached_stop_iter():
+                break
+
             sys.stdout.write('\r{}/{}'.format(processed_source_num, total_source_num))
             sys.stdout.flush()
 
@@ -188,7 +180,7 @@ class MCDSolver(Solver):
 
             source_inputs, source_labels = next(source_iter)
 
-            source_inputs = source_inputs.to(self.device)
+            source_inputs = self.prepare_train_inputs(source_inputs)
 
             source_outputs1, source_outputs2 = self.model(source_inputs)
 
@@ -218,7 +210,7 @@ class MCDSolver(Solver):
             loss_source2 = nn.CrossEntropyLoss()(source_outputs2, source_labels)
             loss_source = loss_source1 + loss_source2
 
-            target_inputs = target_inputs.to(self.device)
+            target_inputs = self.prepare_train_inputs(target_inputs)
             target_outputs1, target_outputs2 = self.model(target_inputs)
             loss_discrepancy = self.compute_discrepancy(target_outputs1, target_outputs2)
 
@@ -240,6 +232,7 @@ class MCDSolver(Solver):
 
             # TODO 5 : other parameters
             self.iter_num += 1
+            self.end_iter()
 
         acc = (source_corrects / 2) / processed_source_num
         average_loss = (total_loss / 2) / processed_source_num
@@ -0,0 +1,174 @@
+from __future__ import print_function, division
+
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+from networks.Alignment import coral, linear_mmd
+from networks.Baseline import DigitsMU, DigitsStoM, ResNet50
+from networks.Deploy import SoftmaxClassifier
+from solvers.Solver import Solver
+
+
+class MMDSolver(Solver):
+    """
+    Align source and target features with a linear-time MMD and / or CORAL loss, without discriminator.
+    Source and target batches go through the network in a single forward pass.
+    """
+
+    def __init__(self, dataset_type, source_domain, target_domain, cuda='cuda:0',
+                 pretrained=False,
+                 batch_size=32,
+                 num_epochs=9999, max_iter_num=9999999, test_interval=500, test_mode=False, num_workers=2,
+                 clean_log=False, lr=0.001, gamma=10, optimizer_type='SGD', align_loss='mmd', loss_weight=1.0,
+                 **kwargs):
+        super(MMDSolver, self).__init__(
+            dataset_type=dataset_type,
+            source_domain=source_domain,
+            target_domain=target_domain,
+            cuda=cuda,
+            pretrained=pretrained,
+            batch_size=batch_size,
+            num_epochs=num_epochs,
+            max_iter_num=max_iter_num,
+            test_interval=test_interval,
+            test_mode=test_mode,
+            num_workers=num_workers,
+            clean_log=clean_log,
+            lr=lr,
+            gamma=gamma,
+            optimizer_type=optimizer_type,
+            **kwargs
+        )
+        # align_loss : 'mmd' | 'coral' | 'both'
+        self.align_loss = align_loss
+        self.loss_weight = loss_weight
+        self.model_name = align_loss.upper() if align_loss != 'both' else 'MMD_CORAL'
+        self.iter_num = 0
+
+    def set_model(self):
+        if self.dataset_type == 'Digits':
+            if self.task in ['MtoU', 'UtoM']:
+                self.model = DigitsMU(n_classes=self.n_classes)
+            if self.task in ['StoM']:
+                self.model = DigitsStoM(n_classes=self.n_classes)
+
+        if self.dataset_type in ['Office31', 'OfficeHome']:
+            self.model = ResNet50(bottleneck_dim=256, n_classes=self.n_classes, pretrained=True)
+
+        if self.pretrained:
+            self.load_model(path=self.models_checkpoints_dir + '/' + self.model_name + '_best_train.pt')
+
+        self.model = self.model.to(self.device)
+
+    def test(self, data_loader):
+        self.model.eval()
+
+        corrects = 0
+        data_num = len(data_loader.dataset)
+        processed_num = 0
+
+        for inputs, labels in data_loader:
+            sys.stdout.write('\r{}/{}'.format(processed_num, data_num))
+            sys.stdout.flush()
+
+            inputs = inputs.to(self.device)
+            labels = labels.to(self.device)
+
+            class_outputs = self.model(inputs, get_features=False, get_class_outputs=True)
+
+            _, preds = torch.max(class_outputs, 1)
+
+            corrects += (preds == labels.data).sum().item()
+            processed_num += labels.size()[0]
+
+        acc = corrects / processed_num
+        print('\nData size = {} , corrects = {}'.format(processed_num, corrects))
+
+        return 0, acc
+
+    def predict(self, inputs):
+        with torch.no_grad():
+            class_outputs = self.model(inputs, get_features=False, get_class_outputs=True)
+            return nn.Softmax(dim=1)(class_outputs)
+
+    def get_deploy_model(self):
+        return SoftmaxClassifier(self.model)
+
+    def compute_align_loss(self, source_features, target_features):
+        loss = 0
+        if self.align_loss in ['mmd', 'both']:
+            loss = loss + linear_mmd(source_features, target_features)
+        if self.align_loss in ['coral', 'both']:
+            loss = loss + coral(source_features, target_features)
+        return loss
+
+    def train_one_epoch(self):
+        since = time.time()
+        self.model.train()
+
+        total_loss = 0
+        total_align_loss = 0
+        source_corrects = 0
+
+        total_target_num = len(self.data_loader['target']['train'].dataset)
+        processed_target_num = 0
+        total_source_num = 0
+
+        alpha = 0
+        source_iter = iter(self.cycle(self.data_loader['source']['train']))
+        for target_inputs, target_labels, _ in self.data_loader['target']['train']:
+            if self.reached_stop_iter():
+                break
+
+            sys.stdout.write('\r{}/{}'.format(processed_target_num, total_target_num))
+            sys.stdout.flush()
+
+            self.update_optimizer()
+
+            self.optimizer.zero_grad()
+
+            alpha = self.get_alpha()
+
+            # TODO 1 : one forward pass over source and target
+            source_inputs, source_labels = next(source_iter)
+            source_inputs = self.prepare_train_inputs(source_inputs)
+            target_inputs = self.prepare_train_inputs(target_inputs)
+            source_labels = source_labels.to(self.device)
+
+            features, class_outputs = self.model(torch.cat([source_inputs, target_inputs]), get_features=True,
+                                                 get_class_outputs=True)
+            source_num = source_inputs.size(0)
+            source_class_outputs = class_outputs[:source_num]
+
+            # TODO 2 : LOSS
+            source_class_loss = nn.CrossEntropyLoss()(source_class_outputs, source_labels)
+            align_loss = self.compute_align_loss(features[:source_num], features[source_num:])
+
+            loss = source_class_loss + self.loss_weight * alpha * align_loss
+
+            loss.backward()
+
+            self.optimizer.step()
+
+            # TODO 3 : other parameters
+            total_loss += loss.item() * source_labels.size()[0]
+            total_align_loss += align_loss.item() * source_labels.size()[0]
+            _, source_class_preds = torch.max(source_class_outputs, 1)
+            source_corrects += (source_class_preds == source_labels.data).sum().item()
+            total_source_num += source_labels.size()[0]
+            processed_target_num += target_labels.size()[0]
+            self.iter_num += 1
+            self.end_iter()
+
+        acc = source_corrects / total_source_num
+        average_loss = total_loss / total_source_num
+
+        print()
+        print('\nData size = {} , corrects = {}'.format(total_source_num, source_corrects))
+        print('Align loss ({}) = {:.4f}'.format(self.align_loss, total_align_loss / total_source_num))
+        print('Using {:4f}'.format(time.time() - since))
+        print('Alpha = ', alpha)
+        return average_loss, acc
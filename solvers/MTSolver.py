@@ -6,14 +6,29 @@ import time
 import torch.nn as nn
 
 from data_helpers.data_helper import *
+from networks.Deploy import SoftmaxClassifier
 from networks.MT import MT
 from solvers.Solver import Solver
 import torch.nn.functional as F
 
 
+def stochastic_round(x, dtype):
+    """
+    Round fp32 x to dtype, up or down with probabilities given by the distance to both neighbours,
+    so the rounding is unbiased and updates far below the resolution of dtype still add up on average.
+    """
+    nearest = x.to(dtype)
+    error = x - nearest.float()
+    neighbour = torch.nextafter(nearest, torch.where(error > 0, torch.inf, -torch.inf).to(dtype))
+    gap = (neighbour.float() - nearest.float()).abs()
+    use_neighbour = torch.rand_like(x) * gap < error.abs()
+    return torch.where(use_neighbour, neighbour, nearest)
+
+
 class OldWeightEMA(object):
     """
-    Exponential moving average weight optimizer for mean teacher model
+    Exponential moving average weight optimizer for mean teacher model, the teacher weights stored in reduced
+    precision are updated in fp32 one tensor at a time and stochastically rounded back
     """
 
     def __init__(self, target_net, source_net, alpha=0.999):
@@ -27,6 +42,12 @@ class OldWeightEMA(object):
     def step(self):
         one_minus_alpha = 1.0 - self.alpha
         for p, src_p in zip(self.target_params, self.source_params):
+            # parameters of a trunk shared by student and teacher
+            if p is src_p:
+                continue
+            if p.dtype != src_p.dtype:
+                p.data.copy_(stochastic_round(p.data.float() * self.alpha + src_p.data * one_minus_alpha, p.dtype))
+                continue
             p.data.mul_(self.alpha)
             p.data.add_(src_p.data * one_minus_alpha)
 
@@ -38,7 +59,7 @@ class MTSolver(Solver):
                  batch_size=36,
                  num_epochs=9999, max_iter_num=9999999, test_interval=500, test_mode=False, num_workers=2,
                  clean_log=False, lr=0.001, gamma=10, loss_weight=3.0, optimizer_type='SGD', confidence_thresh=0.968,
-                 rampup_epoch=80, use_CT=False):
+                 rampup_epoch=80, use_CT=False, teacher_dtype='fp32', shared_stages=0, **kwargs):
         super(MTSolver, self).__init__(
             dataset_type=dataset_type,
             source_domain=source_domain,
@@ -54,7 +75,8 @@ class MTSolver(Solver):
             clean_log=clean_log,
             lr=lr,
             gamma=gamma,
-            optimizer_type=optimizer_type
+            optimizer_type=optimizer_type,
+            **kwargs
         )
         self.model_name = 'MT'
         self.iter_num = 0
@@ -63,25 +85,29 @@ class MTSolver(Solver):
         self.rampup_epoch = rampup_epoch
         self.rampup_value = 0
         self.use_CT = use_CT
+        self.teacher_dtype = teacher_dtype
+        self.shared_stages = shared_stages
 
     def set_model(self):
         if self.dataset_type == 'Digits':
             self.confidence_thresh = 0.968
 
             if self.task in ['MtoU', 'UtoM']:
-                self.model = MT(n_classes=self.n_classes, base_model='DigitsMU')
+                self.model = MT(n_classes=self.n_classes, base_model='DigitsMU', teacher_dtype=self.teacher_dtype)
             if self.task in ['StoM']:
-                self.model = MT(n_classes=self.n_classes, base_model='DigitsStoM')
+                self.model = MT(n_classes=self.n_classes, base_model='DigitsStoM', teacher_dtype=self.teacher_dtype)
 
         if self.dataset_type == 'Office31':
             self.confidence_thresh = 0.90
             self.loss_weight = 10.0
-            self.model = MT(n_classes=self.n_classes, base_model='ResNet50')
+            self.model = MT(n_classes=self.n_classes, base_model='ResNet50', teacher_dtype=self.teacher_dtype,
+                            shared_stages=self.shared_stages)
 
         if self.dataset_type == 'OfficeHome':
             self.confidence_thresh = 0.90
             self.loss_weight = 10.0
-            self.model = MT(n_classes=self.n_classes, base_model='ResNet50')
+            self.model = MT(n_classes=self.n_classes, base_model='ResNet50', teacher_dtype=self.teacher_dtype,
+                            shared_stages=self.shared_stages)
 
         if self.pretrained:
             self.load_model(path=self.models_checkpoints_dir + '/' + self.model_name + '_best_test.pt')
@@ -115,6 +141,21 @@ class MTSolver(Solver):
 
         return 0, acc
 
+    def predict(self, inputs):
+        with torch.no_grad():
+            class_outputs = self.model(source_x=inputs, test_mode=True)
+            return nn.Softmax(dim=1)(class_outputs)
+
+    def get_deploy_model(self):
+        return SoftmaxClassifier(self.model.student)
+
+    def predict_pseudo_labels(self, inputs):
+        # training records the teacher outputs and skips the samples the teacher is saturated on, so the refresh
+        # uses the teacher as well and the store never mixes confidences of the two networks
+        with torch.no_grad(), self.model.teacher_autocast(inputs.device):
+            class_outputs = self.model.teacher(inputs, get_features=False, get_class_outputs=True)
+        return nn.Softmax(dim=1)(class_outputs.float())
+
     def set_optimizer(self):
         super(MTSolver, self).set_optimizer()
         self.teacher_optimizer = OldWeightEMA(self.model.teacher, self.model.student)
@@ -171,7 +212,7 @@ class MTSolver(Solver):
             if A:
                 theta[:, :, :2] += np.random.normal(scale=0.1, size=(N, 2, 2))
 
-        grid = F.affine_grid(theta=torch.from_numpy(theta), size=x.size())
+        grid = F.affine_grid(theta=torch.from_numpy(theta).to(x.device), size=x.size())
         new_x = F.grid_sample(input=x, grid=grid)
 
         return new_x
@@ -187,6 +228,7 @@ class MTSolver(Solver):
         total_target_num = len(self.data_loader['target']['train'].dataset)
         processed_target_num = 0
         total_source_num = 0
+        skipped_target_num = 0
         CT_pass_rate = 0
 
         if not self.use_CT:
@@ -198,7 +240,11 @@ class MTSolver(Solver):
                 self.rampup_value = 1.0
             print('ramup value = ', self.rampup_value)
 
-        for target_inputs, target_labels in self.data_loader['target']['train']:
+        source_iter = iter(self.cycle(self.data_loader['source']['train']))
+        for target_inputs, target_labels, target_indices in self.data_loader['target']['train']:
+            if self.reached_stop_iter():
+                break
+
             sys.stdout.write('\r{}/{}'.format(processed_target_num, total_target_num))
             sys.stdout.flush()
 
@@ -208,11 +254,20 @@ class MTSolver(Solver):
 
             # TODO 1 : Target Train
 
-            target_x1 = self.augment(target_inputs).to(self.device)
-            target_x2 = self.augment(target_inputs).to(self.device)
+            # samples the teacher already predicts with saturated confidence add almost nothing to the consistency loss
+            keep = self.select_unsaturated(target_indices)
+            if keep is not None:
+                keep = keep.cpu()
+                skipped_target_num += int((~keep).sum())
+                target_inputs, target_indices = target_inputs[keep], target_indices[keep]
+
+            target_inputs = self.prepare_train_inputs(target_inputs)
+            target_x1 = self.augment(target_inputs)
+            target_x2 = self.augment(target_inputs)
 
             target_y1, target_y2 = self.model(target_x1=target_x1, target_x2=target_x2, test_mode=False,
                                               is_source=False)
+            self.record_pseudo_labels(target_indices, target_y2)
 
             if self.use_CT:
                 aug_loss, CT_pass_rate = self.compute_aug_loss(target_y1, target_y2)
@@ -221,9 +276,8 @@ class MTSolver(Solver):
 
             # TODO 1 : Source Train
 
-            source_iter = iter(self.data_loader['source']['train'])
             source_inputs, source_labels = next(source_iter)
-            source_inputs = self.augment(source_inputs).to(self.device)
+            source_inputs = self.augment(self.prepare_train_inputs(source_inputs))
 
             source_y = self.model(source_x=source_inputs, test_mode=False, is_source=True)
             source_labels = source_labels.to(self.device)
@@ -250,6 +304,7 @@ class MTSolver(Solver):
             total_source_num += source_labels.size()[0]
             processed_target_num += target_labels.size()[0]
             self.iter_num += 1
+            self.end_iter()
 
         acc = source_corrects / total_source_num
         average_loss = total_loss / total_source_num
@@ -260,6 +315,9 @@ class MTSolver(Solver):
         if self.use_CT:
             print('CT pass rate : ', CT_pass_rate)
 
+        if self.saturation_thresh > 0:
+            print('Skipped saturated target samples :', skipped_target_num)
+
         print('loss weight :', self.loss_weight)
 
         if self.dataset_type in ['Office31', 'OfficeHome']:
@@ -1,11 +1,17 @@
 from __future__ import print_function, division
 
+import copy
+import json
+import math
 import time
 
-import pandas as pd
-from torch.utils.data import DataLoader
-
 from data_helpers.data_helper import *
+from data_helpers.data_loader import build_dataloader, tune_num_workers
+from data_helpers.samplers import ClassBalancedSampler, PseudoLabelSampler
+from solvers.memory import MemoryProfiler
+from solvers.pseudo_labels import PseudoLabelStore
+from solvers.schedules import MAX_STEPS, constant_schedule, grl_alpha_schedule, group_parameters, \
+    inv_lr_schedule
 
 
 
@@ -13,7 +19,12 @@ class Solver():
     def __init__(self, dataset_type, source_domain, target_domain, cuda='cuda:0',
                  pretrained=False, batch_size=32,
                  num_epochs=999999, max_iter_num=999999, test_interval=500, test_mode=False, num_workers=2,
-                 clean_log=False, lr=0.001, gamma=10, optimizer_type='SGD'):
+                 clean_log=False, lr=0.001, gamma=10, optimizer_type='SGD', use_shards=False,
+                 gpu_augment=False, eval_batch_size=0, pin_memory=None, persistent_workers=True, prefetch_factor=2,
+                 drop_last=False, worker_cpus=None, source_sampler='uniform', target_sampler='uniform',
+                 pseudo_label_interval=500, pseudo_label_fraction=1.0, saturation_thresh=0.0, time_budget=0,
+                 sample_budget=0, early_stop_patience=0, early_stop_metric='auto', early_stop_smoothing=0.6,
+                 early_stop_min_delta=0.001, memory_interval=0, memory_growth_thresh=50.0):
         self.dataset_type = dataset_type
         self.source_domain = source_domain
         self.target_domain = target_domain
@@ -30,6 +41,11 @@ class Solver():
         self.gamma = gamma
         self.lr = lr
         self.cur_lr = lr
+        self.cur_alpha = 0.0
+        # precomputed over the horizon of the run by set_schedules, before the first update_optimizer
+        self.lr_schedule = None
+        self.alpha_schedule = None
+        self.lr_groups = []
         self.model = None
         self.model_name = None
         self.scheduler = None
@@ -54,6 +70,7 @@ class Solver():
             'optimizer': [],
             'batch_size': [],
             'lr': [],
+            'alpha': [],
             'train_acc': [],
             'val_acc': [],
             'test_acc': [],
@@ -70,35 +87,189 @@ class Solver():
         self.logs_dir = ''
         self.models_checkpoints_dir = ''
         self.iter_num = 0
+        self.epoch = 0
+        # train_one_epoch stops before this iteration, e.g. at the end of a search rung, None : whole epochs
+        self.stop_iter = None
+        self.epoch_interrupted = False
+        self.epoch_start_iter = 0
         self.optimizer_type = optimizer_type
+        self.use_shards = use_shards
+        self.gpu_augment = gpu_augment
+        self.batch_augment = None
+
+        # DataLoader settings, eval_batch_size=0 and pin_memory=None are chosen from the batch size and device
+        self.eval_batch_size = eval_batch_size if eval_batch_size > 0 else 4 * batch_size
+        self.pin_memory = self.device.type == 'cuda' if pin_memory is None else pin_memory
+        self.persistent_workers = persistent_workers
+        self.prefetch_factor = prefetch_factor
+        self.drop_last = drop_last
+        self.worker_cpus = worker_cpus
+
+        # source_sampler : 'uniform' | 'balanced', target_sampler : 'uniform' | 'pseudo'
+        self.source_sampler = source_sampler
+        self.target_sampler = target_sampler
+        self.pseudo_label_interval = pseudo_label_interval
+        self.pseudo_label_sampler = None
+        self.pseudo_label_iter = 0
+
+        # pseudo-label store of the target train samples, refreshing pseudo_label_fraction of them (the stalest)
+        # every pseudo_label_interval iterations, saturation_thresh > 0 skips the samples predicted that confidently
+        self.pseudo_label_fraction = pseudo_label_fraction
+        self.saturation_thresh = saturation_thresh
+        self.pseudo_labels = None
+
+        # budget mode : the lr and alpha schedules run over time_budget seconds or sample_budget target samples
+        # instead of num_epochs / max_iter_num, early_stop_patience > 0 stops when the smoothed
+        # validation (Digits) or test accuracy has not improved for that many evaluations
+        self.time_budget = time_budget
+        self.sample_budget = sample_budget
+        self.early_stop_patience = early_stop_patience
+        self.early_stop_metric = early_stop_metric
+        self.early_stop_smoothing = early_stop_smoothing
+        self.early_stop_min_delta = early_stop_min_delta
+        self.train_since = None
+        self.smoothed_metric = None
+        self.best_smoothed_metric = None
+        self.plateau_count = 0
+        self.stop_reason = None
+
+        # memory_interval > 0 samples the RSS, the cuda allocator and the live tensors every memory_interval
+        # iterations into logs/<dataset>/<task>/<model>_memory.jsonl
+        self.memory_interval = memory_interval
+        self.memory_growth_thresh = memory_growth_thresh
+        self.memory_profiler = None
 
     def test(self, data_loader):
         raise NotImplementedError
 
+    def evaluate(self, data_loader):
+        with torch.no_grad():
+            return self.test(data_loader=data_loader)
+
+    def predict(self, inputs):
+        """Return the class probabilities of the deployed classifier for a batch of inputs."""
+        raise NotImplementedError
+
+    def get_deploy_model(self):
+        """Return the trained classifier as a module mapping inputs to class probabilities."""
+        raise NotImplementedError
+
     def train_one_epoch(self):
         raise NotImplementedError
 
+    def reached_stop_iter(self):
+        """
+        Checked before every step of train_one_epoch, the epoch is then left unfinished : the iteration limit of
+        search.py and the time / sample budgets, which would otherwise overrun by up to a whole epoch.
+        """
+        if self.stop_iter is not None and self.iter_num >= self.stop_iter:
+            self.epoch_interrupted = True
+            return True
+        # at least one step per epoch, its loss and accuracy are averaged over the steps
+        if self.train_since is not None and self.iter_num > self.epoch_start_iter and \
+                self.get_budget_stop_reason() is not None:
+            self.epoch_interrupted = True
+            return True
+        return False
+
+    def end_iter(self):
+        """Called by train_one_epoch at the end of every step, once iter_num counts it."""
+        if self.memory_profiler is not None:
+            self.memory_profiler.step(self.iter_num)
+
+    def get_progress(self):
+        """Training progress in [0, 1] driving the lr and alpha schedules, relative to the budget if there is one."""
+        if self.time_budget > 0:
+            return min((time.time() - self.train_since) / self.time_budget, 1.0)
+        if self.sample_budget > 0:
+            return min(self.iter_num * self.batch_size / self.sample_budget, 1.0)
+        if self.num_epochs != 999999:
+            return self.epoch / self.num_epochs
+        return self.iter_num / self.max_iter_num
+
+    def get_budget_stop_reason(self):
+        if self.time_budget > 0 and time.time() - self.train_since >= self.time_budget:
+            return 'time_budget'
+        if self.sample_budget > 0 and self.iter_num * self.batch_size >= self.sample_budget:
+            return 'sample_budget'
+        return None
+
+    def update_plateau(self, metric):
+        """Smooth the early stopping metric with an EMA, return True once it has plateaued."""
+        if self.smoothed_metric is None:
+            self.smoothed_metric = metric
+        else:
+            self.smoothed_metric = self.early_stop_smoothing * self.smoothed_metric + \
+                                   (1 - self.early_stop_smoothing) * metric
+
+        if self.best_smoothed_metric is None or \
+                self.smoothed_metric > self.best_smoothed_metric + self.early_stop_min_delta:
+            self.best_smoothed_metric = self.smoothed_metric
+            self.plateau_count = 0
+        else:
+            self.plateau_count += 1
+
+        return self.early_stop_patience > 0 and self.plateau_count >= self.early_stop_patience
+
+    def save_stop_summary(self, best_val_acc, best_test_acc):
+        if not os.path.exists(self.logs_dir):
+            os.makedirs(self.logs_dir)
+
+        path = os.path.join(self.logs_dir, self.model_name + '_stop.json')
+        with open(path, 'w') as f:
+            json.dump({
+                'stop_reason': self.stop_reason,
+                'iter': self.iter_num,
+                'epoch': self.epoch,
+                'samples': self.iter_num * self.batch_size,
+                'elapsed': time.time() - self.train_since,
+                'time_budget': self.time_budget,
+                'sample_budget': self.sample_budget,
+                'smoothed_metric': self.smoothed_metric,
+                'best_val_acc': best_val_acc,
+                'best_test_acc': best_test_acc,
+            }, f, indent=2)
+
+        print('Stop reason : {}, saved in {}'.format(self.stop_reason, path))
+
     def train(self, num_epochs):
         since = time.time()
+        if self.memory_interval > 0:
+            self.memory_profiler = MemoryProfiler(
+                path=os.path.join(self.logs_dir, self.model_name + '_memory.jsonl'),
+                interval=self.memory_interval,
+                growth_thresh=self.memory_growth_thresh,
+                device=self.device
+            )
 
         self.iter_num = 0
         log_iter = 0
+        stop_metric = self.early_stop_metric
+        if stop_metric == 'auto':
+            stop_metric = 'val' if self.dataset_type == 'Digits' else 'test'
 
-        best_val_loss, best_val_acc = self.test(
+        best_val_loss, best_val_acc = self.evaluate(
             data_loader=self.data_loader['source']['test'],
         )
 
         print('Initial Train Loss: {:.4f} Acc: {:.4f}\n'.format(best_val_loss, best_val_acc))
         print()
 
-        best_test_loss, best_test_acc = self.test(
+        best_test_loss, best_test_acc = self.evaluate(
             data_loader=self.data_loader['target']['test'],
         )
         print('Initial Test Loss: {:.4f} Acc: {:.4f}\n'.format(best_test_loss, best_test_acc))
         print()
 
+        # the time budget only counts training, not the initial evaluations
+        self.train_since = time.time()
+
+        self.epoch = 0
         for epoch in range(num_epochs):
             self.epoch = epoch
+            self.epoch_interrupted = False
+            self.epoch_start_iter = self.iter_num
+            plateaued = False
             print('\nEpoch {}/{}'.format(epoch, num_epochs - 1), '\n', '-' * 10)
             print('iteration : {}\n'.format(self.iter_num))
 
@@ -107,12 +278,18 @@ class Solver():
 
             print('Train Loss: {:.4f} Acc: {:.4f}\n'.format(train_loss, train_acc))
 
+            # a budget stopped the epoch, it is the last one
+            if not self.epoch_interrupted:
+                self.update_pseudo_labels()
+
             # TODO 2 : Validation
             val_acc = val_loss = 0
             if self.dataset_type == 'Digits':
 
-                val_loss, val_acc = self.test(data_loader=self.data_loader['source']['test'], )
+                val_loss, val_acc = self.evaluate(data_loader=self.data_loader['source']['test'], )
                 print('Val Loss: {:.4f} Acc: {:.4f}\n'.format(val_loss, val_acc))
+                if stop_metric == 'val':
+                    plateaued = self.update_plateau(val_acc)
 
                 if val_acc >= best_val_acc:
                     best_val_acc = val_acc
@@ -122,9 +299,11 @@ class Solver():
             # TODO 3 : Test
             if self.iter_num - log_iter >= self.test_interval:
                 log_iter = self.iter_num
-                test_loss, test_acc = self.test(data_loader=self.data_loader['target']['test'])
+                test_loss, test_acc = self.evaluate(data_loader=self.data_loader['target']['test'])
 
                 print('Test Loss: {:.4f} Acc: {:.4f}\n'.format(test_loss, test_acc))
+                if stop_metric == 'test':
+                    plateaued = self.update_plateau(test_acc)
 
                 if test_acc >= best_test_acc:
                     best_test_acc = test_acc
@@ -136,12 +315,28 @@ class Solver():
 
             print('Cuda :', self.device, 'Current Best Test Acc : {:4f}'.format(best_test_acc))
             if self.iter_num >= self.max_iter_num:
+                self.stop_reason = 'max_iter'
+                break
+            self.stop_reason = self.get_budget_stop_reason()
+            if self.stop_reason is not None:
+                break
+            if plateaued:
+                self.stop_reason = 'plateau'
+                print('Smoothed {} acc {:.4f} has not improved for {} evaluations'.format(
+                    stop_metric, self.smoothed_metric, self.plateau_count))
                 break
             print('Optimizer :', self.optimizer_type, 'Cur lr : ', self.cur_lr, '\n\n')
 
+        if self.stop_reason is None:
+            self.stop_reason = 'num_epochs'
+
         time_elapsed = time.time() - since
         print('Training complete in {:.0f}m {:.0f}s'.format(time_elapsed // 60, time_elapsed % 60))
         print('Best Val Acc : {:4f}, Test Acc : {:4f}'.format(best_val_acc, best_test_acc))
+        self.save_stop_summary(best_val_acc, best_test_acc)
+        if self.memory_profiler is not None:
+            self.memory_profiler.sample(self.iter_num)
+            self.memory_profiler.summary()
 
     def set_model(self):
         raise NotImplementedError
@@ -150,71 +345,209 @@ class Solver():
         if self.optimizer_type == 'Adam':
             self.optimizer_type = 'Adam'
             self.optimizer = torch.optim.Adam(
-                params=self.model.get_parameters(),
+                params=group_parameters(self.model.get_parameters()),
                 lr=self.lr,
                 weight_decay=0.0005
             )
         else:
             self.optimizer_type = 'SGD'
             self.optimizer = torch.optim.SGD(
-                self.model.get_parameters(),
+                group_parameters(self.model.get_parameters()),
                 lr=self.lr,
                 momentum=0.9,
                 weight_decay=0.0005,
                 nesterov=True
             )
-
-    def update_optimizer(self, power=0.75, weight_decay=0.0005):
-        """Decay learning rate by a factor of 0.1 every lr_decay_epoch epochs."""
+        self.lr_schedule = None
+
+    def get_optimizers(self):
+        return [self.optimizer]
+
+    def get_schedule_steps(self):
+        """Steps of the schedule tables, one per iteration or epoch of the run when its horizon is known."""
+        if self.time_budget > 0:
+            return MAX_STEPS
+        if self.sample_budget > 0:
+            return min(int(math.ceil(self.sample_budget / self.batch_size)), MAX_STEPS)
+        if self.num_epochs != 999999:
+            return min(self.num_epochs, MAX_STEPS)
+        return min(self.max_iter_num, MAX_STEPS)
+
+    def set_schedules(self, power=0.75, delta=10.0):
+        steps = self.get_schedule_steps()
         if self.optimizer_type == 'SGD':
-            if self.num_epochs != 999999:
-                p = self.epoch / self.num_epochs
-            else:
-                p = self.iter_num / self.max_iter_num
-
-            lr = self.lr * (1.0 + self.gamma * p) ** (-power)
+            self.lr_schedule = inv_lr_schedule(self.lr, self.gamma, steps, power=power)
         else:
-            lr = self.lr
+            self.lr_schedule = constant_schedule(self.lr)
+        self.alpha_schedule = grl_alpha_schedule(steps, delta=delta)
+
+        # the weight decay of the groups is set once by group_parameters, only the lr changes
+        self.lr_groups = [(param_group, param_group['lr_mult'])
+                          for optimizer in self.get_optimizers() for param_group in optimizer.param_groups]
+        self.cur_lr = None
+
+    def update_optimizer(self):
+        if self.lr_schedule is None:
+            self.set_schedules()
+
+        lr = self.lr_schedule(self.get_progress())
+        if lr == self.cur_lr:
+            return
 
         self.cur_lr = lr
+        for param_group, lr_mult in self.lr_groups:
+            param_group['lr'] = lr * lr_mult
+
+    def get_alpha(self):
+        if self.alpha_schedule is None:
+            self.set_schedules()
 
-        for param_group in self.optimizer.param_groups:
-            param_group['lr'] = lr * param_group['lr_mult']
-            param_group['weight_decay'] = weight_decay * param_group['decay_mult']
+        self.cur_alpha = self.alpha_schedule(self.get_progress())
+        return self.cur_alpha
+
+    def prepare_train_inputs(self, inputs):
+        """Move a training batch to the device, applying the batched Office augmentation when it is enabled."""
+        inputs = inputs.to(self.device, non_blocking=True)
+        if self.batch_augment is not None:
+            inputs = self.batch_augment(inputs)
+        return inputs
 
     def set_dataloader(self):
-        self.data_loader['source']['train'] = DataLoader(
-            self.source_data['train'],
-            batch_size=self.batch_size,
-            shuffle=True,
-            num_workers=self.num_workers,
-        )
-        self.data_loader['source']['test'] = DataLoader(
-            self.source_data['test'],
-            batch_size=self.batch_size,
-            shuffle=False,
-            num_workers=self.num_workers
-        )
+        if self.gpu_augment and self.dataset_type in ['Office31', 'OfficeHome']:
+            self.batch_augment = BatchRandomResizedCrop(crop_size=224).to(self.device)
+
+        # num_workers < 0 : measure a few worker counts on this host and keep the fastest
+        if self.num_workers < 0:
+            self.num_workers = tune_num_workers(
+                self.source_data['train'],
+                batch_size=self.batch_size,
+                key='{}:{}:{}'.format(self.dataset_type, self.source_domain, self.batch_size),
+                pin_memory=self.pin_memory,
+                prefetch_factor=self.prefetch_factor,
+                worker_cpus=self.worker_cpus
+            )
 
-        self.data_loader['target']['train'] = DataLoader(
-            self.target_data['train'],
-            batch_size=self.batch_size,
-            shuffle=True,
+        self.data_loader['source']['train'] = self.make_dataloader(self.source_data['train'], train=True,
+                                                                   sampler=self.make_source_sampler())
+        self.data_loader['source']['test'] = self.make_dataloader(self.source_data['test'], train=False)
+        # target train samples return their index, the key of the pseudo-label store
+        self.data_loader['target']['train'] = self.make_dataloader(make_indexed_dataset(self.target_data['train']),
+                                                                   train=True, sampler=self.make_target_sampler())
+        self.data_loader['target']['test'] = self.make_dataloader(self.target_data['test'], train=False)
+
+        if self.pseudo_label_sampler is not None or self.saturation_thresh > 0:
+            self.pseudo_labels = PseudoLabelStore(len(self.target_data['train']), self.n_classes, device=self.device)
+
+    def make_source_sampler(self):
+        if self.source_sampler != 'balanced':
+            return None
+        if isinstance(self.source_data['train'], data.IterableDataset):
+            print('Sharded datasets are read sequentially, source_sampler = {} is ignored'.format(self.source_sampler))
+            return None
+        return ClassBalancedSampler(self.source_data['train'])
+
+    def make_target_sampler(self):
+        if self.target_sampler != 'pseudo':
+            return None
+        if isinstance(self.target_data['train'], data.IterableDataset):
+            print('Sharded datasets are read sequentially, target_sampler = {} is ignored'.format(self.target_sampler))
+            return None
+        self.pseudo_label_sampler = PseudoLabelSampler(self.target_data['train'])
+        return self.pseudo_label_sampler
+
+    def get_target_eval_dataset(self):
+        """The target train images with the test transform, i.e. without augmentation."""
+        dataset = copy.copy(self.target_data['train'])
+        dataset.transform = self.target_data['test'].transform
+        if isinstance(dataset, ShardedImageDataset):
+            dataset.shuffle = False
+        return dataset
+
+    def update_pseudo_labels(self):
+        # the sampler draws the indices of a whole epoch at once, so pseudo-labels are refreshed between epochs
+        if self.pseudo_labels is not None and self.iter_num - self.pseudo_label_iter >= self.pseudo_label_interval:
+            self.pseudo_label_iter = self.iter_num
+            self.refresh_pseudo_labels()
+
+    def refresh_pseudo_labels(self):
+        since = time.time()
+        self.model.eval()
+
+        dataset = make_indexed_dataset(self.get_target_eval_dataset())
+        # sharded datasets cannot be subset, they are always refreshed entirely
+        if self.pseudo_label_fraction < 1.0 and not isinstance(dataset, data.IterableDataset):
+            indices = self.pseudo_labels.stalest(int(math.ceil(self.pseudo_label_fraction * len(dataset))))
+            dataset = data.Subset(dataset, indices.tolist())
+        data_loader = self.make_dataloader(dataset, train=False)
+
+        for inputs, _, indices in data_loader:
+            probs = self.predict_pseudo_labels(inputs.to(self.device, non_blocking=True))
+            self.pseudo_labels.update(indices, probs, self.iter_num)
+
+        self.model.train()
+
+        # the sampler only stratifies once every target sample has a pseudo-label
+        if self.pseudo_label_sampler is not None and self.pseudo_labels.is_complete():
+            self.pseudo_label_sampler.update(self.pseudo_labels.labels.cpu())
+
+        seen_num, mean_confidence, saturated_num = self.pseudo_labels.summary(self.saturation_thresh)
+        print('Refresh {} target pseudo-labels, {}/{} predicted, mean confidence {:.4f}, {} saturated, using {:4f}\n'
+              .format(len(dataset), seen_num, self.pseudo_labels.data_num, mean_confidence, saturated_num,
+                      time.time() - since))
+
+    def predict_pseudo_labels(self, inputs):
+        """Class probabilities refreshing the store, from the network whose outputs record_pseudo_labels gets."""
+        return self.predict(inputs)
+
+    def record_pseudo_labels(self, indices, class_outputs):
+        """Update the store with target predictions computed during training anyway."""
+        if self.pseudo_labels is not None:
+            self.pseudo_labels.update(indices, F.softmax(class_outputs.detach(), dim=1), self.iter_num)
+
+    def select_unsaturated(self, indices):
+        """Mask of the target samples still worth training on, None when nothing is skipped."""
+        if self.pseudo_labels is None or self.saturation_thresh <= 0:
+            return None
+        mask = ~self.pseudo_labels.saturated(indices, self.saturation_thresh)
+        # never skip a whole batch
+        if not mask.any():
+            return None
+        return mask
+
+    def make_dataloader(self, dataset, train=True, sampler=None):
+        return build_dataloader(
+            dataset,
+            batch_size=self.batch_size if train else self.eval_batch_size,
+            train=train,
             num_workers=self.num_workers,
+            pin_memory=self.pin_memory,
+            persistent_workers=self.persistent_workers,
+            prefetch_factor=self.prefetch_factor,
+            drop_last=self.drop_last,
+            worker_cpus=self.worker_cpus,
+            sampler=sampler
         )
 
-        self.data_loader['target']['test'] = DataLoader(
-            self.target_data['test'],
-            batch_size=self.batch_size,
-            shuffle=False,
-            num_workers=self.num_workers,
-        )
+    def set_task(self):
+        if self.dataset_type == 'Digits':
+            self.n_classes = 10
+            self.task = self.source_domain[0] + 'to' + self.target_domain[0]
+
+        if self.dataset_type == 'Office31':
+            self.n_classes = 31
+            self.task = self.source_domain[0] + 'to' + self.target_domain[0]
+
+        if self.dataset_type == 'OfficeHome':
+            self.n_classes = 65
+            self.task = self.source_domain[:2] + 'to' + self.target_domain[:2]
+
+        self.models_checkpoints_dir = './models_checkpoints/' + self.dataset_type + '/' + self.task
 
     def load_dataset(self):
         # TODO 1 : Load Dataset
+        self.set_task()
+
         if self.dataset_type == 'Digits':
-            self.n_classes = 10
-            self.task = self.source_domain[0] + 'to' + self.target_domain[0]
             if self.task == 'MtoU':
                 self.source_data = load_MNIST(root_dir='./data/Digits/MNIST')
                 self.target_data = load_USPS(root_dir='./data/Digits/USPS')
@@ -228,16 +561,16 @@ class Solver():
                 self.target_data = load_MNIST(root_dir='./data/Digits/MNIST', resize_size=32, Gray_to_RGB=True)
 
         if self.dataset_type == 'Office31':
-            self.n_classes = 31
-            self.task = self.source_domain[0] + 'to' + self.target_domain[0]
-            self.source_data = load_Office('./data/Office31', domain=self.source_domain)
-            self.target_data = load_Office('./data/Office31', domain=self.target_domain)
+            self.source_data = load_Office('./data/Office31', domain=self.source_domain, use_shards=self.use_shards,
+                                           gpu_augment=self.gpu_augment)
+            self.target_data = load_Office('./data/Office31', domain=self.target_domain, use_shards=self.use_shards,
+                                           gpu_augment=self.gpu_augment)
 
         if self.dataset_type == 'OfficeHome':
-            self.n_classes = 65
-            self.task = self.source_domain[:2] + 'to' + self.target_domain[:2]
-            self.source_data = load_Office('./data/OfficeHome', domain=self.source_domain)
-            self.target_data = load_Office('./data/OfficeHome', domain=self.target_domain)
+            self.source_data = load_Office('./data/OfficeHome', domain=self.source_domain, use_shards=self.use_shards,
+                                           gpu_augment=self.gpu_augment)
+            self.target_data = load_Office('./data/OfficeHome', domain=self.target_domain, use_shards=self.use_shards,
+                                           gpu_augment=self.gpu_augment)
 
         print('Source domain :{}, Train Data size:{} Test Data size:{}'.format(self.source_domain,
                                                                                len(self.source_data['train']),
@@ -254,7 +587,6 @@ class Solver():
         self.set_dataloader()
 
         # TODO 3 : set model
-        self.models_checkpoints_dir = './models_checkpoints/' + self.dataset_type + '/' + self.task
         if not os.path.exists(self.models_checkpoints_dir):
             os.makedirs(self.models_checkpoints_dir)
 
@@ -268,13 +600,7 @@ class Solver():
         self.logs_dir = './logs/' + self.dataset_type + '/' + self.task
 
         if self.test_mode:
-            self.test(
-                data_loader=torch.utils.data.DataLoader(
-                    self.target_data['test'],
-                    batch_size=self.batch_size,
-                    shuffle=False, num_workers=self.num_workers
-                )
-            )
+            self.evaluate(data_loader=self.data_loader['target']['test'])
         else:
             self.train(num_epochs=self.num_epochs)
 
@@ -288,6 +614,7 @@ class Solver():
         self.log['optimizer'].append(self.optimizer_type)
         self.log['batch_size'].append(self.batch_size)
         self.log['lr'].append(self.cur_lr)
+        self.log['alpha'].append(self.cur_alpha)
         self.log['train_acc'].append('%.4f' % train_acc)
         self.log['val_acc'].append('%.4f' % val_acc)
         self.log['test_acc'].append('%.4f' % test_acc)
@@ -296,6 +623,8 @@ class Solver():
         self.log['test_loss'].append('%.4f' % test_loss)
 
     def save_log(self):
+        import pandas as pd
+
         if not os.path.exists(self.logs_dir):
             os.makedirs(self.logs_dir)
 
@@ -303,7 +632,7 @@ class Solver():
 
         log = pd.DataFrame(
             data=self.log,
-            columns=['time', 'iter', 'epoch', 'source', 'target', 'model', 'optimizer', 'batch_size', 'lr', 'train_acc',
+            columns=['time', 'iter', 'epoch', 'source', 'target', 'model', 'optimizer', 'batch_size', 'lr', 'alpha', 'train_acc',
                      'val_acc',
                      'test_acc',
                      'train_loss', 'val_loss', 'test_loss']
@@ -320,11 +649,44 @@ class Solver():
 
     def load_model(self, path):
         if os.path.exists(path):
-            self.model.load_state_dict(torch.load(path))
+            self.model.load_state_dict(torch.load(path, map_location=self.device))
             print('Read model in {} successfully\n'.format(path))
         else:
             print('Cannot find {}, use the initial model\n'.format(path))
 
+    def save_checkpoint(self, path):
+        """Model, optimizers and counters, enough to continue training with the same schedules."""
+        checkpoint = {
+            'model': self.model.state_dict(),
+            'optimizers': {name: value.state_dict() for name, value in vars(self).items()
+                           if isinstance(value, torch.optim.Optimizer)},
+            'iter_num': self.iter_num,
+            'epoch': self.epoch,
+        }
+        if self.lr_schedule is not None:
+            checkpoint['schedules'] = {'lr': self.lr_schedule.state_dict(), 'alpha': self.alpha_schedule.state_dict()}
+        if self.pseudo_labels is not None:
+            checkpoint['pseudo_labels'] = self.pseudo_labels.state_dict()
+            checkpoint['pseudo_label_iter'] = self.pseudo_label_iter
+        torch.save(checkpoint, path)
+
+    def load_checkpoint(self, path):
+        checkpoint = torch.load(path, map_location=self.device)
+        self.model.load_state_dict(checkpoint['model'])
+        for name, state in checkpoint['optimizers'].items():
+            getattr(self, name).load_state_dict(state)
+        self.iter_num = checkpoint['iter_num']
+        self.epoch = checkpoint['epoch']
+        if 'schedules' in checkpoint:
+            self.set_schedules()
+            self.lr_schedule.load_state_dict(checkpoint['schedules']['lr'])
+            self.alpha_schedule.load_state_dict(checkpoint['schedules']['alpha'])
+        if self.pseudo_labels is not None and 'pseudo_labels' in checkpoint:
+            self.pseudo_labels.load_state_dict(checkpoint['pseudo_labels'])
+            self.pseudo_label_iter = checkpoint['pseudo_label_iter']
+            if self.pseudo_label_sampler is not None and self.pseudo_labels.is_complete():
+                self.pseudo_label_sampler.update(self.pseudo_labels.labels.cpu())
+
     def cycle(self, iterable):
         while True:
             for x in iterable:
@@ -0,0 +1,34 @@
+import os
+
+from solvers.registry import get_solver_class
+
+
+def load_trained_solver(model, dataset_type, source_domain, target_domain, cuda='cuda:0', checkpoint='',
+                        batch_size=256, num_workers=2):
+    """Build the network of a solver and load its checkpoint, without loading any dataset.
+
+    The checkpoint defaults to ./models_checkpoints/<dataset>/<task>/<model>_best_test.pt
+    """
+    solver = get_solver_class(model)(
+        dataset_type=dataset_type,
+        source_domain=source_domain,
+        target_domain=target_domain,
+        cuda=cuda,
+        pretrained=False,
+        test_mode=True,
+        batch_size=batch_size,
+        num_workers=num_workers
+    )
+    solver.set_task()
+    solver.set_model()
+
+    if checkpoint == '':
+        checkpoint = os.path.join(solver.models_checkpoints_dir, solver.model_name + '_best_test.pt')
+
+    if not os.path.exists(checkpoint):
+        raise FileNotFoundError('Cannot find checkpoint {}'.format(checkpoint))
+
+    solver.load_model(path=checkpoint)
+    solver.model.eval()
+
+    return solver
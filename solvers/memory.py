@@ -0,0 +1,149 @@
+import collections
+import gc
+import json
+import os
+import resource
+import time
+import warnings
+
+import torch
+
+
+def get_rss():
+    """Current resident set size of the process in MB, the peak one where /proc is missing."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def get_live_tensors():
+    """(dtype, device, shape) -> (count, MB) of the tensors reachable by the garbage collector."""
+    tensors = collections.defaultdict(lambda: [0, 0.0])
+    with warnings.catch_warnings():
+        # isinstance on some deprecated torch objects warns
+        warnings.simplefilter('ignore')
+        objects = [obj for obj in gc.get_objects() if isinstance(obj, torch.Tensor)]
+
+    for obj in objects:
+        key = '{} {} {}'.format(str(obj.dtype).replace('torch.', ''), obj.device, tuple(obj.shape))
+        tensors[key][0] += 1
+        tensors[key][1] += obj.numel() * obj.element_size() / 1e6
+    return tensors
+
+
+def get_slope(xs, ys):
+    """Least squares slope of ys over xs."""
+    n = len(xs)
+    mean_x, mean_y = sum(xs) / n, sum(ys) / n
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+
+
+class MemoryProfiler(object):
+    """
+    Sample the RSS, the cuda allocator and the live tensors every interval iterations into a json lines trace,
+    and warn when the RSS grows faster than growth_thresh MB per 1k iterations, again only once the growth has
+    doubled since the last warning.
+    """
+
+    def __init__(self, path, interval=500, growth_thresh=50.0, device=torch.device('cpu'), top_shapes=10,
+                 warmup_samples=2):
+        self.path = path
+        self.interval = interval
+        self.growth_thresh = growth_thresh
+        self.device = device
+        self.top_shapes = top_shapes
+        # the first samples include the allocator and DataLoader warm up, they are left out of the growth
+        self.warmup_samples = warmup_samples
+
+        self.samples = []
+        self.first_tensors = None
+        self.last_tensors = None
+        self.last_iter = None
+        self.warned_growth = None
+
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+    def step(self, iter_num):
+        if self.last_iter is not None and iter_num - self.last_iter < self.interval:
+            return
+        self.last_iter = iter_num
+        self.sample(iter_num)
+
+    def sample(self, iter_num):
+        since = time.time()
+        gc.collect()
+        tensors = get_live_tensors()
+
+        sample = {
+            'time': time.time(),
+            'iter': iter_num,
+            'rss': get_rss(),
+            'tensor_num': sum(count for count, _ in tensors.values()),
+            'tensor_mb': sum(size for _, size in tensors.values()),
+        }
+        if self.device.type == 'cuda':
+            sample['cuda_allocated'] = torch.cuda.memory_allocated(self.device) / 1e6
+            sample['cuda_reserved'] = torch.cuda.memory_reserved(self.device) / 1e6
+            sample['cuda_max_allocated'] = torch.cuda.max_memory_allocated(self.device) / 1e6
+        sample['top_shapes'] = [[key, count, size] for key, (count, size) in
+                                sorted(tensors.items(), key=lambda item: -item[1][1])[:self.top_shapes]]
+        sample['using'] = time.time() - since
+
+        if len(self.samples) == self.warmup_samples:
+            self.first_tensors = tensors
+        self.last_tensors = tensors
+        self.samples.append(sample)
+
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(sample) + '\n')
+
+        growth = self.get_growth()
+        if growth is not None and growth > max(self.growth_thresh, 2 * (self.warned_growth or 0.0)):
+            print('\nWarning : RSS grows {:.1f}MB per 1k iterations (> {:.1f}MB) at iter {}, RSS {:.1f}MB, '
+                  '{} live tensors'.format(growth, self.growth_thresh, iter_num, sample['rss'], sample['tensor_num']))
+            self.warned_growth = growth
+
+    def get_growth(self, key='rss'):
+        """Growth of a sampled value per 1k iterations after the warm up, None until there are 2 samples."""
+        samples = self.samples[self.warmup_samples:]
+        if len(samples) < 2:
+            return None
+        return get_slope([s['iter'] for s in samples], [s[key] for s in samples]) * 1000
+
+    def summary(self):
+        if not self.samples:
+            return
+
+        rss = [s['rss'] for s in self.samples]
+        growth = self.get_growth()
+        tensor_growth = self.get_growth('tensor_num')
+        print('Memory : RSS {:.1f}MB -> {:.1f}MB, peak {:.1f}MB over {} samples, growth {} MB / {} tensors '
+              'per 1k iterations{}'.format(
+                rss[0], rss[-1], max(rss), len(rss),
+                '-' if growth is None else '{:.1f}'.format(growth),
+                '-' if tensor_growth is None else '{:.1f}'.format(tensor_growth),
+                ', above the threshold' if growth is not None and growth > self.growth_thresh else ''))
+
+        if self.device.type == 'cuda':
+            print('Cuda : allocated {:.1f}MB, reserved {:.1f}MB, peak {:.1f}MB'.format(
+                self.samples[-1]['cuda_allocated'], self.samples[-1]['cuda_reserved'],
+                self.samples[-1]['cuda_max_allocated']))
+
+        # tensor shapes whose count grew the most since the warm up, the usual suspects of a leak
+        if self.first_tensors is not None:
+            grown = []
+            for key, (count, size) in self.last_tensors.items():
+                first_count, first_size = self.first_tensors.get(key, (0, 0.0))
+                if count > first_count:
+                    grown.append((size - first_size, count - first_count, key))
+            for size, count, key in sorted(grown, reverse=True)[:self.top_shapes]:
+                print('    +{} tensors {} (+{:.2f}MB)'.format(count, key, size))
+
+        print('Memory trace saved in {}'.format(self.path))
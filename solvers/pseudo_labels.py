@@ -0,0 +1,66 @@
+import torch
+
+
+class PseudoLabelStore(object):
+    """
+    Latest class probabilities of every target train sample, indexed by the sample index the target
+    train loader returns. Refreshed in chunks of the stalest samples, or online from the target
+    predictions a solver computes anyway during training.
+    """
+
+    def __init__(self, data_num, n_classes, device='cpu'):
+        self.data_num = data_num
+        self.n_classes = n_classes
+        self.device = device
+
+        self.probs = torch.full((data_num, n_classes), 1.0 / n_classes, device=device)
+        self.confidences = torch.zeros(data_num, device=device)
+        self.labels = torch.full((data_num,), -1, dtype=torch.long, device=device)
+        # iteration of the last update of every sample, -1 : never predicted
+        self.updated_iter = torch.full((data_num,), -1, dtype=torch.long, device=device)
+
+    def update(self, indices, probs, iter_num):
+        indices = indices.to(self.device)
+        probs = probs.detach().to(self.device, dtype=self.probs.dtype)
+        confidences, labels = torch.max(probs, 1)
+
+        self.probs[indices] = probs
+        self.confidences[indices] = confidences
+        self.labels[indices] = labels
+        self.updated_iter[indices] = iter_num
+
+    def get(self, indices):
+        indices = indices.to(self.device)
+        return self.probs[indices], self.confidences[indices]
+
+    def saturated(self, indices, thresh):
+        """Mask of the samples whose cached confidence reaches thresh."""
+        return self.confidences[indices.to(self.device)] >= thresh
+
+    def stalest(self, num):
+        """Indices of the num samples updated the longest time ago, never predicted ones first."""
+        num = min(num, self.data_num)
+        return torch.argsort(self.updated_iter, stable=True)[:num].cpu()
+
+    def is_complete(self):
+        return bool((self.updated_iter >= 0).all())
+
+    def summary(self, thresh=0.0):
+        seen = self.updated_iter >= 0
+        seen_num = int(seen.sum())
+        mean_confidence = self.confidences[seen].mean().item() if seen_num > 0 else 0.0
+        saturated_num = int((self.confidences[seen] >= thresh).sum()) if thresh > 0 else 0
+        return seen_num, mean_confidence, saturated_num
+
+    def state_dict(self):
+        return {
+            'probs': self.probs.cpu(),
+            'updated_iter': self.updated_iter.cpu()
+        }
+
+    def load_state_dict(self, state_dict):
+        self.probs = state_dict['probs'].to(self.device)
+        self.updated_iter = state_dict['updated_iter'].to(self.device)
+        self.confidences, self.labels = torch.max(self.probs, 1)
+        self.labels[self.updated_iter < 0] = -1
+        self.confidences[self.updated_iter < 0] = 0
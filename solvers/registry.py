@@ -0,0 +1,25 @@
+import importlib
+
+# model name -> (module, class, solver arguments besides the ones shared by every solver)
+SOLVERS = {
+    'Baseline': ('solvers.BaselineSolver', 'BaselineSolver', []),
+    'DANN': ('solvers.DANNSolver', 'DANNSolver', ['use_augment']),
+    'MADA': ('solvers.MADASolver', 'MADASolver', ['loss_weight']),
+    'MCD': ('solvers.MCDSolver', 'MCDSolver', ['num_k']),
+    'MMD': ('solvers.MMDSolver', 'MMDSolver', ['align_loss', 'loss_weight']),
+    'MT': ('solvers.MTSolver', 'MTSolver', ['use_CT', 'teacher_dtype', 'shared_stages']),
+    'Distill': ('solvers.DistillSolver', 'DistillSolver', ['teacher', 'teacher_checkpoint', 'student', 'temperature']),
+}
+
+
+def get_solver_class(model):
+    """Import the solver of a model only when it is selected."""
+    if model not in SOLVERS:
+        raise ValueError('Unknown model {}, choose from {}'.format(model, list(SOLVERS.keys())))
+
+    module_name, class_name, _ = SOLVERS[model]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_solver_args(model):
+    return SOLVERS[model][2]
@@ -0,0 +1,51 @@
+import numpy as np
+
+# longest schedule table, longer horizons and time budgets are looked up at this resolution of the progress
+MAX_STEPS = 100000
+
+
+class Schedule(object):
+    """Values of a schedule precomputed at the progress 0, 1 / steps, ..., 1 and looked up by the training progress."""
+
+    def __init__(self, fn, steps):
+        self.steps = steps
+        self.values = np.asarray(fn(np.linspace(0.0, 1.0, steps + 1)), dtype=np.float64).tolist()
+
+    def __call__(self, progress):
+        return self.values[min(int(progress * self.steps + 0.5), self.steps)]
+
+    def state_dict(self):
+        return {'steps': self.steps, 'values': self.values}
+
+    def load_state_dict(self, state_dict):
+        self.steps = state_dict['steps']
+        self.values = list(state_dict['values'])
+
+
+def inv_lr_schedule(lr, gamma, steps, power=0.75):
+    """lr * (1 + gamma * p) ^ -power, the annealing of DANN (Ganin & Lempitsky 2015)."""
+    return Schedule(lambda p: lr * (1.0 + gamma * p) ** (-power), steps)
+
+
+def constant_schedule(value):
+    return Schedule(lambda p: np.full_like(p, value), 1)
+
+
+def grl_alpha_schedule(steps, delta=10.0):
+    """2 / (1 + exp(-delta * p)) - 1, the weight of the reversed gradients, from 0 to 1."""
+    return Schedule(lambda p: 2.0 / (1.0 + np.exp(-delta * p)) - 1.0, steps)
+
+
+def group_parameters(parameters, weight_decay=0.0005):
+    """
+    Merge the parameter groups of get_parameters() with the same lr_mult and decay_mult, e.g. the 65 domain
+    classifiers of MADA on OfficeHome become one group, and set their weight decay once.
+    """
+    groups = {}
+    for group in parameters:
+        key = (group['lr_mult'], group['decay_mult'])
+        if key not in groups:
+            groups[key] = {'params': [], 'lr_mult': key[0], 'decay_mult': key[1],
+                           'weight_decay': weight_decay * key[1]}
+        groups[key]['params'] += list(group['params'])
+    return list(groups.values())
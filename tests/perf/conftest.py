@@ -0,0 +1,123 @@
+"""
+CPU timings of the network forward / backward passes and of the solver steps, compared with baseline.json.
+
+    $ PERF=1 python -m pytest tests/perf -q
+    $ PERF_UPDATE_BASELINE=1 python -m pytest tests/perf -q    # record the timings of this host as the baseline
+    $ PERF=1 PERF_NUM_THREADS=4 python -m pytest tests/perf -q    # time with 4 intra-op threads (default 1)
+
+Wall-clock assertions fail on a loaded host, so the suite is opt-in : without PERF=1 (or PERF_UPDATE_BASELINE=1)
+its tests are collected and skipped.
+
+Every timing is divided by the one of a reference matmul measured in the same session, so the baseline of one
+host roughly carries over to another one. A test fails when its relative timing is more than PERF_TOLERANCE
+(default 0.5, i.e. 50%) above the baseline. Timings depend on the intra-op thread count, so the baseline keeps
+one set of timings per thread count and only the set of the current count is compared.
+"""
+import json
+import os
+import sys
+import time
+
+import pytest
+import torch
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+TOLERANCE = float(os.environ.get('PERF_TOLERANCE', '0.5'))
+UPDATE_BASELINE = os.environ.get('PERF_UPDATE_BASELINE', '') == '1'
+RUN_PERF = os.environ.get('PERF', '') == '1' or UPDATE_BASELINE
+NUM_THREADS = int(os.environ.get('PERF_NUM_THREADS', '1'))
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'perf: wall-clock timing test, only run with PERF=1')
+
+
+def pytest_collection_modifyitems(config, items):
+    perf_dir = os.path.dirname(os.path.abspath(__file__))
+    for item in items:
+        if not str(item.fspath).startswith(perf_dir + os.sep):
+            continue
+        item.add_marker(pytest.mark.perf)
+        if not RUN_PERF:
+            item.add_marker(pytest.mark.skip(reason='timing test, run it with PERF=1 on an otherwise idle host'))
+
+
+def measure(fn, warmup=2, repeats=5):
+    """Median time of fn in seconds."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        since = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - since)
+    return sorted(times)[len(times) // 2]
+
+
+def measure_reference():
+    a, b = torch.randn(1024, 1024), torch.randn(1024, 1024)
+
+    def fn():
+        for _ in range(10):
+            torch.mm(a, b)
+
+    return measure(fn, warmup=3, repeats=7)
+
+
+class Baseline(object):
+    def __init__(self, path, num_threads):
+        self.path = path
+        self.num_threads = num_threads
+        self.reference = measure_reference()
+        # thread count -> name -> relative timing
+        self.saved = {}
+        self.recorded = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.saved = json.load(f)['timings']
+        self.timings = self.saved.get(str(num_threads), {})
+
+    def check(self, name, fn, warmup=2, repeats=5):
+        """Time fn and compare it with the baseline of name."""
+        if not UPDATE_BASELINE and name not in self.timings:
+            pytest.skip('{} has no baseline with {} threads, record it with PERF_UPDATE_BASELINE=1'.format(
+                name, self.num_threads))
+
+        relative = measure(fn, warmup, repeats) / self.reference
+        if UPDATE_BASELINE:
+            self.recorded[name] = relative
+            return
+
+        limit = self.timings[name] * (1 + TOLERANCE)
+        print('{} : {:.2f} reference matmuls, baseline {:.2f}'.format(name, relative, self.timings[name]))
+        assert relative <= limit, '{} is {:.0f}% slower than its baseline ({:.2f} > {:.2f} reference matmuls)'.format(
+            name, (relative / self.timings[name] - 1) * 100, relative, self.timings[name])
+
+    def save(self):
+        timings = dict(self.timings)
+        timings.update(self.recorded)
+        saved = dict(self.saved)
+        saved[str(self.num_threads)] = dict(sorted(timings.items()))
+        with open(self.path, 'w') as f:
+            json.dump({
+                'torch': torch.__version__,
+                'unit': 'time / time of 10 1024x1024 matmuls',
+                'timings': dict(sorted(saved.items(), key=lambda item: int(item[0]))),
+            }, f, indent=2)
+            f.write('\n')
+
+
+@pytest.fixture(scope='session')
+def baseline():
+    torch.set_num_threads(NUM_THREADS)
+    torch.manual_seed(0)
+
+    baseline = Baseline(BASELINE_PATH, NUM_THREADS)
+    yield baseline
+
+    if UPDATE_BASELINE and baseline.recorded:
+        baseline.save()
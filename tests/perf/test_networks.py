@@ -0,0 +1,57 @@
+import pytest
+import torch
+
+from networks.Baseline import DigitsMU, DigitsStoM, ResNet50
+from networks.DANN import DANN
+from networks.MADA import MADA
+from networks.MCD import MCD
+from networks.MT import MT
+
+DIGITS_MU_INPUTS = (32, 1, 28, 28)
+DIGITS_STOM_INPUTS = (32, 3, 32, 32)
+OFFICE_INPUTS = (4, 3, 224, 224)
+
+# name -> (network builder, input size, forward of a training step)
+NETWORKS = {
+    'DigitsMU': (lambda: DigitsMU(n_classes=10), DIGITS_MU_INPUTS, lambda model, x: model(x)),
+    'DigitsStoM': (lambda: DigitsStoM(n_classes=10), DIGITS_STOM_INPUTS, lambda model, x: model(x)),
+    'ResNet50': (lambda: ResNet50(n_classes=31, pretrained=False), OFFICE_INPUTS, lambda model, x: model(x)),
+    'DANN_DigitsMU': (lambda: DANN(n_classes=10, base_model='DigitsMU'), DIGITS_MU_INPUTS,
+                      lambda model, x: model(x, alpha=1.0)),
+    'DANN_ResNet50': (lambda: DANN(n_classes=31, base_model='ResNet50', pretrained=False), OFFICE_INPUTS,
+                      lambda model, x: model(x, alpha=1.0)),
+    'MADA_DigitsMU': (lambda: MADA(n_classes=10, base_model='DigitsMU'), DIGITS_MU_INPUTS,
+                      lambda model, x: model(x, alpha=1.0)),
+    'MADA_ResNet50': (lambda: MADA(n_classes=31, base_model='ResNet50', pretrained=False), OFFICE_INPUTS,
+                      lambda model, x: model(x, alpha=1.0)),
+    'MCD_DigitsMU': (lambda: MCD(n_classes=10, base_model='DigitsMU'), DIGITS_MU_INPUTS,
+                     lambda model, x: model(x)),
+    'MCD_ResNet50': (lambda: MCD(n_classes=31, base_model='ResNet50', pretrained=False), OFFICE_INPUTS,
+                     lambda model, x: model(x)),
+    'MT_DigitsMU': (lambda: MT(n_classes=10, base_model='DigitsMU'), DIGITS_MU_INPUTS,
+                    lambda model, x: model(target_x1=x, target_x2=x, is_source=False)),
+    'MT_ResNet50': (lambda: MT(n_classes=31, base_model='ResNet50', pretrained=False), OFFICE_INPUTS,
+                    lambda model, x: model(target_x1=x, target_x2=x, is_source=False)),
+}
+
+
+def get_loss(outputs):
+    """Sum of every output with a graph, e.g. the teacher outputs of MT have none."""
+    if torch.is_tensor(outputs):
+        outputs = [outputs]
+    return sum(output.float().sum() for output in outputs if output.requires_grad)
+
+
+@pytest.mark.parametrize('name', list(NETWORKS.keys()))
+def test_forward_backward(name, baseline):
+    build, input_size, forward = NETWORKS[name]
+    model = build().train()
+    x = torch.randn(*input_size)
+
+    def step():
+        model.zero_grad()
+        get_loss(forward(model, x)).backward()
+
+    # a ResNet50 step is ~100 times a Digits one, fewer repeats keep the suite short
+    repeats = 3 if input_size == OFFICE_INPUTS else 10
+    baseline.check('forward_backward/' + name, step, warmup=1, repeats=repeats)
@@ -0,0 +1,36 @@
+import contextlib
+import io
+
+import pytest
+
+from benchmark_step import set_synthetic_dataloader
+from solvers.registry import get_solver_class
+
+BATCH_SIZE = 32
+ITERS = 5
+
+# Distill needs a trained teacher checkpoint, it is left out
+SOLVERS = ['Baseline', 'DANN', 'MADA', 'MCD', 'MMD', 'MT']
+
+
+@pytest.mark.parametrize('model', SOLVERS)
+def test_solver_step(model, baseline):
+    """ITERS training steps of a solver on synthetic MNIST -> USPS batches, a DigitsMU network."""
+    solver = get_solver_class(model)(
+        dataset_type='Digits',
+        source_domain='MNIST',
+        target_domain='USPS',
+        cuda='cpu',
+        batch_size=BATCH_SIZE,
+        num_workers=0,
+    )
+    solver.set_task()
+    solver.set_model()
+    solver.set_optimizer()
+    set_synthetic_dataloader(solver, BATCH_SIZE, ITERS)
+
+    def steps():
+        with contextlib.redirect_stdout(io.StringIO()):
+            solver.train_one_epoch()
+
+    baseline.check('solver_step/' + model, steps, warmup=1, repeats=5)